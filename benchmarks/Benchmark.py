@@ -0,0 +1,192 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+import polars as pl
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from Mock_Pdf_Server import MockPdfServer, ServerConfig
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, where the peak RSS is left out
+    resource = None
+
+
+# Peak resident set size of the current process in MB
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Nearest-rank percentile of a list of numbers
+def percentile(values: list, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+# Runs one FileHandler end to end. Called in a fresh process so the peak RSS and thread count belong to this run alone
+def run_handler(arguments: dict) -> dict:
+    from Polar_File_Handler import FileHandler
+
+    peak_threads = threading.active_count()
+    done = threading.Event()
+
+    def sample_threads():
+        nonlocal peak_threads
+        while not done.wait(0.01):
+            # The sampler itself is not counted
+            peak_threads = max(peak_threads, threading.active_count() - 1)
+
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+    file_handler = FileHandler(**arguments)
+    started = time.perf_counter()
+    file_handler.handler()
+    seconds = time.perf_counter() - started
+    done.set()
+    sampler.join()
+
+    statuses = file_handler.statuses.rows()
+    downloaded = [name for name, state in statuses if state == "yes"]
+    size = sum(os.path.getsize(os.path.join(arguments["destination"], name + ".pdf")) for name in downloaded)
+    return {
+        "seconds": seconds,
+        "succeeded": len(downloaded),
+        "failed": len(statuses) - len(downloaded),
+        "bytes": size,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_threads": peak_threads,
+        "tuned_threads": file_handler.tuner.workers if file_handler.tuner is not None else None,
+    }
+
+
+# Drives FileHandler.handler against the mock server for one engine and thread count and returns its figures.
+# Per file latency is measured on the server, from the first request for a file until its last byte was sent
+# duplicate_rate of the rows point at the url of another row and every url goes through redirect_hops redirects
+def benchmark(server: MockPdfServer, engine: str, threads, files: int, max_attempts: int, duplicate_rate: float = 0.0, redirect_hops: int = 0) -> dict:
+    server.log.reset()
+    prefix = f"redirect/{redirect_hops}/" if redirect_hops else ""
+    urls = [server.url(f"{prefix}reports/{int(i * (1 - duplicate_rate))}.pdf") for i in range(files)]
+    with tempfile.TemporaryDirectory() as work_dir:
+        url_file = os.path.join(work_dir, "urls.parquet")
+        pl.DataFrame(
+            {"BRnum": [str(i) for i in range(files)], "Pdf_URL": urls, "Report Html Address": [None] * files},
+            schema={"BRnum": pl.String, "Pdf_URL": pl.String, "Report Html Address": pl.String},
+        ).write_parquet(url_file)
+        arguments = {
+            "url_file": url_file,
+            "meta_file": os.path.join(work_dir, "meta.xlsx"),
+            "destination": os.path.join(work_dir, "files"),
+            "number_of_threads": threads,
+            "engine": engine,
+            # Every file comes from the same host, so the per host limits are lifted to the thread count
+            "per_host_limit": 64 if threads == "auto" else threads,
+            "rate_per_host": 1_000_000.0,
+            "max_attempts": max_attempts,
+            "export_xlsx": False,
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            figures = executor.submit(run_handler, arguments).result()
+
+    latencies = server.log.latencies()
+    seconds = figures["seconds"]
+    return {
+        "engine": engine,
+        "threads": threads,
+        "files": files,
+        **figures,
+        "files_per_second": figures["succeeded"] / seconds if seconds else None,
+        "mb_per_second": figures["bytes"] / (1024 * 1024) / seconds if seconds else None,
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "requests": sum(server.log.requests.values()),
+        "statuses": {str(status): count for status, count in sorted(server.log.statuses.items())},
+    }
+
+
+# Commit of the working tree, so results from different versions can be told apart
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the downloader end to end against a local mock pdf server")
+    parser.add_argument("--files", type=int, default=500, help="Number of files to download per run")
+    parser.add_argument("--threads", type=lambda value: value if value == "auto" else int(value), nargs="+", default=[10], help="Thread counts to compare, auto tunes it")
+    parser.add_argument("--engines", nargs="+", choices=["threads", "async"], default=["threads"], help="Engines to compare")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per engine and thread count")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Attempts per url")
+    parser.add_argument("--min-size", type=int, default=100 * 1024, help="Smallest file in bytes")
+    parser.add_argument("--max-size", type=int, default=2 * 1024 * 1024, help="Largest file in bytes")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the server answers")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--html-rate", type=float, default=0.0, help="Fraction of files served as html instead of pdf")
+    parser.add_argument("--drip-rate", type=float, default=0.0, help="Fraction of responses sent slowly")
+    parser.add_argument("--drip-speed", type=int, default=64 * 1024, help="Bytes per second of slow responses")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Fraction of rows that share the url of another row")
+    parser.add_argument("--redirect-hops", type=int, default=0, help="Redirects every url goes through")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the server's random choices")
+    parser.add_argument("--output", default="benchmark.json", help="File the results are written to as JSON")
+    args = parser.parse_args()
+
+    config = ServerConfig(
+        min_size=args.min_size,
+        max_size=args.max_size,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        html_rate=args.html_rate,
+        drip_rate=args.drip_rate,
+        drip_bytes_per_second=args.drip_speed,
+        seed=args.seed,
+    )
+    runs = []
+    with MockPdfServer(config) as server:
+        for engine in args.engines:
+            for threads in args.threads:
+                for _ in range(args.repeat):
+                    run = benchmark(server, engine, threads, args.files, args.max_attempts, args.duplicate_rate, args.redirect_hops)
+                    runs.append(run)
+                    print(
+                        f"{engine:>7} {threads:>4} threads: {run['files_per_second']:8.1f} files/s {run['mb_per_second']:8.1f} MB/s "
+                        f"p50 {run['latency_p50'] or 0:.3f}s p95 {run['latency_p95'] or 0:.3f}s p99 {run['latency_p99'] or 0:.3f}s "
+                        f"{run['succeeded']}/{run['files']} ok, peak {run['peak_threads']} threads"
+                        + (f", tuned to {run['tuned_threads']}" if run["tuned_threads"] is not None else "")
+                    )
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "server": config.as_dict(),
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
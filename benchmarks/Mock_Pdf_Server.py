@@ -0,0 +1,208 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+# Behaviour of the mock server. Rates are fractions of the requests in [0, 1], drawn independently for every request so
+# a retried request can succeed. The body of a file only depends on its path, so every request for it gets the same bytes
+class ServerConfig(object):
+
+    def __init__(
+        self,
+        min_size: int = 100 * 1024,
+        max_size: int = 2 * 1024 * 1024,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        html_rate: float = 0.0,
+        drip_rate: float = 0.0,
+        drip_bytes_per_second: int = 64 * 1024,
+        retry_after: int = 1,
+        seed: int = 0,
+    ) -> None:
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        # Seconds before the response headers are sent
+        self.latency = latency
+        # Answered with a 503
+        self.error_rate = error_rate
+        # Answered with a 429 and a Retry-After of retry_after seconds
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        # Answered with an html page instead of a pdf. Decided per file, so the same file is always html
+        self.html_rate = html_rate
+        # Sent slowly at drip_bytes_per_second
+        self.drip_rate = drip_rate
+        self.drip_bytes_per_second = drip_bytes_per_second
+        self.seed = seed
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+# Per file request log used for the latency figures: when the first request for a path arrived, when the last byte of
+# its last successful response was sent and how many requests it took
+class RequestLog(object):
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.first_request = {}
+        self.completed = {}
+        self.requests = {}
+        self.statuses = {}
+
+    def started(self, path: str) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.first_request.setdefault(path, now)
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def finished(self, path: str, status: int, delivered: bool = False) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if delivered:
+                self.completed[path] = now
+
+    # Seconds from the first request for a file until it was completely sent, for every file that was sent
+    def latencies(self) -> list:
+        with self.lock:
+            return [self.completed[path] - self.first_request[path] for path in self.completed]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.first_request.clear()
+            self.completed.clear()
+            self.requests.clear()
+            self.statuses.clear()
+
+
+class PdfRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        config = self.server.config
+        log = self.server.log
+        path = self.path.split("?")[0]
+        log.started(path)
+        if config.latency:
+            time.sleep(config.latency)
+
+        # /redirect/<hops>/<path> bounces through hops redirects before <path> is served, like a url shortener or a CDN
+        match = re.fullmatch(r"/redirect/(\d+)(/.*)", path)
+        if match:
+            hops = int(match.group(1))
+            return self.send_empty(302, {"Location": f"/redirect/{hops - 1}{match.group(2)}" if hops > 1 else match.group(2)})
+
+        draw = self.server.random()
+        if draw < config.rate_limit_rate:
+            return self.send_empty(429, {"Retry-After": str(config.retry_after)})
+        if draw < config.rate_limit_rate + config.error_rate:
+            return self.send_empty(503)
+
+        # Everything below only depends on the path
+        rng = random.Random(f"{config.seed}:{path}")
+        if rng.random() < config.html_rate:
+            return self.send_body(200, b"<html><body>Report not found</body></html>", "text/html")
+        body = self.server.body(path, rng.randint(config.min_size, config.max_size))
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            return self.send_empty(304, {"ETag": etag})
+
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        status = 200
+        start, end = 0, len(body) - 1
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match and self.headers.get("If-Range", etag) == etag:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            if start > end:
+                return self.send_empty(416, {"Content-Range": f"bytes */{len(body)}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+        drip = self.server.random() < config.drip_rate
+        self.send_body(status, body[start : end + 1], "application/pdf", headers, drip)
+
+    def send_empty(self, status: int, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.log.finished(self.path.split("?")[0], status)
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None, drip: bool = False) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            if drip:
+                step = max(self.server.config.drip_bytes_per_second // 10, 1)
+                for start in range(0, len(body), step):
+                    self.wfile.write(body[start : start + step])
+                    time.sleep(0.1)
+            else:
+                self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        self.server.log.finished(self.path.split("?")[0], status, content_type == "application/pdf")
+
+
+# Local HTTP server answering every GET with a synthetic pdf, shaped by a ServerConfig. Runs in a background thread:
+#
+#     with MockPdfServer(ServerConfig(latency=0.05)) as server:
+#         url = server.url("reports/1.pdf")
+class MockPdfServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: Optional[ServerConfig] = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__((host, port), PdfRequestHandler)
+        self.config = config if config is not None else ServerConfig()
+        self.log = RequestLog()
+        self.random_lock = threading.Lock()
+        self.rng = random.Random(self.config.seed)
+        self.thread = None
+        self.filler = None
+
+    def random(self) -> float:
+        with self.random_lock:
+            return self.rng.random()
+
+    # Every file is a slice of one shared block behind a header naming its path, which keeps memory flat while every
+    # file still has its own content and hash
+    def body(self, path: str, size: int) -> bytes:
+        header = b"%PDF-1.4\n% " + path.encode() + b"\n"
+        trailer = b"\n%%EOF\n"
+        if self.filler is None:
+            block = random.Random(self.config.seed).randbytes(4096)
+            self.filler = (block * (self.config.max_size // len(block) + 1))[: self.config.max_size]
+        return header + self.filler[: max(size - len(header) - len(trailer), 0)] + trailer
+
+    def url(self, path: str) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{path.lstrip('/')}"
+
+    def start(self) -> "MockPdfServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "MockPdfServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,412 @@
+import asyncio
+from collections import deque
+from concurrent.futures import Executor
+import hashlib
+import logging
+import os
+import socket
+import time
+from typing import Callable, Iterable, Optional
+from Downloader import (
+    CancelledTransferError,
+    DeadlineExceededError,
+    DownloadResult,
+    RetryPolicy,
+    SlowTransferError,
+    TruncatedTransferError,
+    check_pace,
+    classify_status,
+    preallocate,
+)
+from Circuit_Breaker import CircuitBreaker
+from Redirect_Cache import STALE_FAILURES, RedirectCache
+from Host_Scheduler import host_of, parse_retry_after
+from Pdf_Validation import LANDING_PAGE_BYTES, BadPdfError, NotPdfError, PdfValidator, extract_pdf_links
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed for the async engine, the threaded engine runs on requests alone
+    aiohttp = None
+
+
+# Maps aiohttp and asyncio errors onto the failure classes used by the threaded Downloader
+def classify_async_exception(error: BaseException) -> str:
+    if isinstance(error, TruncatedTransferError):
+        return "truncated"
+    if isinstance(error, SlowTransferError):
+        return "slow"
+    if isinstance(error, DeadlineExceededError):
+        return "deadline"
+    if isinstance(error, CancelledTransferError):
+        return "cancelled"
+    if isinstance(error, NotPdfError):
+        return "not_pdf"
+    if isinstance(error, BadPdfError):
+        return "bad_pdf"
+    if aiohttp is not None:
+        dns_error = getattr(aiohttp, "ClientConnectorDNSError", None)
+        if dns_error is not None and isinstance(error, dns_error):
+            return "dns"
+        if isinstance(error, aiohttp.ClientConnectorError):
+            return "dns" if isinstance(getattr(error, "os_error", None), socket.gaierror) else "connect"
+        if isinstance(error, aiohttp.ServerTimeoutError):
+            return "connect" if "connect" in str(error).lower() else "read_timeout"
+        if isinstance(error, (aiohttp.ClientPayloadError, aiohttp.ServerDisconnectedError)):
+            return "truncated"
+    if isinstance(error, asyncio.TimeoutError):
+        return "read_timeout"
+    return "other"
+
+
+# Class for downloading many files from a single event loop instead of one OS thread per download.
+# Takes the same (link, destination, name, alt_link) items as the threaded FileHandler queue
+class AsyncDownloader(object):
+
+    # max_concurrency caps the number of downloads in flight, per_host_limit caps how many of them hit the same host
+    # metrics is an optional DownloadMetrics that every download is reported to. validate_pdf, check_xref and
+    # max_landing_links work as for Downloader. Host names are cached by aiohttp's resolver for dns_ttl seconds, 0 or None
+    # turns the cache off, and the addresses of a host are raced with happy eyeballs after happy_eyeballs_delay seconds.
+    # circuit_breaker, min_transfer_rate, rate_grace, deadline, cancelled and redirect_cache work as for Downloader.
+    # A download abandoned for being slow is put back once and runs again without the rate floor after every other item
+    # was started. With result_executor on_result runs on that executor instead of the event loop, for results whose
+    # handling blocks, such as copying the file into an archive
+    def __init__(
+        self,
+        max_concurrency: int = 500,
+        per_host_limit: int = 8,
+        chunk_size: int = 64 * 1024,
+        timeout: int = 30,
+        retry_policy: Optional[RetryPolicy] = None,
+        metrics=None,
+        validate_pdf: bool = True,
+        check_xref: bool = False,
+        max_landing_links: int = 2,
+        dns_ttl: Optional[float] = 300.0,
+        happy_eyeballs_delay: Optional[float] = 0.25,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        min_transfer_rate: Optional[float] = None,
+        rate_grace: float = 10.0,
+        deadline: Optional[float] = None,
+        cancelled=None,
+        redirect_cache: Optional[RedirectCache] = None,
+        result_executor: Optional[Executor] = None,
+    ) -> None:
+        if aiohttp is None:
+            raise ImportError("The async engine requires aiohttp, install it with 'pip install aiohttp'")
+        self.max_concurrency = max(max_concurrency, 1)
+        self.per_host_limit = max(per_host_limit, 1)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.metrics = metrics
+        self.validate_pdf = validate_pdf
+        self.check_xref = check_xref
+        self.max_landing_links = max_landing_links
+        self.dns_ttl = dns_ttl
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.circuit_breaker = circuit_breaker
+        self.min_transfer_rate = min_transfer_rate
+        self.rate_grace = rate_grace
+        self.deadline = deadline
+        self.cancelled = cancelled
+        self.redirect_cache = redirect_cache
+        self.result_executor = result_executor
+        # Items abandoned for being slow wait here until the input is used up. skipped counts the items that were not
+        # started because the deadline had passed
+        self.requeued = deque()
+        self.slow_names = set()
+        self.skipped = 0
+        # Cap on the downloads in flight below max_concurrency, which set_limit may change from another thread while
+        # the downloads run. None means max_concurrency
+        self.limit = None
+        self.active = 0
+        self.loop = None
+        self.limit_changed = None
+
+    # Downloads every item and reports (name, "yes"/"no"), the download details and the DownloadResult to on_result as each
+    # download finishes. validators maps a name to the details of its earlier download and turns the request into a
+    # conditional one
+    def run(self, items: Iterable, on_result: Callable, validators: Optional[dict] = None) -> None:
+        self.validators = validators or {}
+        asyncio.run(self.download_all(items, on_result))
+
+    async def download_all(self, items: Iterable, on_result: Callable) -> None:
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.per_host_limit,
+            use_dns_cache=bool(self.dns_ttl),
+            ttl_dns_cache=int(self.dns_ttl) if self.dns_ttl else None,
+            happy_eyeballs_delay=self.happy_eyeballs_delay,
+        )
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[self.trace_config()]) as session:
+            # A fixed set of worker coroutines pull from one iterator, so the number of pending tasks never grows with the input
+            iterator = iter(items)
+            self.loop = asyncio.get_running_loop()
+            self.limit_changed = asyncio.Event()
+            try:
+                workers = [asyncio.create_task(self.worker(session, iterator, on_result)) for _ in range(self.max_concurrency)]
+                await asyncio.gather(*workers)
+            finally:
+                self.loop = None
+
+    # Changes the cap on the downloads in flight. Safe to call from any thread
+    def set_limit(self, limit: Optional[int]) -> None:
+        self.limit = limit
+        loop = self.loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self.limit_changed.set)
+            except RuntimeError:
+                # The run ended in the meantime
+                pass
+
+    # Waits until a download may start under the limit
+    async def acquire_slot(self) -> None:
+        while self.limit and self.active >= self.limit:
+            self.limit_changed.clear()
+            await self.limit_changed.wait()
+        self.active += 1
+
+    def release_slot(self) -> None:
+        self.active -= 1
+        self.limit_changed.set()
+
+    # Times name resolution and opening connections. Each request passes its DownloadResult as trace_request_ctx.
+    # aiohttp does not tell the TCP connect and the TLS handshake apart, so both count as connect
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def connect_start(session, context, params):
+            context.connect_started = time.perf_counter()
+            context.dns = 0.0
+
+        async def dns_start(session, context, params):
+            context.dns_started = time.perf_counter()
+
+        async def dns_end(session, context, params):
+            context.dns = time.perf_counter() - context.dns_started
+            if isinstance(context.trace_request_ctx, DownloadResult):
+                context.trace_request_ctx.timings["dns"] += context.dns
+
+        # Opening a connection includes the lookup, which is already counted as dns
+        async def connect_end(session, context, params):
+            if isinstance(context.trace_request_ctx, DownloadResult):
+                context.trace_request_ctx.timings["connect"] += max(time.perf_counter() - context.connect_started - context.dns, 0.0)
+
+        trace_config.on_connection_create_start.append(connect_start)
+        trace_config.on_dns_resolvehost_start.append(dns_start)
+        trace_config.on_dns_resolvehost_end.append(dns_end)
+        trace_config.on_connection_create_end.append(connect_end)
+        return trace_config
+
+    # Yields the items of the shared iterator, then the items put back for being slow. An iterator that fails ends the
+    # input instead of the run, so the downloads in flight still finish
+    def next_items(self, iterator):
+        try:
+            yield from iterator
+        except Exception:
+            logger.exception("Could not read the next item to download")
+        while self.requeued:
+            yield self.requeued.popleft()
+
+    async def worker(self, session, iterator, on_result: Callable) -> None:
+        for link, destination, name, alt_link in self.next_items(iterator):
+            if self.deadline is not None and time.monotonic() >= self.deadline or self.cancelled is not None and self.cancelled.is_set():
+                self.skipped += 1
+                continue
+            await self.acquire_slot()
+            try:
+                await self.download_item(session, link, destination, name, alt_link, on_result)
+            finally:
+                self.release_slot()
+
+    # Downloads one item and reports its status, or puts it back when it was abandoned for being slow
+    async def download_item(self, session, link, destination, name, alt_link, on_result: Callable) -> None:
+        path = os.path.join(destination, f"{name}.pdf")
+        started = self.metrics.started() if self.metrics is not None else None
+        rate_floor = name not in self.slow_names
+        try:
+            result = await self.download_handling(session, link, path, alt_link, self.validators.get(name), rate_floor)
+        except Exception:
+            logger.exception("Unexpected error while downloading %s", name)
+            result = DownloadResult()
+            result.failure = "other"
+        if result.failure == "cancelled":
+            if self.metrics is not None:
+                self.metrics.finished(name, result, started, completed=False)
+            return
+        if result.failure == "slow" and rate_floor:
+            self.slow_names.add(name)
+            self.requeued.append((link, destination, name, alt_link))
+            if self.metrics is not None:
+                self.metrics.finished(name, result, started, completed=False)
+            return
+        if self.metrics is not None:
+            self.metrics.finished(name, result, started)
+        if result:
+            await self.deliver(on_result, (name, "yes"), dict(result.details(), path=path), result)
+        else:
+            await self.deliver(on_result, (name, "no"), result.details(), result)
+
+    # Hands a finished download to on_result. On the result executor the other downloads go on while it runs, and the
+    # download keeps its slot until it is done so results can not pile up faster than they are handled. A result that
+    # can not be handled is logged, it must not end the other downloads
+    async def deliver(self, on_result: Callable, *arguments) -> None:
+        try:
+            if self.result_executor is None:
+                on_result(*arguments)
+            else:
+                await asyncio.get_running_loop().run_in_executor(self.result_executor, on_result, *arguments)
+        except Exception:
+            logger.exception("Could not handle the result of %s", arguments[0][0])
+
+    # Async counterpart of Downloader.download_handling. Tries the main url, then the alt url, then links to the pdf
+    # found on landing pages
+    async def download_handling(
+        self, session, url: str, destination_path: str, alt_url: Optional[str] = None, validators: Optional[dict] = None, rate_floor: bool = True
+    ) -> DownloadResult:
+        result = DownloadResult()
+        result.min_transfer_rate = self.min_transfer_rate if rate_floor else None
+        if validators and not (validators.get("archived") or os.path.exists(destination_path)):
+            validators = None
+        candidates = [(url, "primary"), (alt_url, "alt")]
+        tried = set()
+        for candidate, source in candidates:
+            if not candidate or candidate in tried:
+                continue
+            tried.add(candidate)
+            candidate_validators = validators if validators and validators.get("url") == candidate else None
+            host = host_of(candidate)
+            attempt = 0
+            while True:
+                if self.cancelled is not None and self.cancelled.is_set():
+                    result.failure = "cancelled"
+                    return result
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    result.failure = "deadline"
+                    return result
+                if self.circuit_breaker is not None and not self.circuit_breaker.allow(host):
+                    result.failure = "circuit_open"
+                    break
+                attempt += 1
+                result.attempts += 1
+                result.failure = None
+                result.content_length = None
+                answered = len(result.responses)
+                fetched = await self.fetch(session, candidate, destination_path, result, candidate_validators)
+                if self.circuit_breaker is not None:
+                    self.circuit_breaker.record(host, result.failure)
+                if fetched:
+                    result.url = candidate
+                    result.source = source
+                    result.success = True
+                    return result
+                if result.failure in ("slow", "deadline", "cancelled"):
+                    return result
+                if not self.retry_policy.should_retry(result.failure, attempt):
+                    break
+                # A 429 or 503 may say in Retry-After how long to wait, which only counts when this attempt got an answer
+                retry_after = result.responses[-1][3] if len(result.responses) > answered else None
+                await asyncio.sleep(self.retry_policy.delay(attempt, retry_after))
+            landing = sum(1 for _, kind in candidates if kind == "landing")
+            candidates.extend((link, "landing") for link in result.landing_links[: max(self.max_landing_links - landing, 0)])
+            result.landing_links = []
+        return result
+
+    # Streams a pdf response into a temporary file and renames it into place once the whole body has arrived.
+    # A 304 answer to a conditional request keeps the file already on disk. The body is sniffed instead of trusting
+    # the Content-Type, and an html page is searched for links to the pdf
+    async def fetch(self, session, url: str, destination_path: str, result: DownloadResult, validators: Optional[dict] = None) -> bool:
+        target = self.redirect_cache.resolve(url) if self.redirect_cache is not None else url
+        fetched = await self.fetch_from(session, target, url, destination_path, result, validators)
+        if not fetched and target != url and result.failure in STALE_FAILURES:
+            # The cached target no longer serves the file, so the redirects are followed again from the original url
+            self.redirect_cache.forget(url)
+            result.landing_links = []
+            return await self.fetch_from(session, url, url, destination_path, result, validators)
+        return fetched
+
+    # Requests url, which original redirected to in an earlier request or is original itself, and saves the body
+    async def fetch_from(self, session, url: str, original: str, destination_path: str, result: DownloadResult, validators: Optional[dict] = None) -> bool:
+        temp_path = destination_path + ".part"
+        headers = {}
+        if validators and validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators and validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        started = time.perf_counter()
+        opened = result.timings["dns"] + result.timings["connect"]
+        try:
+            async with session.get(url, headers=headers, trace_request_ctx=result) as response:
+                result.timings["ttfb"] += max(time.perf_counter() - started - (result.timings["dns"] + result.timings["connect"] - opened), 0.0)
+                result.responses.append((url, response.status, time.perf_counter() - started, parse_retry_after(response.headers.get("retry-after"))))
+                if headers and response.status == 304:
+                    result.not_modified = True
+                    for key in ("etag", "last_modified", "content_length", "sha256"):
+                        setattr(result, key, validators.get(key))
+                    return True
+                content_type = response.headers.get("content-type", "").lower()
+                accepted = "html" not in content_type if self.validate_pdf else "application/pdf" in content_type
+                if self.redirect_cache is not None and response.status == 200 and response.history:
+                    self.redirect_cache.record(original, str(response.url))
+                if response.status != 200 or not accepted:
+                    result.failure = classify_status(response.status) or "not_pdf"
+                    if response.status == 200 and "html" in content_type:
+                        result.landing_links = extract_pdf_links(await response.content.read(LANDING_PAGE_BYTES), str(response.url))
+                    return False
+                written = 0
+                digest = hashlib.sha256()
+                validator = PdfValidator() if self.validate_pdf else None
+                streamed = time.perf_counter()
+                writing = 0.0
+                encoded = "content-encoding" in response.headers
+                with open(temp_path, "wb") as file:
+                    preallocated = preallocate(file, None if encoded else response.content_length)
+                    try:
+                        async for chunk in response.content.iter_chunked(self.chunk_size):
+                            if validator is not None:
+                                try:
+                                    validator.feed(chunk)
+                                except NotPdfError as error:
+                                    # The rest of an html page is read to look for links to the pdf on it
+                                    if error.html:
+                                        error.head += await response.content.read(max(LANDING_PAGE_BYTES - len(error.head), 0))
+                                    raise
+                            check_pace(streamed, written, result.min_transfer_rate, self.rate_grace, self.deadline, self.cancelled)
+                            chunk_started = time.perf_counter()
+                            file.write(chunk)
+                            writing += time.perf_counter() - chunk_started
+                            digest.update(chunk)
+                            written += len(chunk)
+                    finally:
+                        if preallocated:
+                            file.truncate()
+                result.timings["write"] += writing
+                result.timings["transfer"] += time.perf_counter() - streamed - writing
+                result.bytes_received += written
+                if response.content_length is not None and not encoded and response.content_length != written:
+                    raise TruncatedTransferError(f"Truncated transfer: got {written} of {response.content_length} bytes")
+                if validator is not None:
+                    validator.finish()
+                    if self.check_xref:
+                        validator.check_xref(temp_path)
+                result.etag = response.headers.get("etag")
+                result.last_modified = response.headers.get("last-modified")
+            os.replace(temp_path, destination_path)
+            result.content_length = written
+            result.sha256 = digest.hexdigest()
+            return True
+        except Exception as error:
+            result.failure = classify_async_exception(error)
+            if isinstance(error, (SlowTransferError, DeadlineExceededError, CancelledTransferError)):
+                result.content_length = response.content_length
+            if isinstance(error, NotPdfError) and error.html:
+                result.landing_links = extract_pdf_links(error.head, url)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Failure classes that say the host itself is unreachable, as opposed to an answer the host gave
+HOST_FAILURES = {"dns", "connect", "read_timeout"}
+
+
+# Bookkeeping for one host. A circuit is closed while the host answers, open while requests to it fail fast, and
+# half-open once reset_timeout has passed, when one probe request is let through to find out whether it is back
+class CircuitState(object):
+
+    def __init__(self, reset_timeout: float) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.reset_timeout = reset_timeout
+        self.probing_since = None
+
+    def probe_due(self, now: float) -> bool:
+        if now < self.opened_at + self.reset_timeout:
+            return False
+        # A probe that never reported back does not keep the host blocked forever
+        return self.probing_since is None or now - self.probing_since >= self.reset_timeout
+
+
+# Per-host circuit breaker shared by every worker of a run. After failure_threshold consecutive connect failures or
+# timeouts against a host the circuit opens and the remaining downloads from that host fail at once instead of each
+# waiting for its own timeout. After reset_timeout seconds a single probe is let through. When the probe fails as well
+# the circuit stays open twice as long, up to max_reset_timeout, and any answer from the host closes it again
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, max_reset_timeout: float = 600.0) -> None:
+        self.failure_threshold = max(failure_threshold, 1)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    # Returns True when a request to host may be made. Takes the probe of a half-open circuit
+    def allow(self, host: str) -> bool:
+        if not host:
+            return True
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or state.opened_at is None:
+                return True
+            now = time.monotonic()
+            if not state.probe_due(now):
+                return False
+            state.probing_since = now
+            return True
+
+    # True while requests to host fail fast. Unlike allow it never takes the probe
+    def is_open(self, host: str) -> bool:
+        with self.lock:
+            state = self.hosts.get(host)
+            return state is not None and state.opened_at is not None and not state.probe_due(time.monotonic())
+
+    # Records the outcome of one request to host. failure is its failure class, None when it succeeded
+    def record(self, host: str, failure: Optional[str]) -> None:
+        if not host:
+            return
+        with self.lock:
+            state = self.hosts.get(host)
+            if failure not in HOST_FAILURES:
+                if state is not None:
+                    if state.opened_at is not None:
+                        logger.info("Circuit for %s closed again", host)
+                    del self.hosts[host]
+                return
+            if state is None:
+                state = self.hosts[host] = CircuitState(self.reset_timeout)
+            state.failures += 1
+            now = time.monotonic()
+            if state.probing_since is not None:
+                # The probe failed, so the host gets longer before the next one
+                state.reset_timeout = min(state.reset_timeout * 2, self.max_reset_timeout)
+                state.opened_at = now
+                state.probing_since = None
+            elif state.opened_at is None and state.failures >= self.failure_threshold:
+                state.opened_at = now
+                logger.warning("Circuit for %s opened after %d consecutive failures", host, state.failures)
+
+    # Hosts whose circuit is currently open or half-open
+    def open_hosts(self) -> list:
+        with self.lock:
+            return sorted(host for host, state in self.hosts.items() if state.opened_at is not None)
@@ -0,0 +1,132 @@
+import logging
+import math
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Finds the number of concurrent downloads at the knee of the files/s curve while a run is going. Every interval it
+# reads the aggregates of a DownloadMetrics and compares the files/s of the last window with the best window so far.
+# While more workers still pay off by at least gain it grows the count by growth, and once they stop paying off it
+# goes back to the best count and settles there. A window whose error rate is error_margin above the error rate of
+# the first window, or whose latency is latency_factor times the latency of the best window, halves the count at any
+# time, after which the count is probed again from there. apply is called with every new count and is meant to set
+# the limit of the engine
+class ConcurrencyTuner(object):
+
+    def __init__(
+        self,
+        metrics,
+        apply: Optional[Callable[[int], None]] = None,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        interval: float = 2.0,
+        min_samples: int = 20,
+        growth: float = 1.5,
+        gain: float = 0.05,
+        error_margin: float = 0.1,
+        latency_factor: float = 2.0,
+    ) -> None:
+        self.metrics = metrics
+        self.apply = apply
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.workers = min(max(initial, self.minimum), self.maximum)
+        self.interval = interval
+        self.min_samples = min_samples
+        self.growth = growth
+        self.gain = gain
+        self.error_margin = error_margin
+        self.latency_factor = latency_factor
+
+        self.settled = False
+        self.best_workers = None
+        self.best_rate = 0.0
+        self.best_latency = None
+        self.base_error_rate = None
+        self.window = None
+        # The window after a change still has downloads started under the old count, so it is only used to warm up
+        self.warming_up = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.stopped.clear()
+        self.window = self.sample()
+        self.thread = threading.Thread(target=self.run, name="concurrency-tuner", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.tick()
+
+    # The counters the windows are measured from
+    def sample(self) -> dict:
+        snapshot = self.metrics.snapshot()
+        return {
+            "elapsed": snapshot["elapsed"],
+            "completed": snapshot["completed"],
+            "failed": snapshot["failed"],
+            "seconds": snapshot["phase_seconds"].get("total", 0.0),
+        }
+
+    # Closes the current window once it holds min_samples downloads and adjusts the count. Returns the count
+    def tick(self) -> int:
+        current = self.sample()
+        completed = current["completed"] - self.window["completed"]
+        duration = current["elapsed"] - self.window["elapsed"]
+        if completed < self.min_samples or duration <= 0:
+            return self.workers
+        if self.warming_up:
+            self.warming_up = False
+            self.window = current
+            return self.workers
+        rate = completed / duration
+        error_rate = (current["failed"] - self.window["failed"]) / completed
+        latency = (current["seconds"] - self.window["seconds"]) / completed
+        self.window = current
+        return self.observe(rate, error_rate, latency)
+
+    # Adjusts the count to one window of rate files/s, error_rate failures per download and latency seconds per download
+    def observe(self, rate: float, error_rate: float, latency: float) -> int:
+        if self.base_error_rate is None:
+            self.base_error_rate = error_rate
+        if error_rate > self.base_error_rate + self.error_margin or (self.best_latency and latency > self.latency_factor * self.best_latency):
+            # The hosts are struggling, so the count backs off and the windows measured so far are no longer trusted
+            workers = max(self.minimum, self.workers // 2)
+            if workers != self.workers:
+                logger.info("Backing off to %d concurrent downloads: %.0f%% failed, %.2fs per download", workers, 100 * error_rate, latency)
+            self.best_workers = None
+            self.best_rate = 0.0
+            self.best_latency = None
+            self.settled = False
+            return self.set_workers(workers)
+        if self.settled:
+            return self.workers
+        if self.best_workers is None or rate > self.best_rate * (1 + self.gain):
+            self.best_workers = self.workers
+            self.best_rate = rate
+            self.best_latency = latency
+            if self.workers < self.maximum:
+                return self.set_workers(min(self.maximum, math.ceil(self.workers * self.growth)))
+        # More workers no longer pay off, or the maximum is reached
+        self.settled = True
+        logger.info("Concurrency settled at %d concurrent downloads (%.1f files/s)", self.best_workers, self.best_rate)
+        return self.set_workers(self.best_workers)
+
+    def set_workers(self, workers: int) -> int:
+        if workers != self.workers:
+            logger.debug("Concurrency changed from %d to %d", self.workers, workers)
+            self.warming_up = True
+        self.workers = workers
+        if self.apply is not None:
+            self.apply(workers)
+        return workers
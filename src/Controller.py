@@ -1,31 +1,173 @@
-from Polar_File_Handler import FileHandler
-from typing import Optional
+from Polar_File_Handler import FileHandler, run_sharded
+from Destination_Layout import LAYOUTS
+from Pdf_Archive import ARCHIVE_FORMATS
+from typing import Optional, Union
 import os
 import argparse
+import logging
 
 
 # Class for instantiating a download from a file into a given path.
 class Controller(object):
 
-    # Initiates the controller class with default values
-    def __init__(self) -> None:
+    # Initiates the controller class with default values. Paths that are not given default to the customer_data and
+    # files folders next to src
+    def __init__(
+        self,
+        shard: Optional[tuple] = None,
+        processes: Optional[int] = 1,
+        shard_by: Optional[str] = "id",
+        merge: Optional[list] = None,
+        url_file_name: Optional[Union[str, list]] = None,
+        report_file_name: Optional[str] = None,
+        destination: Optional[str] = None,
+        number_of_threads: Optional[Union[int, str]] = 10,
+        engine: Optional[str] = "threads",
+        max_threads: Optional[int] = 64,
+        verify: Optional[bool] = False,
+        layout: Optional[str] = "flat",
+        migrate: Optional[bool] = False,
+        archive: Optional[str] = None,
+        archive_shard_bytes: Optional[int] = 1024**3,
+    ) -> None:
         parent_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
         # Create a path for the "files" folder in the parent folder
         files_folder = os.path.join(parent_folder, "files")
         data_folder = os.path.join(parent_folder, "customer_data")
-        self.url_file_name = os.path.join(data_folder, "GRI_2017_2020.xlsx")
-        self.report_file_name = os.path.join(data_folder, "Metadata2017_2020.xlsx")
-        self.destination = files_folder
+        self.url_file_name = url_file_name or os.path.join(data_folder, "GRI_2017_2020.xlsx")
+        self.report_file_name = report_file_name or os.path.join(data_folder, "Metadata2017_2020.xlsx")
+        self.destination = destination or files_folder
+        # A number of threads, or "auto" to tune the number of concurrent downloads up to max_threads while running
+        self.number_of_threads = number_of_threads
+        self.engine = engine
+        self.max_threads = max_threads
+        # Runs only one shard of the url file, so the download can be split over several machines
+        self.shard = shard
+        self.processes = processes
+        self.shard_by = shard_by
+        # Status stores of other shards to merge into the meta workbook instead of downloading
+        self.merge = merge
+        # Checks the files already downloaded before downloading, so missing and corrupt ones are downloaded again
+        self.verify = verify
+        # How the files are spread over subdirectories of the destination, and whether files already downloaded are moved
+        # to it first
+        self.layout = layout
+        self.migrate = migrate
+        # Packs the downloads into archive shards of this format instead of keeping a file per download
+        self.archive = archive
+        self.archive_shard_bytes = archive_shard_bytes
 
     # Runs the filehandler
     def run(self):
+        if self.merge:
+            file_handler = FileHandler(self.url_file_name, self.report_file_name, self.destination, 1)
+            file_handler.status_store.merge(*self.merge)
+            file_handler.export_status_store()
+            return
+        if self.migrate or self.verify:
+            with FileHandler(self.url_file_name, self.report_file_name, self.destination, 1, shard=self.shard, shard_by=self.shard_by, layout=self.layout) as file_handler:
+                if self.migrate:
+                    file_handler.migrate_layout()
+                if self.verify:
+                    file_handler.verify()
+        if self.processes > 1:
+            run_sharded(
+                self.processes,
+                url_file=self.url_file_name,
+                meta_file=self.report_file_name,
+                destination=self.destination,
+                number_of_threads=self.number_of_threads,
+                engine=self.engine,
+                max_threads=self.max_threads,
+                shard_by=self.shard_by,
+                layout=self.layout,
+                archive=self.archive,
+                archive_shard_bytes=self.archive_shard_bytes,
+            )
+        else:
+            # A single shard of a run split over machines leaves the meta workbook to the merge
+            with FileHandler(
+                self.url_file_name,
+                self.report_file_name,
+                self.destination,
+                self.number_of_threads,
+                engine=self.engine,
+                max_threads=self.max_threads,
+                shard=self.shard,
+                shard_by=self.shard_by,
+                layout=self.layout,
+                archive=self.archive,
+                archive_shard_bytes=self.archive_shard_bytes,
+                export_xlsx=self.shard is None,
+            ) as file_handler:
+                file_handler.handler()
 
-        file_handler = FileHandler(self.url_file_name, self.report_file_name, self.destination, 1)
-        file_handler.handler()
+
+# Parses a shard given as "index/count", such as 0/4 for the first of four shards
+def parse_shard(value: str) -> tuple:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be given as index/count, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be between 0 and {count - 1}, got {value!r}")
+    return index, count
+
+
+# Parses the number of threads, a positive number or "auto"
+def parse_threads(value: str):
+    if value == "auto":
+        return value
+    try:
+        threads = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Threads must be a positive number or auto, got {value!r}")
+    if threads < 1:
+        raise argparse.ArgumentTypeError(f"Threads must be a positive number or auto, got {value!r}")
+    return threads
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Downloads the pdf reports listed in the url file")
+    parser.add_argument("-d", "--destination", help="Folder the pdf files are downloaded to")
+    parser.add_argument("-rf", "--report-file", help="Meta workbook the download statuses are reported in")
+    parser.add_argument("-uf", "--url-file", nargs="+", help="Files with the urls to download, downloaded one after the other")
+    parser.add_argument("-t", "--threads", type=parse_threads, default=10, help="Number of concurrent downloads, or auto to tune it while running")
+    parser.add_argument("--max-threads", type=int, default=64, help="Upper bound for the number of concurrent downloads with -t auto")
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads", help="Download with a thread per download or with asyncio")
+    parser.add_argument("--shard", type=parse_shard, help="Only download shard index/count of the url file, such as 0/4")
+    parser.add_argument("--processes", type=int, default=1, help="Number of processes to split the url file over")
+    parser.add_argument("--shard-by", choices=["id", "host"], default="id", help="Split the rows by id or by host")
+    parser.add_argument("--layout", choices=LAYOUTS, default="flat", help="Put the files straight into the destination or spread them over subdirectories")
+    parser.add_argument("--migrate", action="store_true", help="Move the files already downloaded to the layout first")
+    parser.add_argument("--archive", choices=ARCHIVE_FORMATS, help="Pack the downloads into archive shards instead of keeping a file per download")
+    parser.add_argument("--archive-shard-size", type=int, default=1024, help="Size in MB at which an archive shard is closed and the next one started")
+    parser.add_argument("--verify", action="store_true", help="Check the downloaded files first and download missing or corrupt ones again")
+    parser.add_argument("--merge", nargs="+", help="Status stores of finished shards to merge into the meta workbook")
+    return parser
 
 
 # My main function
 if __name__ == "__main__":
-    controller = Controller()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args = build_parser().parse_args()
+    url_file = args.url_file[0] if args.url_file and len(args.url_file) == 1 else args.url_file
+    controller = Controller(
+        args.shard,
+        args.processes,
+        args.shard_by,
+        args.merge,
+        url_file_name=url_file,
+        report_file_name=args.report_file,
+        destination=args.destination,
+        number_of_threads=args.threads,
+        engine=args.engine,
+        max_threads=args.max_threads,
+        verify=args.verify,
+        layout=args.layout,
+        migrate=args.migrate,
+        archive=args.archive,
+        archive_shard_bytes=args.archive_shard_size * 1024 * 1024,
+    )
     controller.run()
@@ -0,0 +1,89 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Optional
+from Disk_Manifest import list_pdfs
+
+logger = logging.getLogger(__name__)
+
+LAYOUTS = ("flat", "hash", "prefix")
+
+
+# Where the pdf of every id goes inside the destination. "flat" puts every file straight into the destination, which
+# slows every lookup down once it holds hundreds of thousands of files. "hash" spreads the files evenly over
+# subdirectories named after the first hex digits of a hash of the id, "prefix" groups them by the first characters of
+# the id so ids that sort together stay together. depth levels of width characters each, so the default 2 levels of
+# 2 hex digits make 65536 folders
+class DestinationLayout(object):
+
+    def __init__(self, destination: str, scheme: str = "flat", depth: int = 2, width: int = 2) -> None:
+        if scheme not in LAYOUTS:
+            raise ValueError(f"Unknown destination layout {scheme!r}, expected one of {', '.join(LAYOUTS)}")
+        self.destination = destination
+        self.scheme = scheme
+        self.depth = depth
+        self.width = width
+        # Folders already created, so a folder is only made once per run
+        self.created = set()
+        self.lock = threading.Lock()
+
+    # The subdirectories of the file of name, relative to the destination
+    def folders(self, name) -> list:
+        name = str(name)
+        if self.scheme == "flat":
+            return []
+        if self.scheme == "hash":
+            key = hashlib.md5(name.encode("utf-8")).hexdigest()
+        else:
+            # Ids shorter than the prefix are padded, characters that can not be part of a folder name are replaced
+            key = "".join(character if character.isalnum() or character in "-_" else "_" for character in name).ljust(self.depth * self.width, "_")
+        return [key[level * self.width : (level + 1) * self.width] for level in range(self.depth)]
+
+    # The folder the file of name goes in, created when it does not exist yet
+    def directory(self, name) -> str:
+        folders = self.folders(name)
+        if not folders:
+            return self.destination
+        directory = os.path.join(self.destination, *folders)
+        if directory not in self.created:
+            os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                self.created.add(directory)
+        return directory
+
+    def path(self, name) -> str:
+        return os.path.join(self.directory(name), f"{name}.pdf")
+
+    # Moves the pdfs anywhere in the destination, such as a flat folder from before, to where this layout puts them.
+    # Files are renamed, so nothing is copied as long as the destination is one file system. Returns the old and new
+    # path of every file moved
+    def migrate(self) -> list:
+        moved = []
+        for path, size, mtime_ns in list_pdfs(self.destination):
+            name = os.path.basename(path)[: -len(".pdf")]
+            target = os.path.join(self.destination, *self.folders(name), f"{name}.pdf")
+            if os.path.normpath(path) == os.path.normpath(target):
+                continue
+            self.directory(name)
+            if os.path.exists(target):
+                logger.warning("Not moving %s, %s already exists", path, target)
+                continue
+            os.replace(path, target)
+            moved.append((path, target))
+        self.remove_empty_folders()
+        return moved
+
+    # Removes the folders a migration left empty, such as those of an earlier layout
+    def remove_empty_folders(self, directory: Optional[str] = None) -> None:
+        directory = directory or self.destination
+        with os.scandir(directory) as entries:
+            folders = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+        for folder in folders:
+            self.remove_empty_folders(folder)
+            try:
+                os.rmdir(folder)
+            except OSError:
+                continue
+            with self.lock:
+                self.created.discard(folder)
@@ -0,0 +1,130 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import polars as pl
+from Pdf_Validation import PDF_EOF, PDF_MAGIC, SNIFF_BYTES, TAIL_BYTES, BadPdfError, PdfValidator
+
+# Failures verify records for downloads whose file is gone or damaged. They supersede the download recorded before them
+LOST_FAILURES = {"missing", "corrupt"}
+
+# Captures the id of a pdf from its path, which is the file name without .pdf
+PDF_NAME = r"([^/\\]+)\.pdf$"
+
+# Columns of the manifest next to the id column. mtime_ns and size tell whether a file changed since it was hashed
+MANIFEST_SCHEMA = {
+    "path": pl.String,
+    "size": pl.Int64,
+    "mtime_ns": pl.Int64,
+    "sha256": pl.String,
+    "valid": pl.Boolean,
+    "problem": pl.String,
+}
+
+
+# Hashes the file at path and checks that it looks like a complete pdf. The file is mapped into memory, so it is hashed
+# without being copied through Python buffers and the header and trailer checks only touch the pages they need.
+# Returns (path, size, mtime_ns, sha256, valid, problem)
+def inspect_file(path: str, check_xref: bool = False) -> tuple:
+    try:
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_size == 0:
+                return path, 0, stat.st_mtime_ns, hashlib.sha256().hexdigest(), False, "empty"
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                sha256 = hashlib.sha256(data).hexdigest()
+                problem = None
+                if data.find(PDF_MAGIC, 0, SNIFF_BYTES) == -1:
+                    problem = "no_header"
+                elif data.rfind(PDF_EOF, max(stat.st_size - TAIL_BYTES, 0)) == -1:
+                    problem = "no_trailer"
+                elif check_xref:
+                    validator = PdfValidator()
+                    validator.tail = data[-TAIL_BYTES:]
+                    try:
+                        validator.check_xref(path)
+                    except BadPdfError:
+                        problem = "bad_xref"
+        return path, stat.st_size, stat.st_mtime_ns, sha256, problem is None, problem
+    except (OSError, ValueError):
+        return path, None, None, None, False, "unreadable"
+
+
+def inspect_files(paths: list, check_xref: bool = False) -> list:
+    return [inspect_file(path, check_xref) for path in paths]
+
+
+# Every pdf under destination with its size and modification time. Files being downloaded or linked are not pdfs yet
+def list_pdfs(destination: str) -> list:
+    found = []
+    pending = [destination]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.name.endswith(".pdf") and entry.is_file():
+                    stat = entry.stat()
+                    found.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    return found
+
+
+# Manifest of the pdfs in a destination folder: the id, path, size, modification time and SHA-256 of every file and
+# whether it looks like a complete pdf. The manifest is kept in a Parquet file, and a later scan only hashes the files
+# whose size or modification time changed. Hashing is spread over processes processes, all cores when None
+class DiskManifest(object):
+
+    def __init__(self, path: str, processes: Optional[int] = None, check_xref: bool = False) -> None:
+        self.path = path
+        self.processes = processes or os.cpu_count() or 1
+        self.check_xref = check_xref
+        self.hashed = 0
+
+    def read(self, id_column: str) -> pl.DataFrame:
+        if not os.path.isfile(self.path):
+            return pl.DataFrame(schema={id_column: pl.String, **MANIFEST_SCHEMA})
+        return pl.read_parquet(self.path)
+
+    # Scans destination and writes the new manifest. Returns it with one row per pdf, named by its file name
+    def scan(self, destination: str, id_column: str) -> pl.DataFrame:
+        previous = {row[0]: row for row in self.read(id_column).select(MANIFEST_SCHEMA.keys()).iter_rows()}
+        rows = []
+        changed = []
+        for path, size, mtime_ns in list_pdfs(destination):
+            known = previous.get(path)
+            if known is not None and known[1] == size and known[2] == mtime_ns:
+                rows.append(known)
+            else:
+                changed.append(path)
+        rows.extend(self.inspect(changed))
+        self.hashed = len(changed)
+        manifest = pl.DataFrame(rows, schema=MANIFEST_SCHEMA, orient="row")
+        manifest = manifest.select(pl.col("path").str.extract(PDF_NAME, 1).alias(id_column), pl.all())
+        manifest.write_parquet(self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+        return manifest
+
+    # Takes files moved from one path to another over, given as (old path, new path), so they are not hashed again
+    def move(self, moved: list, id_column: str) -> None:
+        if not moved or not os.path.isfile(self.path):
+            return
+        paths = dict(moved)
+        manifest = self.read(id_column).with_columns(pl.col("path").replace(paths))
+        manifest.write_parquet(self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+    # Inspects the files in batches spread over the process pool. A handful of files is not worth starting processes for
+    def inspect(self, paths: list) -> list:
+        if self.processes < 2 or len(paths) < 4 * self.processes:
+            return inspect_files(paths, self.check_xref)
+        size = max(1, min(256, len(paths) // (4 * self.processes)))
+        batches = [paths[start : start + size] for start in range(0, len(paths), size)]
+        # Polars' thread pool deadlocks in forked children, so the workers are spawned
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return [row for batch in executor.map(inspect_files, batches, [self.check_xref] * len(batches)) for row in batch]
@@ -0,0 +1,159 @@
+import errno
+import os
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+
+# In-process cache of getaddrinfo answers shared by every worker. getaddrinfo does not tell the TTL of an answer, so
+# answers are kept for ttl seconds and lookups that failed for negative_ttl seconds. Concurrent lookups of the same
+# host wait for the first one instead of all asking the resolver
+class DnsCache(object):
+
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 60.0) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        # host -> (expires, addresses or the error of the failed lookup)
+        self.entries = {}
+        self.resolving = {}
+        self.lookups = 0
+        self.hits = 0
+
+    # Returns the getaddrinfo entries for host, with port filled into every address.
+    # Raises socket.gaierror when the host does not resolve, UnicodeError when it is not a valid host name
+    def resolve(self, host: str, port: Optional[int] = None) -> list:
+        while True:
+            with self.lock:
+                entry = self.entries.get(host)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    break
+                waiter = self.resolving.get(host)
+                if waiter is None:
+                    waiter = self.resolving[host] = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                waiter.wait()
+                continue
+            entry = None
+            # The waiters are woken up whatever happens, or every later lookup of host would wait forever
+            try:
+                answer = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+                entry = (time.monotonic() + self.ttl, answer)
+            except (UnicodeError, OSError) as error:
+                # Host names that fail IDNA encoding raise UnicodeError instead of socket.gaierror
+                entry = (time.monotonic() + self.negative_ttl, error)
+            finally:
+                with self.lock:
+                    self.lookups += 1
+                    if entry is not None:
+                        self.entries[host] = entry
+                    del self.resolving[host]
+                waiter.set()
+            break
+        answer = entry[1]
+        if isinstance(answer, Exception):
+            raise answer
+        return [(family, kind, protocol, name, (address[0], port or 0) + tuple(address[2:])) for family, kind, protocol, name, address in answer]
+
+    # True when the last lookup of host failed and has not expired yet
+    def is_dead(self, host: str) -> bool:
+        with self.lock:
+            entry = self.entries.get(host)
+        return entry is not None and entry[0] > time.monotonic() and isinstance(entry[1], Exception)
+
+    # Resolves every host in parallel before the downloads start and returns the ones that do not resolve
+    def prefetch(self, hosts: Iterable[str], workers: int = 32) -> set:
+        hosts = [host for host in set(hosts) if host]
+
+        def lookup(host):
+            try:
+                self.resolve(host)
+                return None
+            except (UnicodeError, OSError):
+                return host
+
+        if not hosts:
+            return set()
+        with ThreadPoolExecutor(min(workers, len(hosts))) as pool:
+            return {host for host in pool.map(lookup, hosts) if host is not None}
+
+
+# Orders addresses so the families alternate, starting with the family of the first answer, as RFC 8305 recommends
+def interleave_families(addresses: list) -> list:
+    if not addresses:
+        return []
+    first = addresses[0][0]
+    preferred = [address for address in addresses if address[0] == first]
+    others = [address for address in addresses if address[0] != first]
+    ordered = []
+    for index in range(max(len(preferred), len(others))):
+        ordered.extend(pair[index] for pair in (preferred, others) if index < len(pair))
+    return ordered
+
+
+# Connects to the first of addresses that answers. The next address is tried after delay seconds without giving
+# up on the earlier ones, so a dead IPv6 route costs delay instead of the whole connect timeout (happy eyeballs).
+# Raises socket.timeout when nothing connected within timeout and the last OSError when every address failed
+def happy_eyeballs_connect(addresses: list, timeout: Optional[float] = None, delay: float = 0.25, source_address=None, socket_options=None) -> socket.socket:
+    addresses = interleave_families(addresses)
+    if not addresses:
+        raise OSError("getaddrinfo returns an empty list")
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    selector = selectors.DefaultSelector()
+    pending = []
+    last_error = None
+    next_start = time.monotonic()
+    try:
+        while addresses or pending:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                raise socket.timeout("timed out")
+            if addresses and (now >= next_start or not pending):
+                family, kind, protocol, name, address = addresses.pop(0)
+                sock = socket.socket(family, kind, protocol)
+                try:
+                    for option in socket_options or ():
+                        sock.setsockopt(*option)
+                    if source_address:
+                        sock.bind(source_address)
+                    sock.setblocking(False)
+                    code = sock.connect_ex(address)
+                except OSError as error:
+                    sock.close()
+                    last_error = error
+                    continue
+                if code == 0:
+                    sock.settimeout(timeout)
+                    return sock
+                if code not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, "WSAEWOULDBLOCK", -1)):
+                    sock.close()
+                    last_error = OSError(code, os.strerror(code))
+                    continue
+                pending.append(sock)
+                selector.register(sock, selectors.EVENT_WRITE)
+                next_start = now + delay
+            # Waits for a connection to finish until it is time to start the next address or to give up
+            wake = [moment for moment in (next_start if addresses else None, deadline) if moment is not None]
+            wait = max(min(wake) - time.monotonic(), 0.0) if wake else None
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                pending.remove(sock)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code == 0:
+                    sock.settimeout(timeout)
+                    return sock
+                sock.close()
+                last_error = OSError(code, os.strerror(code))
+        raise last_error
+    finally:
+        for sock in pending:
+            sock.close()
+        selector.close()
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterable, Optional
+from Downloader import PHASES
+
+
+# Receives one event per finished download. Subclasses decide where the events go
+class MetricsHook(object):
+
+    # Called once by the DownloadMetrics the hook is given to, so the hook can read the live aggregates
+    def attach(self, metrics) -> None:
+        self.metrics = metrics
+
+    def record(self, event: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# Appends every event as a line of JSON to a trace file
+class JsonlMetricsHook(MetricsHook):
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def record(self, event: dict) -> None:
+        line = json.dumps(event, default=str) + "\n"
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf-8")
+            self.file.write(line)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# Publishes the aggregates in the Prometheus text format, written to a file every interval seconds and when the run
+# ends, and served on http://host:port/metrics when a port is given
+class PrometheusMetricsHook(MetricsHook):
+
+    def __init__(self, path: Optional[str] = None, port: Optional[int] = None, host: str = "127.0.0.1", interval: float = 5.0) -> None:
+        self.path = path
+        self.interval = interval
+        self.last_write = 0.0
+        self.lock = threading.Lock()
+        self.server = None
+        if port is not None:
+            hook = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def log_message(self, format, *args) -> None:
+                    pass
+
+                def do_GET(self) -> None:
+                    body = hook.metrics.prometheus_text().encode()
+                    self.send_response(200 if self.path.split("?")[0] == "/metrics" else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            self.server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def record(self, event: dict) -> None:
+        if self.path is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_write < self.interval:
+                return
+            self.last_write = now
+        self.write()
+
+    # The file is replaced in one step so a scraper never reads half of it
+    def write(self) -> None:
+        if self.path is None:
+            return
+        with self.lock:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+                file.write(self.metrics.prometheus_text())
+            os.replace(self.path + ".tmp", self.path)
+
+    def close(self) -> None:
+        self.write()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+# Live aggregates of a run: downloads in flight, queue depth, completed files, bytes and the time spent in every phase.
+# Every finished download is handed to the hooks as an event with its phase timings, bytes, attempts and source url
+class DownloadMetrics(object):
+
+    def __init__(self, hooks: Optional[Iterable[MetricsHook]] = None) -> None:
+        self.hooks = list(hooks or [])
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.in_flight = 0
+        self.completed = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.bytes = 0
+        self.phase_seconds = dict.fromkeys(PHASES + ("total",), 0.0)
+        # Set by the engine to a function returning the number of downloads waiting to start
+        self.queue_depth: Optional[Callable[[], int]] = None
+        for hook in self.hooks:
+            hook.attach(self)
+
+    # Starts the clock the rates are measured against and clears the counts of an earlier run
+    def start(self) -> None:
+        with self.lock:
+            self.started_at = time.monotonic()
+            self.completed = 0
+            self.succeeded = 0
+            self.failed = 0
+            self.bytes = 0
+            self.phase_seconds = dict.fromkeys(PHASES + ("total",), 0.0)
+
+    # Marks a download as started and returns the time it started, to be handed back to finished
+    def started(self) -> float:
+        with self.lock:
+            self.in_flight += 1
+        return time.monotonic()
+
+    # Records a finished download. result is the DownloadResult of the download. A download that is not completed was
+    # abandoned to be tried again later, so its bytes and time count but not the download itself
+    def finished(self, name, result, started: float, completed: bool = True) -> None:
+        event = result.metrics()
+        event["id"] = name
+        event["total"] = time.monotonic() - started
+        event["completed"] = completed
+        with self.lock:
+            self.in_flight -= 1
+            if completed:
+                self.completed += 1
+                if event["success"]:
+                    self.succeeded += 1
+                else:
+                    self.failed += 1
+            self.bytes += event["bytes"]
+            for phase in self.phase_seconds:
+                self.phase_seconds[phase] += event.get(phase) or 0.0
+        for hook in self.hooks:
+            hook.record(event)
+
+    def snapshot(self) -> dict:
+        queue_depth = self.queue_depth() if self.queue_depth is not None else None
+        with self.lock:
+            elapsed = time.monotonic() - self.started_at
+            return {
+                "elapsed": elapsed,
+                "in_flight": self.in_flight,
+                "queue_depth": queue_depth,
+                "completed": self.completed,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "files_per_second": self.completed / elapsed if elapsed else 0.0,
+                "bytes_per_second": self.bytes / elapsed if elapsed else 0.0,
+                "phase_seconds": dict(self.phase_seconds),
+            }
+
+    def prometheus_text(self) -> str:
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE pdf_downloads_in_flight gauge",
+            f"pdf_downloads_in_flight {snapshot['in_flight']}",
+            "# TYPE pdf_downloads_total counter",
+            f'pdf_downloads_total{{result="success"}} {snapshot["succeeded"]}',
+            f'pdf_downloads_total{{result="failure"}} {snapshot["failed"]}',
+            "# TYPE pdf_download_bytes_total counter",
+            f"pdf_download_bytes_total {snapshot['bytes']}",
+            "# TYPE pdf_download_bytes_per_second gauge",
+            f"pdf_download_bytes_per_second {snapshot['bytes_per_second']:.3f}",
+            "# TYPE pdf_downloads_per_second gauge",
+            f"pdf_downloads_per_second {snapshot['files_per_second']:.3f}",
+            "# TYPE pdf_download_phase_seconds_total counter",
+        ]
+        lines += [f'pdf_download_phase_seconds_total{{phase="{phase}"}} {seconds:.6f}' for phase, seconds in snapshot["phase_seconds"].items()]
+        if snapshot["queue_depth"] is not None:
+            lines += ["# TYPE pdf_download_queue_depth gauge", f"pdf_download_queue_depth {snapshot['queue_depth']}"]
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        for hook in self.hooks:
+            hook.close()
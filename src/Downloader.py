@@ -1,47 +1,856 @@
 import requests
+import hashlib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NameResolutionError, NewConnectionError, ProtocolError, ReadTimeoutError
 from typing import Optional
+from Host_Scheduler import host_of, parse_retry_after
+from Circuit_Breaker import CircuitBreaker
+from Dns_Cache import DnsCache, happy_eyeballs_connect
+from Redirect_Cache import STALE_FAILURES, RedirectCache
+from Pdf_Validation import LANDING_PAGE_BYTES, BadPdfError, NotPdfError, PdfValidator, extract_pdf_links, looks_like_html
+
+# Phases of a download timed for every file. dns, connect and tls are only spent when a new connection is opened,
+# ttfb is the wait from sending the request until the response headers, transfer the time spent receiving the body
+# and write the time spent writing it to disk
+PHASES = ("dns", "connect", "tls", "ttfb", "transfer", "write")
+
+# Connection phases of the request the current thread is making. Connections are opened by the thread that sends the
+# request, so the timed connections below leave their phases here for Downloader.download to pick up
+phase_local = threading.local()
+
+
+# Returns the connection phases recorded by the current thread since the last call and starts over
+def take_connection_phases() -> dict:
+    phases = getattr(phase_local, "phases", None)
+    phase_local.phases = {}
+    return phases or {}
+
+
+def record_connection_phase(phase: str, seconds: float) -> None:
+    phases = getattr(phase_local, "phases", None)
+    if phases is None:
+        phases = phase_local.phases = {}
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+# Connection that times name resolution, the TCP connect and the TLS handshake separately. The host is resolved once
+# and every address is tried in turn, the way urllib3 does it, so timing the lookup does not cost a second lookup.
+# Subclasses made by timed_pool_classes resolve through a DnsCache shared by every worker and race the addresses of
+# both families with happy eyeballs instead of trying them one after the other
+class TimedConnectionMixin(object):
+    dns_cache: Optional[DnsCache] = None
+    happy_eyeballs_delay: Optional[float] = None
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        try:
+            if self.dns_cache is not None:
+                addresses = self.dns_cache.resolve(self._dns_host, self.port)
+            else:
+                addresses = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError) as error:
+            raise NameResolutionError(self.host, self, error) from error
+        finally:
+            resolved = time.perf_counter()
+            record_connection_phase("dns", resolved - started)
+        if self.happy_eyeballs_delay is not None:
+            try:
+                return self.race_addresses(addresses)
+            finally:
+                record_connection_phase("connect", time.perf_counter() - resolved)
+                self.open_seconds = time.perf_counter() - started
+        dns_host = self._dns_host
+        try:
+            for index, (family, kind, protocol, name, address) in enumerate(addresses):
+                self._dns_host = address[0]
+                try:
+                    return super()._new_conn()
+                except (ConnectTimeoutError, NewConnectionError):
+                    if index == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+            record_connection_phase("connect", time.perf_counter() - resolved)
+            self.open_seconds = time.perf_counter() - started
+
+    # Opens the socket with happy eyeballs and raises the errors urllib3 raises for a failed connect
+    def race_addresses(self, addresses: list):
+        timeout = self.timeout if isinstance(self.timeout, (int, float)) else None
+        try:
+            sock = happy_eyeballs_connect(addresses, timeout, self.happy_eyeballs_delay, self.source_address, self.socket_options)
+        except socket.timeout as error:
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. (connect timeout={timeout})") from error
+        except OSError as error:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {error}") from error
+        sys.audit("http.client.connect", self, self.host, self.port)
+        return sock
+
+    # Whatever connect spends beyond opening the socket is the TLS handshake
+    def connect(self) -> None:
+        started = time.perf_counter()
+        self.open_seconds = 0.0
+        super().connect()
+        if isinstance(self, HTTPSConnection):
+            record_connection_phase("tls", max(time.perf_counter() - started - self.open_seconds, 0.0))
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+# Pool classes whose connections resolve through dns_cache and connect with happy eyeballs after happy_eyeballs_delay
+# seconds. The cache is bound to subclasses because the pool manager only passes hashable settings to its pools
+def timed_pool_classes(dns_cache: Optional[DnsCache] = None, happy_eyeballs_delay: Optional[float] = None) -> dict:
+    if dns_cache is None and happy_eyeballs_delay is None:
+        return {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+    settings = {"dns_cache": dns_cache, "happy_eyeballs_delay": happy_eyeballs_delay}
+    http_connection = type("CachedHTTPConnection", (TimedHTTPConnection,), settings)
+    https_connection = type("CachedHTTPSConnection", (TimedHTTPSConnection,), settings)
+    return {
+        "http": type("CachedHTTPConnectionPool", (TimedHTTPConnectionPool,), {"ConnectionCls": http_connection}),
+        "https": type("CachedHTTPSConnectionPool", (TimedHTTPSConnectionPool,), {"ConnectionCls": https_connection}),
+    }
+
+
+# Transport adapter that keeps one connection pool per host and remembers how many connections each pool opened
+# so a run can report how many requests were served over a reused keep-alive connection
+class PooledAdapter(HTTPAdapter):
+
+    def __init__(self, pool_connections: int = 100, pool_maxsize: int = 10, dns_cache: Optional[DnsCache] = None, happy_eyeballs_delay: Optional[float] = None) -> None:
+        self.pool_classes = timed_pool_classes(dns_cache, happy_eyeballs_delay)
+        self.stats_lock = threading.Lock()
+        self.retired_requests = 0
+        self.retired_connections = 0
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.pool_classes)
+        # Host pools evicted from the pool manager are counted before they are closed
+        self.poolmanager.pools.dispose_func = self.retire_pool
+
+    def retire_pool(self, pool) -> None:
+        with self.stats_lock:
+            self.retired_requests += pool.num_requests
+            self.retired_connections += pool.num_connections
+        pool.close()
+
+    # Returns the number of requests, opened connections and reused connections over the lifetime of the adapter
+    def connection_stats(self) -> dict:
+        pools = self.poolmanager.pools
+        with self.stats_lock:
+            requests_sent = self.retired_requests
+            connections = self.retired_connections
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        return {"requests": requests_sent, "connections": connections, "reused": max(requests_sent - connections, 0)}
+
+
+# Creates a session whose connection pools are shared by every worker. pool_size should match the number of threads
+# so no worker has to open a throwaway connection because the host pool was full. Host names are resolved through
+# dns_cache when one is given, and happy_eyeballs_delay turns on happy eyeballs for hosts with several addresses
+def create_session(pool_size: int = 10, max_hosts: int = 100, dns_cache: Optional[DnsCache] = None, happy_eyeballs_delay: Optional[float] = None) -> requests.Session:
+    session = requests.Session()
+    adapter = PooledAdapter(pool_connections=max_hosts, pool_maxsize=max(pool_size, 1), dns_cache=dns_cache, happy_eyeballs_delay=happy_eyeballs_delay)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Sums the connection stats of every pooled adapter mounted on the session
+def connection_stats(session: requests.Session) -> dict:
+    stats = {"requests": 0, "connections": 0, "reused": 0}
+    for adapter in set(session.adapters.values()):
+        if isinstance(adapter, PooledAdapter):
+            for key, value in adapter.connection_stats().items():
+                stats[key] += value
+    return stats
+
+
+# Failure classes recorded next to pdf_downloaded. Retryable ones are tried again within a run,
+# permanent ones will fail the same way on the next run too. "circuit_open" marks a url skipped because its host stopped
+# answering, "slow" a transfer below the rate floor, "deadline" one cut off by the deadline of the run and "cancelled"
+# one cut off by cancelling the run. They are neither and are simply tried again later
+RETRYABLE_FAILURES = {"connect", "read_timeout", "http_429", "http_5xx", "truncated"}
+PERMANENT_FAILURES = {"http_4xx", "not_pdf", "bad_pdf"}
+
+
+# Raised when a body ends before Content-Length bytes arrived
+class TruncatedTransferError(IOError):
+    pass
+
+
+# Raised when a transfer is slower than the rate floor, so it can be put back at the end of the run
+class SlowTransferError(IOError):
+    pass
+
+
+# Raised when the deadline of the run passes during a transfer
+class DeadlineExceededError(IOError):
+    pass
+
+
+# Raised when the run is cancelled during a transfer
+class CancelledTransferError(IOError):
+    pass
+
+
+# Abandons a transfer that is past deadline, a time.monotonic() value, or that is slower than min_rate bytes per second
+# once grace seconds have passed since streamed, a time.perf_counter() value. received is the bytes received since then.
+# A transfer is also abandoned once the cancelled event is set
+def check_pace(streamed: float, received: int, min_rate: Optional[float], grace: float, deadline: Optional[float], cancelled: Optional[threading.Event] = None) -> None:
+    if cancelled is not None and cancelled.is_set():
+        raise CancelledTransferError("The run was cancelled during the transfer")
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceededError("The deadline of the run passed during the transfer")
+    if min_rate:
+        elapsed = time.perf_counter() - streamed
+        if elapsed >= grace and received < min_rate * elapsed:
+            raise SlowTransferError(f"Transfer rate {received / elapsed:.0f} B/s is below the floor of {min_rate:.0f} B/s")
+
+
+# Reserves size bytes on disk for a file about to be written, so the file system can place it in one piece instead of
+# growing it chunk by chunk. The file takes that size at once, so a writer that stops short has to truncate it to what
+# it wrote. Returns False where the platform or the file system can not reserve space
+def preallocate(file, size: Optional[int]) -> bool:
+    if not size or not hasattr(os, "posix_fallocate"):
+        return False
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+    except OSError:
+        return False
+    return True
+
+
+# Classifies an exception raised while requesting or reading a response
+def classify_exception(error: BaseException) -> str:
+    if isinstance(error, TruncatedTransferError):
+        return "truncated"
+    if isinstance(error, SlowTransferError):
+        return "slow"
+    if isinstance(error, DeadlineExceededError):
+        return "deadline"
+    if isinstance(error, CancelledTransferError):
+        return "cancelled"
+    if isinstance(error, NotPdfError):
+        return "not_pdf"
+    if isinstance(error, BadPdfError):
+        return "bad_pdf"
+    # requests wraps the urllib3 error that tells what actually went wrong, so the whole chain is searched
+    seen = set()
+    pending = [error]
+    while pending:
+        cause = pending.pop()
+        if cause is None or id(cause) in seen:
+            continue
+        seen.add(id(cause))
+        if isinstance(cause, (NameResolutionError, socket.gaierror)):
+            return "dns"
+        if isinstance(cause, (ConnectTimeoutError, requests.exceptions.ConnectTimeout)):
+            return "connect"
+        if isinstance(cause, (ReadTimeoutError, requests.exceptions.ReadTimeout)):
+            return "read_timeout"
+        pending.extend([getattr(cause, "reason", None), cause.__cause__, cause.__context__])
+        pending.extend(arg for arg in getattr(cause, "args", ()) if isinstance(arg, BaseException))
+    if isinstance(error, (requests.exceptions.ChunkedEncodingError, ProtocolError)):
+        return "truncated"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "connect"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "read_timeout"
+    return "other"
+
+
+# Classifies an HTTP status code, returns None for statuses that are not failures
+def classify_status(status_code: int) -> Optional[str]:
+    if status_code == 429:
+        return "http_429"
+    if status_code >= 500:
+        return "http_5xx"
+    if status_code >= 400:
+        return "http_4xx"
+    return None
+
+
+# Decides whether and when a failed request is tried again. One policy is shared by all workers of a run
+# so the retry budget caps the extra requests of the whole run
+class RetryPolicy(object):
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30.0, budget: Optional[int] = None) -> None:
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.lock = threading.Lock()
+
+    # attempt is the number of attempts already made. Takes one retry from the budget when the answer is yes
+    def should_retry(self, failure: Optional[str], attempt: int) -> bool:
+        if failure not in RETRYABLE_FAILURES or attempt >= self.max_attempts:
+            return False
+        with self.lock:
+            if self.budget is not None:
+                if self.budget <= 0:
+                    return False
+                self.budget -= 1
+        return True
+
+    # Exponential backoff with full jitter, but never sooner than the server asked for with Retry-After
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+# Outcome of a single download_handling call. Evaluates to True when the file is on disk, so it can be used like the
+# bool download_handling used to return. The validators and hash are kept so the next run can revalidate the file
+class DownloadResult(object):
+
+    def __init__(self) -> None:
+        self.success = False
+        self.url = None
+        self.not_modified = False
+        self.etag = None
+        self.last_modified = None
+        self.content_length = None
+        self.sha256 = None
+        # Class of the last failure and the number of requests made over all urls
+        self.failure = None
+        self.attempts = 0
+        # (url, status code, seconds until the headers arrived, Retry-After seconds) for every request made
+        self.responses = []
+        # Seconds spent in every phase and bytes received, summed over all requests. source is "primary" or "alt"
+        # depending on which url the file came from
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.bytes_received = 0
+        self.source = None
+        # Links to the pdf found on an html page returned instead of it, tried after the given urls
+        self.landing_links = []
+        # Bytes per second a transfer has to keep up, None for no floor
+        self.min_transfer_rate = None
+
+    def __bool__(self) -> bool:
+        return self.success
+
+    # The fields that are stored in the status journal next to pdf_downloaded
+    def details(self) -> dict:
+        if not self.success:
+            # The size of a file that was cut off is kept, so the next run can schedule it by size
+            if self.content_length is not None:
+                return {"failure": self.failure, "attempts": self.attempts, "content_length": self.content_length}
+            return {"failure": self.failure, "attempts": self.attempts}
+        return {
+            "url": self.url,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "content_length": self.content_length,
+            "sha256": self.sha256,
+            "attempts": self.attempts,
+        }
+
+    # The fields reported to the download metrics
+    def metrics(self) -> dict:
+        return dict(self.timings, success=self.success, url=self.url, source=self.source, attempts=self.attempts, bytes=self.bytes_received, failure=self.failure)
 
 
 # Class for handling a single download. The function main functionality is to take an url and download it into the path
 class Downloader(object):
 
-    # uses a url link and a destination to download a file. Optionally one can use an alt url if applicaple
-    # Returns success is file got downlaoded
-    def download_handling(self, url: str, destination_path: str, alt_url: Optional[str] = None) -> bool:
-        success = False
+    # A session can be shared between downloaders so connections are kept alive across downloads.
+    # chunk_size bounds how much of a response body is held in memory at once. Files of at least parallel_threshold
+    # bytes are fetched as parallel_ranges concurrent range requests when the server supports it.
+    # With validate_pdf a body is only kept when it starts with the pdf header and ends with the %%EOF trailer, whatever
+    # its Content-Type says, and check_xref also checks that the trailer points at a cross-reference table. Up to
+    # max_landing_links links to a pdf found on html pages returned instead of one are tried after the given urls.
+    # A url on a host whose circuit_breaker circuit is open fails with "circuit_open" without a request. A transfer slower
+    # than min_transfer_rate bytes per second after rate_grace seconds is abandoned, and no transfer runs past deadline,
+    # a time.monotonic() value, or goes on once the cancelled event is set. Requests for urls in redirect_cache go straight
+    # to where they redirected to before
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        chunk_size: int = 64 * 1024,
+        retry_policy: Optional[RetryPolicy] = None,
+        parallel_ranges: int = 1,
+        parallel_threshold: int = 64 * 1024 * 1024,
+        validate_pdf: bool = True,
+        check_xref: bool = False,
+        max_landing_links: int = 2,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        min_transfer_rate: Optional[float] = None,
+        rate_grace: float = 10.0,
+        deadline: Optional[float] = None,
+        cancelled: Optional[threading.Event] = None,
+        redirect_cache: Optional[RedirectCache] = None,
+    ) -> None:
+        self.session = session if session is not None else create_session(1)
+        self.chunk_size = chunk_size
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.parallel_ranges = parallel_ranges
+        self.parallel_threshold = parallel_threshold
+        self.validate_pdf = validate_pdf
+        self.check_xref = check_xref
+        self.max_landing_links = max_landing_links
+        self.circuit_breaker = circuit_breaker
+        self.min_transfer_rate = min_transfer_rate
+        self.rate_grace = rate_grace
+        self.deadline = deadline
+        self.cancelled = cancelled
+        self.redirect_cache = redirect_cache
+
+    # uses a url link and a destination to download a file. Optionally one can use an alt url if applicaple.
+    # validators are the details stored by an earlier download of the same file, used to make a conditional request
+    # Returns a DownloadResult that is truthy if the file got downlaoded or is unchanged on the server.
+    # A transfer abandoned for being slow, for the deadline or by cancelling returns at once, without trying the other urls, and
+    # rate_floor=False lets a download that was abandoned for being slow before run at any speed
+    def download_handling(self, url: str, destination_path: str, alt_url: Optional[str] = None, validators: Optional[dict] = None, rate_floor: bool = True) -> DownloadResult:
+        result = DownloadResult()
         if not url and not alt_url:
-            return success
-        # Tries downloading with the main url
-        fileDownloaded, response = self.download(url)
+            return result
+        result.min_transfer_rate = self.min_transfer_rate if rate_floor else None
+        # A conditional request only makes sense while the earlier copy is still on disk or in the archive
+        if validators and not (validators.get("archived") or os.path.exists(destination_path)):
+            validators = None
+
+        # Links found on landing pages are added to the end of the candidates as they turn up
+        candidates = [(url, "primary"), (alt_url, "alt")]
+        tried = set()
+        for candidate, source in candidates:
+            if not candidate or candidate in tried:
+                continue
+            tried.add(candidate)
+            candidate_validators = validators if validators and validators.get("url") == candidate else None
+            host = host_of(candidate)
+            attempt = 0
+            while True:
+                if self.cancelled is not None and self.cancelled.is_set():
+                    result.failure = "cancelled"
+                    return result
+                if self.deadline is not None and time.monotonic() >= self.deadline:
+                    result.failure = "deadline"
+                    return result
+                if self.circuit_breaker is not None and not self.circuit_breaker.allow(host):
+                    result.failure = "circuit_open"
+                    break
+                attempt += 1
+                result.attempts += 1
+                result.failure = None
+                result.content_length = None
+                downloaded = self.attempt(candidate, destination_path, candidate_validators, result)
+                # Ranges of a parallel download stop when the circuit opened in the meantime, which says nothing new
+                if self.circuit_breaker is not None and result.failure != "circuit_open":
+                    self.circuit_breaker.record(host, result.failure)
+                if downloaded:
+                    result.source = source
+                    return result
+                if result.failure in ("slow", "deadline", "cancelled"):
+                    return result
+                # Only failures that may go away are retried, everything else moves straight on to the alternative url
+                if not self.retry_policy.should_retry(result.failure, attempt):
+                    break
+                retry_after = result.responses[-1][3] if result.responses else None
+                time.sleep(self.retry_policy.delay(attempt, retry_after))
+            landing = sum(1 for _, kind in candidates if kind == "landing")
+            candidates.extend((link, "landing") for link in result.landing_links[: max(self.max_landing_links - landing, 0)])
+            result.landing_links = []
+
+        return result
+
+    # Makes one request for the url and saves the body. Returns True when the file is on disk.
+    # A partial file left by an earlier attempt is resumed with a range request instead of fetched again from byte zero
+    def attempt(self, url: str, destination_path: str, validators: Optional[dict], result: DownloadResult) -> bool:
+        resume = self.resume_state(destination_path, url)
+        fileDownloaded, response = self.download(url, validators, result, resume)
+        if not fileDownloaded:
+            return False
+        result.url = url
+        if response.status_code == 304:
+            # The server confirmed the copy on disk is current, so the body is never transferred
+            response.close()
+            result.not_modified = True
+            for key in ("etag", "last_modified", "content_length", "sha256"):
+                setattr(result, key, validators.get(key))
+            result.success = True
+        else:
+            result.etag = response.headers.get("etag")
+            result.last_modified = response.headers.get("last-modified")
+            total = self.resumable_length(response)
+            content_type = (response.headers.get("content-type") or "").lower()
+            parallel = response.status_code == 200 and self.parallel_ranges > 1 and total is not None and total >= self.parallel_threshold
+            # Ranges are only fetched in parallel when the server says the body is a pdf, anything else is sniffed first
+            if parallel and "pdf" in content_type:
+                # The ranges are asked from where the url redirected to, so the redirects are not followed for every range
+                result.success = self.parallel_fetch(response.url or url, destination_path, response, total, result)
+            else:
+                # Sace file to the distination if the download was success
+                result.success = self.save_to_file(destination_path, response, result, resume)
+        return result.success
+
+    # Returns the full length of the file when the response can be resumed with a range request, otherwise None
+    def resumable_length(self, response) -> Optional[int]:
+        headers = response.headers
+        if headers.get("accept-ranges", "").lower() != "bytes" and response.status_code != 206:
+            return None
+        if headers.get("content-encoding", "identity") != "identity":
+            return None
+        if response.status_code == 206:
+            total = headers.get("content-range", "").rpartition("/")[2]
+        else:
+            total = headers.get("content-length", "")
+        return int(total) if total.isdigit() else None
+
+    # Returns what is known about a partial download of url at destination_path, or None when there is nothing to resume
+    def resume_state(self, destination_path: str, url: str) -> Optional[dict]:
+        temp_path = destination_path + ".part"
+        try:
+            with open(temp_path + ".json", encoding="utf-8") as file:
+                state = json.load(file)
+            state["offset"] = os.path.getsize(temp_path)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != url or not (0 < state["offset"] < state.get("total", 0)):
+            return None
+        return state
+
+    # Streams the response body to a temporary file next to the destination and renames it into place when complete.
+    # A transfer that breaks off or comes up short of Content-Length never leaves a file at destination_path. When the
+    # server supports ranges the partial file is kept so the next attempt can resume it. The size and SHA-256 of the
+    # body are recorded on result when one is given
+    def save_to_file(self, destination_path: str, response, result: Optional[DownloadResult] = None, resume: Optional[dict] = None) -> bool:
+        temp_path = destination_path + ".part"
+        meta_path = temp_path + ".json"
+        written = 0
+        digest = hashlib.sha256()
+        validator = PdfValidator() if self.validate_pdf else None
+        total = None
+        chunks = None
+        offset = 0
+        try:
+            total = self.resumable_length(response)
+            # Content-Length counts encoded bytes, so it can only be compared when the body was sent as is
+            expected = response.headers.get("content-length")
+            encoded = response.headers.get("content-encoding", "identity") != "identity"
+            size = total
+            if size is None and expected is not None and expected.isdigit() and not encoded:
+                size = int(expected)
+            if resume and response.status_code == 206:
+                # Only append when the server continues exactly where the partial file ends and the file has not changed
+                start = response.headers.get("content-range", "").partition(" ")[2].partition("-")[0]
+                etag = response.headers.get("etag")
+                if start != str(resume["offset"]) or total != resume["total"] or (etag and resume.get("etag") and etag != resume["etag"]):
+                    raise TruncatedTransferError("Range response does not match the partial file")
+                with open(temp_path, "rb") as file:
+                    for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                        digest.update(chunk)
+                        if validator is not None:
+                            validator.feed(chunk)
+                offset = written = resume["offset"]
+            if total is not None and not offset:
+                with open(meta_path, "w", encoding="utf-8") as file:
+                    url = result.url if result is not None else response.url
+                    json.dump({"url": url, "etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified"), "total": total}, file)
+            streamed = time.perf_counter()
+            writing = 0.0
+            chunks = response.iter_content(chunk_size=self.chunk_size)
+            min_rate = result.min_transfer_rate if result is not None else None
+            with open(temp_path, "r+b" if offset else "wb") as file:
+                file.seek(offset)
+                # A partial file that may be resumed is not preallocated: after a crash its size is the only record of
+                # how much of it arrived, and a file already at full size would be fetched again from byte zero
+                preallocated = total is None and preallocate(file, size)
+                try:
+                    for chunk in chunks:
+                        if chunk:
+                            # A body that is not a pdf is abandoned after its first kilobyte
+                            if validator is not None:
+                                validator.feed(chunk)
+                            check_pace(streamed, written - offset, min_rate, self.rate_grace, self.deadline, self.cancelled)
+                            started = time.perf_counter()
+                            file.write(chunk)
+                            writing += time.perf_counter() - started
+                            digest.update(chunk)
+                            written += len(chunk)
+                finally:
+                    # The partial file of a transfer that stopped short has to end where the received bytes end
+                    if preallocated:
+                        file.truncate()
+            if result is not None:
+                result.timings["write"] += writing
+                result.timings["transfer"] += time.perf_counter() - streamed - writing
+                result.bytes_received += written - offset
+            if total is not None and written != total:
+                raise TruncatedTransferError(f"Truncated transfer: got {written} of {total} bytes")
+            if total is None and expected is not None and expected.isdigit() and not encoded and int(expected) != written:
+                raise TruncatedTransferError(f"Truncated transfer: got {written} of {expected} bytes")
+            if validator is not None:
+                validator.finish()
+                if self.check_xref:
+                    validator.check_xref(temp_path)
+            os.replace(temp_path, destination_path)
+            self.remove_files(meta_path, temp_path + ".ranges.json")
+            if result is not None:
+                result.content_length = written
+                result.sha256 = digest.hexdigest()
+            return True
+        except Exception as error:
+            if result is not None:
+                result.failure = classify_exception(error)
+                if isinstance(error, (SlowTransferError, DeadlineExceededError, CancelledTransferError)):
+                    result.content_length = total
+                # An html page served instead of the pdf may link to it
+                if isinstance(error, NotPdfError) and error.html:
+                    result.landing_links = self.landing_links(error.head, chunks, response.url)
+            # A resumable partial file is kept for the next attempt, anything else is thrown away
+            if total is None or (isinstance(error, TruncatedTransferError) and written == 0) or isinstance(error, (NotPdfError, BadPdfError)):
+                self.remove_files(temp_path, meta_path)
+            return False
+        finally:
+            response.close()
 
-        # If it fails to download try the alternative url
-        if not fileDownloaded and alt_url:
-            fileDownloaded, response = self.download(alt_url)
+    # Returns how far every range of a parallel download of this file got in an earlier attempt, or None when the
+    # partial file can not be continued. The progress is only trusted for the same version of the file
+    def range_progress(self, temp_path: str, ranges: list, total: int, etag: Optional[str], last_modified: Optional[str]) -> Optional[list]:
+        try:
+            with open(temp_path + ".ranges.json", encoding="utf-8") as file:
+                state = json.load(file)
+            size = os.path.getsize(temp_path)
+        except (OSError, ValueError):
+            return None
+        same = etag and state.get("etag") == etag or not etag and last_modified and state.get("last_modified") == last_modified
+        if not same or state.get("total") != total or size != total or state.get("ranges") != [list(byte_range) for byte_range in ranges]:
+            return None
+        return [min(max(position, start), end + 1) for position, (start, end) in zip(state["progress"], ranges)]
 
-        # Sace file to the distination if the download was success
-        if fileDownloaded:
-            success = self.save_to_file(destination_path, response)
+    # Fetches a large file as parallel byte ranges written into a preallocated temporary file. Every range stops at the
+    # deadline, when the run is cancelled, when the transfer as a whole falls below the rate floor or when the circuit of
+    # the host opens, and the others stop with it. How far every range got is kept next to the partial file, so the next
+    # attempt only fetches what is missing
+    def parallel_fetch(self, url: str, destination_path: str, response, total: int, result: DownloadResult) -> bool:
+        temp_path = destination_path + ".part"
+        ranges_path = temp_path + ".ranges.json"
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        response.close()
+        size = -(-total // self.parallel_ranges)
+        ranges = [(start, min(start + size, total) - 1) for start in range(0, total, size)]
+        host = host_of(url) if self.circuit_breaker is not None else None
+        lock = threading.Lock()
+        stopped = threading.Event()
+        failures = []
+        received = 0
+        streamed = time.perf_counter()
 
-        return success
+        def save_progress():
+            with open(ranges_path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump({"etag": etag, "last_modified": last_modified, "total": total, "ranges": ranges, "progress": progress}, file)
+            os.replace(ranges_path + ".tmp", ranges_path)
 
-    def save_to_file(self, destination_path: str, response):
-        with open(destination_path, "wb") as file:
+        def fetch_range(index):
+            nonlocal received
+            start, end = ranges[index]
+            position = progress[index]
+            if position > end:
+                return
             try:
-                file.write(response.content)
-                return True
-            except:
+                if self.circuit_breaker is not None and not self.circuit_breaker.allow(host):
+                    failures.append("circuit_open")
+                    stopped.set()
+                    return
+                headers = {"Range": f"bytes={position}-{end}"}
+                if etag or last_modified:
+                    headers["If-Range"] = etag or last_modified
+                requested = time.monotonic()
+                try:
+                    part = self.session.get(url, stream=True, timeout=30, headers=headers)
+                except Exception:
+                    result.responses.append((url, None, time.monotonic() - requested, None))
+                    raise
+                result.responses.append((url, part.status_code, time.monotonic() - requested, parse_retry_after(part.headers.get("retry-after"))))
+                try:
+                    if part.status_code != 206:
+                        failures.append(classify_status(part.status_code) or "changed")
+                        stopped.set()
+                        return
+                    with open(temp_path, "r+b") as file:
+                        file.seek(position)
+                        for chunk in part.iter_content(chunk_size=self.chunk_size):
+                            # Another range failed, so the download as a whole can not succeed in this attempt
+                            if stopped.is_set():
+                                return
+                            check_pace(streamed, received, result.min_transfer_rate, self.rate_grace, self.deadline, self.cancelled)
+                            file.write(chunk[: end + 1 - position])
+                            position += min(len(chunk), end + 1 - position)
+                            with lock:
+                                received += len(chunk)
+                finally:
+                    part.close()
+                if position != end + 1:
+                    raise TruncatedTransferError(f"Truncated range: got {position - start} of {end + 1 - start} bytes")
+            except Exception as error:
+                failures.append(classify_exception(error))
+                stopped.set()
+            finally:
+                # The file is closed before its progress is recorded, so the record never runs ahead of the bytes
+                with lock:
+                    progress[index] = position
+                    try:
+                        save_progress()
+                    except OSError:
+                        pass
+
+        try:
+            progress = self.range_progress(temp_path, ranges, total, etag, last_modified)
+            if progress is None:
+                progress = [start for start, _ in ranges]
+                with open(temp_path, "wb") as file:
+                    if not preallocate(file, total):
+                        file.truncate(total)
+                save_progress()
+            # The ranges are received and written concurrently, so all of it counts as transfer
+            with ThreadPoolExecutor(len(ranges)) as pool:
+                list(pool.map(fetch_range, range(len(ranges))))
+            result.timings["transfer"] += time.perf_counter() - streamed
+            result.bytes_received += received
+            if failures:
+                result.failure = failures[0]
+                if result.failure in ("slow", "deadline", "cancelled"):
+                    result.content_length = total
+                # A file that changed on the server can not be pieced together from the ranges of the old one
+                if "changed" in failures:
+                    result.failure = "truncated"
+                    self.remove_files(temp_path, ranges_path)
                 return False
+            digest = hashlib.sha256()
+            validator = PdfValidator() if self.validate_pdf else None
+            with open(temp_path, "rb") as file:
+                for chunk in iter(lambda: file.read(self.chunk_size), b""):
+                    digest.update(chunk)
+                    if validator is not None:
+                        validator.feed(chunk)
+            if validator is not None:
+                validator.finish()
+                if self.check_xref:
+                    validator.check_xref(temp_path)
+            os.replace(temp_path, destination_path)
+            self.remove_files(ranges_path)
+            result.content_length = total
+            result.sha256 = digest.hexdigest()
+            return True
+        except Exception as error:
+            result.failure = classify_exception(error)
+            self.remove_files(temp_path, ranges_path)
+            return False
+
+    # Reads the rest of an html page, up to LANDING_PAGE_BYTES, and returns the links on it that may lead to the pdf
+    def landing_links(self, head: bytes, chunks, base_url: Optional[str]) -> list:
+        page = [head]
+        size = len(head)
+        try:
+            for chunk in chunks or ():
+                if size >= LANDING_PAGE_BYTES:
+                    break
+                page.append(chunk)
+                size += len(chunk)
+        except Exception:
+            pass
+        return extract_pdf_links(b"".join(page)[:LANDING_PAGE_BYTES], base_url)
+
+    def remove_files(self, *paths: str) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
-    def download(self, url: str):
+    # Requests the url and accepts any successful response that is not an html page, or a 304 when validators were sent. When resume describes a partial
+    # file the rest of it is requested with a range, guarded by If-Range so a changed file is sent whole.
+    # The status, latency and failure class of the request are added to result when one is given
+    def download(self, url: str, validators: Optional[dict] = None, result: Optional[DownloadResult] = None, resume: Optional[dict] = None):
+        target = self.redirect_cache.resolve(url) if self.redirect_cache is not None else url
+        downloaded, response = self.request(target, validators, result, resume, url)
+        if not downloaded and target != url and result is not None and result.failure in STALE_FAILURES:
+            # The cached target no longer serves the file, so the redirects are followed again from the original url
+            self.redirect_cache.forget(url)
+            result.landing_links = []
+            return self.request(url, validators, result, resume, url)
+        return downloaded, response
+
+    # Sends one request for url, which original redirected to in an earlier request or is original itself
+    def request(self, url: str, validators: Optional[dict], result: Optional[DownloadResult], resume: Optional[dict], original: str):
+        headers = {}
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        if resume and (resume.get("etag") or resume.get("last_modified")):
+            headers["Range"] = f"bytes={resume['offset']}-"
+            headers["If-Range"] = resume.get("etag") or resume["last_modified"]
+        take_connection_phases()
+        started = time.monotonic()
         try:
-            response = requests.get(url, stream=True, timeout=30)
-            # Checks if the response was a pdf file
-            if "application/pdf" in response.headers.get("content-type"):
+            response = self.session.get(url, stream=True, timeout=30, headers=headers)
+            if result is not None:
+                retry_after = parse_retry_after(response.headers.get("retry-after"))
+                result.responses.append((url, response.status_code, time.monotonic() - started, retry_after))
+                self.record_request_phases(result, time.monotonic() - started)
+            if "If-None-Match" in headers or "If-Modified-Since" in headers:
+                if response.status_code == 304:
+                    return True, response
+            failure = classify_status(response.status_code)
+            if self.redirect_cache is not None and failure is None and response.history:
+                self.redirect_cache.record(original, response.url)
+            content_type = (response.headers.get("content-type") or "").lower()
+            # The Content-Type is not trusted, save_to_file sniffs the body. Only an html page is turned down here,
+            # after looking for a link to the pdf on it
+            if failure is None and (not self.validate_pdf and "application/pdf" in content_type or self.validate_pdf and "html" not in content_type):
                 return True, response
+            if failure is None and result is not None:
+                result.landing_links = self.landing_links(b"", response.iter_content(chunk_size=self.chunk_size), response.url)
+            if result is not None:
+                result.failure = failure or "not_pdf"
+            # Hands the connection back to the pool instead of leaving it hanging on an unread body
+            response.close()
             return False, None
-        except:
+        except Exception as error:
+            if result is not None:
+                result.responses.append((url, None, time.monotonic() - started, None))
+                self.record_request_phases(result, time.monotonic() - started)
+                result.failure = classify_exception(error)
             return False, None
 
+    # Splits the time until the response headers arrived into the connection phases and the wait for the first byte
+    def record_request_phases(self, result: DownloadResult, seconds: float) -> None:
+        phases = take_connection_phases()
+        for phase, spent in phases.items():
+            result.timings[phase] += spent
+        result.timings["ttfb"] += max(seconds - sum(phases.values()), 0.0)
+
 
 if __name__ == "__main__":
     downloader = Downloader()
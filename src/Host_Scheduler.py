@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import urlparse
+
+
+# Returns the host part of a url, used to group the downloads that hit the same server
+def host_of(url: Optional[str]) -> str:
+    if not url:
+        return ""
+    try:
+        return urlparse(url).netloc.lower()
+    except ValueError:
+        return ""
+
+
+# Parses a Retry-After header, given either as seconds or as an HTTP date, into seconds from now
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Bookkeeping for one host: the items waiting for it, its token bucket and how many downloads it is allowed in parallel
+class HostState(object):
+
+    def __init__(self, rate: float, burst: float, concurrency: float, unlimited: bool = False) -> None:
+        self.pending = deque()
+        self.in_flight = 0
+        self.concurrency = concurrency
+        self.rate = rate
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0.0
+        self.latency = None
+        self.best_latency = None
+        # Rows without any url never touch the network, so they are not throttled
+        self.unlimited = unlimited
+
+    def refill(self, now: float, burst: float) -> None:
+        self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    # Seconds until the host may start another download, or None while all its download slots are taken
+    def wait_time(self, now: float) -> Optional[float]:
+        if self.unlimited:
+            return 0.0
+        if self.in_flight >= int(self.concurrency):
+            return None
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Work queue that hands out downloads round-robin across hosts. Each host has a token bucket limiting its request rate
+# and a concurrency limit that grows while the host answers quickly and is halved on 429/503, honoring Retry-After.
+# Items of a host whose circuit is open in circuit_breaker are handed out without throttling, since they fail at once.
+# max_in_flight caps the downloads in flight over all hosts, so the number of busy workers can be tuned while they run
+class HostScheduler(object):
+
+    def __init__(
+        self,
+        rate_per_host: Optional[float] = 5.0,
+        burst: Optional[float] = 5.0,
+        initial_concurrency: Optional[float] = 2.0,
+        max_concurrency_per_host: Optional[float] = 8.0,
+        latency_factor: Optional[float] = 3.0,
+        max_pending: Optional[int] = 0,
+        circuit_breaker=None,
+        max_in_flight: Optional[int] = 0,
+    ) -> None:
+        self.rate_per_host = rate_per_host
+        self.burst = burst
+        self.initial_concurrency = min(initial_concurrency, max_concurrency_per_host)
+        self.max_concurrency_per_host = max_concurrency_per_host
+        # A host is considered overloaded when its average latency grows past this multiple of the best latency seen
+        self.latency_factor = latency_factor
+        # put blocks while this many items are waiting, 0 means no limit
+        self.max_pending = max_pending
+        self.circuit_breaker = circuit_breaker
+        # 0 means no limit besides the number of workers
+        self.max_in_flight = max_in_flight
+
+        self.hosts = {}
+        self.ready = deque()
+        self.pending = 0
+        self.unfinished = 0
+        # Set by close once no more items will be put, so idle workers know they can stop
+        self.closed = False
+        # Set by cancel, after which items are dropped instead of handed out
+        self.cancelled = False
+        self.condition = threading.Condition(threading.Lock())
+
+    def host_key(self, item) -> str:
+        link, destination, name, alt_link = item
+        return host_of(link) if link else host_of(alt_link)
+
+    # force skips the max_pending back-pressure. Workers putting an item back use it, since a full queue only drains
+    # while they keep taking items, and would otherwise wait for each other forever
+    def put(self, item, force: bool = False) -> None:
+        host = self.host_key(item)
+        with self.condition:
+            while not force and self.max_pending and self.pending >= self.max_pending and not self.cancelled:
+                self.condition.wait()
+            if self.cancelled:
+                return
+            state = self.hosts.get(host)
+            if state is None:
+                state = HostState(self.rate_per_host, self.burst, self.initial_concurrency, unlimited=not host)
+                self.hosts[host] = state
+            if not state.pending:
+                self.ready.append(host)
+            state.pending.append(item)
+            self.pending += 1
+            self.unfinished += 1
+            self.condition.notify_all()
+
+    # Tells the workers no more items will be put. Items in flight may still be put back
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    # Drops every item that has not been handed out yet and every item put from now on. Downloads in flight still
+    # have to call task_done, after which get returns None
+    def cancel(self) -> None:
+        with self.condition:
+            self.cancelled = True
+            self.closed = True
+            for state in self.hosts.values():
+                self.unfinished -= len(state.pending)
+                state.pending.clear()
+            self.pending = 0
+            self.ready.clear()
+            self.condition.notify_all()
+
+    # Blocks until a host may start another download and returns (host, item).
+    # Returns None once the scheduler is closed and every item has been handed out and finished
+    def get(self):
+        with self.condition:
+            while True:
+                if self.pending == 0:
+                    if self.closed and self.unfinished == 0:
+                        return None
+                    # More items may still be put, or put back by downloads in flight, so idle workers wait for them
+                    self.condition.wait()
+                    continue
+                # Workers above the limit wait here until a download finishes or the limit is raised
+                if self.max_in_flight and self.unfinished - self.pending >= self.max_in_flight:
+                    self.condition.wait()
+                    continue
+                now = time.monotonic()
+                soonest = None
+                for _ in range(len(self.ready)):
+                    host = self.ready[0]
+                    self.ready.rotate(-1)
+                    state = self.hosts[host]
+                    state.refill(now, self.burst)
+                    fail_fast = self.circuit_breaker is not None and self.circuit_breaker.is_open(host)
+                    wait = 0.0 if fail_fast else state.wait_time(now)
+                    if wait == 0.0:
+                        if not state.unlimited and not fail_fast:
+                            state.tokens -= 1
+                        state.in_flight += 1
+                        item = state.pending.popleft()
+                        self.pending -= 1
+                        if not state.pending:
+                            self.ready.remove(host)
+                        self.condition.notify_all()
+                        return host, item
+                    if wait is not None:
+                        soonest = wait if soonest is None else min(soonest, wait)
+                self.condition.wait(soonest)
+
+    # Feeds the outcome of one request back into the limits of its host
+    def report(self, host: str, status_code: Optional[int] = None, latency: Optional[float] = None, retry_after: Optional[float] = None) -> None:
+        with self.condition:
+            state = self.hosts.get(host)
+            if state is None or state.unlimited:
+                return
+            if status_code in (429, 503):
+                state.concurrency = max(1.0, state.concurrency / 2)
+                state.rate = max(self.rate_per_host / 16, state.rate / 2)
+                delay = retry_after if retry_after is not None else 1.0 / state.rate
+                state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            elif latency is not None:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+                state.best_latency = latency if state.best_latency is None else min(state.best_latency, latency)
+                if state.latency > self.latency_factor * state.best_latency:
+                    state.concurrency = max(1.0, state.concurrency * 0.9)
+                else:
+                    state.concurrency = min(self.max_concurrency_per_host, state.concurrency + 1.0 / state.concurrency)
+                    state.rate = min(self.rate_per_host, state.rate * 1.1)
+            self.condition.notify_all()
+
+    # Changes the cap on the downloads in flight over all hosts. Lowering it lets the downloads above it finish first
+    def set_max_in_flight(self, max_in_flight: int) -> None:
+        with self.condition:
+            self.max_in_flight = max_in_flight
+            self.condition.notify_all()
+
+    # Marks a download handed out for host as finished and frees its slot
+    def task_done(self, host: str) -> None:
+        with self.condition:
+            self.hosts[host].in_flight -= 1
+            self.unfinished -= 1
+            self.condition.notify_all()
+
+    # Blocks until every item put on the scheduler is finished
+    def join(self) -> None:
+        with self.condition:
+            while self.unfinished:
+                self.condition.wait()
+
+    def empty(self) -> bool:
+        with self.condition:
+            return self.pending == 0
+
+    def qsize(self) -> int:
+        with self.condition:
+            return self.pending
@@ -0,0 +1,379 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import tarfile
+import threading
+import time
+import zlib
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard is only needed for tar.zst archives, zip and tar archives use the standard library
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMATS = ("zip", "tar", "tar.zst")
+INDEX_SUFFIX = ".index.jsonl"
+# Zip archives are written without the zip64 extensions, which limits their size and number of members
+ZIP_LIMIT = 0xFFFFFFFF
+ZIP_MAX_MEMBERS = 0xFFFF
+ZIP_LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+ZIP_DESCRIPTOR = struct.Struct("<4sIII")
+ZIP_CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+ZIP_END = struct.Struct("<4sHHHHIIH")
+# Sizes and crc follow the data in a descriptor, names are utf-8
+ZIP_FLAGS = 0x0808
+TAR_BLOCK = 512
+
+
+# Date and time of a modification time in the format zip headers store them in
+def dos_time(mtime: float) -> tuple:
+    moment = time.localtime(mtime)
+    if moment.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (moment.tm_hour << 11) | (moment.tm_min << 5) | (moment.tm_sec // 2), ((moment.tm_year - 1980) << 9) | (moment.tm_mon << 5) | moment.tm_mday
+
+
+# The offset past the bytes of an index entry in its shard, None for entries that share the bytes of another one
+def entry_end(entry: dict, archive_format: str) -> Optional[int]:
+    if entry.get("alias"):
+        return None
+    if archive_format == "zip":
+        return entry["offset"] + entry["length"] + ZIP_DESCRIPTOR.size
+    if archive_format == "tar":
+        return entry["offset"] + entry["length"] + (-entry["length"]) % TAR_BLOCK
+    return entry["offset"] + entry["length"]
+
+
+# Index entries of a shard, leaving out a line torn by a crash and entries whose bytes never made it into the shard
+def read_index(index_path: str, shard_path: str, archive_format: str) -> list:
+    try:
+        size = os.path.getsize(shard_path)
+    except OSError:
+        return []
+    entries = []
+    with open(index_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            end = entry_end(entry, archive_format)
+            if end is not None and end > size:
+                break
+            entries.append(entry)
+    return entries
+
+
+# Streams finished pdfs into rolling archive shards in directory, so the corpus can be moved as a few large files
+# instead of millions of small ones. A shard is closed and the next one started once it holds max_bytes. "zip" stores
+# the files as they are and "tar" writes a plain tar, so both read back with one seek and one read. "tar.zst" compresses
+# every member as a zstd frame of its own, which together are a valid tar.zst stream, so one frame is read and
+# decompressed per file. Next to every shard an index holds the offset and length of every file by name.
+# A shard being written is named .part and finished with its trailer when it is closed. A run that crashed leaves it
+# behind, and the next writer cuts it back to the files its index lists and goes on appending to it
+class ArchiveWriter(object):
+
+    def __init__(self, directory: str, archive_format: str = "zip", max_bytes: int = 1024**3, prefix: str = "pdfs", level: int = 3, fsync_every: Optional[int] = 100) -> None:
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format {archive_format!r}, expected one of {', '.join(ARCHIVE_FORMATS)}")
+        if archive_format == "tar.zst" and zstandard is None:
+            raise ImportError("tar.zst archives require zstandard, install it with 'pip install zstandard'")
+        self.directory = directory
+        self.format = archive_format
+        self.max_bytes = min(max_bytes, ZIP_LIMIT) if archive_format == "zip" else max_bytes
+        self.prefix = prefix
+        self.compressor = zstandard.ZstdCompressor(level=level) if archive_format == "tar.zst" else None
+        self.fsync_every = fsync_every
+        self.lock = threading.Lock()
+
+        self.number = None
+        self.file = None
+        self.index = None
+        self.size = 0
+        self.unsynced = 0
+        # name -> index entry of every file in the shards of this writer, with the name of its shard, the name of the
+        # latest file with a given sha256, and the zip members of the open shard
+        self.entries = {}
+        self.hashes = {}
+        self.members = []
+        self.load()
+
+    def shard_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}-{number:05d}.{self.format}")
+
+    def index_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.prefix}-{number:05d}{INDEX_SUFFIX}")
+
+    # Numbers of the shards written before, by the indexes they left
+    def numbers(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        pattern = re.compile(re.escape(self.prefix) + r"-(\d{5})" + re.escape(INDEX_SUFFIX) + "$")
+        return sorted(int(match.group(1)) for match in map(pattern.match, os.listdir(self.directory)) if match)
+
+    # Reads the indexes of the shards earlier runs wrote, so their files count as archived and can be shared
+    def load(self) -> None:
+        for number in self.numbers():
+            shard_path = self.shard_path(number)
+            path = shard_path if os.path.isfile(shard_path) else shard_path + ".part"
+            if os.path.isfile(path):
+                for entry in read_index(self.index_path(number), path, self.format):
+                    self.remember(dict(entry, shard=entry.get("shard", os.path.basename(shard_path))))
+
+    def remember(self, entry: dict) -> None:
+        self.entries[str(entry["name"])] = entry
+        if entry.get("sha256"):
+            self.hashes[entry["sha256"]] = str(entry["name"])
+
+    def __contains__(self, name) -> bool:
+        return str(name) in self.entries
+
+    # The index entry of name with the path of its shard, or None when name is not archived
+    def find(self, name) -> Optional[dict]:
+        entry = self.entries.get(str(name))
+        return None if entry is None else dict(entry, path=os.path.join(self.directory, entry["shard"]))
+
+    # The name of an archived file with the given content, or None
+    def duplicate(self, sha256: Optional[str]):
+        name = self.hashes.get(sha256) if sha256 else None
+        # The name may have been archived again since with other content
+        return name if name is not None and self.entries[name].get("sha256") == sha256 else None
+
+    # Opens the shard a crashed run left unfinished, or starts the next one
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        last = max(self.numbers(), default=-1)
+        if last >= 0 and os.path.isfile(self.shard_path(last) + ".part"):
+            self.recover(last)
+            return
+        self.number = last + 1
+        self.file = open(self.shard_path(self.number) + ".part", "wb")
+        self.index = open(self.index_path(self.number), "w", encoding="utf-8")
+        self.size = 0
+        self.members = []
+
+    # Cuts an unfinished shard back to the files its index lists, so a file cut off by the crash is dropped
+    def recover(self, number: int) -> None:
+        shard_path = self.shard_path(number) + ".part"
+        entries = read_index(self.index_path(number), shard_path, self.format)
+        self.size = max((entry_end(entry, self.format) or 0 for entry in entries), default=0)
+        with open(self.index_path(number) + ".tmp", "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+        os.replace(self.index_path(number) + ".tmp", self.index_path(number))
+        self.number = number
+        self.file = open(shard_path, "r+b")
+        self.file.truncate(self.size)
+        self.file.seek(self.size)
+        self.index = open(self.index_path(number), "a", encoding="utf-8")
+        shard = os.path.basename(self.shard_path(number))
+        for entry in entries:
+            self.remember(dict(entry, shard=entry.get("shard", shard)))
+        self.members = [entry for entry in entries if not entry.get("alias")]
+        logger.info("Resuming archive shard %s with %d files", shard_path, len(entries))
+
+    # Copies the file at path into the open shard under name. Returns its index entry, with the path of the shard
+    def add(self, name, path: str) -> dict:
+        with open(path, "rb") as source:
+            stat = os.fstat(source.fileno())
+            if self.format == "zip" and stat.st_size >= ZIP_LIMIT:
+                raise ValueError(f"{path} is too large for a zip archive")
+            with self.lock:
+                # Offsets past 4 GiB do not fit a zip header, so a file that would end there starts the next shard
+                if self.file is not None and self.format == "zip" and self.size + stat.st_size + 1024 > ZIP_LIMIT:
+                    self.finish()
+                if self.file is None:
+                    self.open()
+                try:
+                    entry = getattr(self, "write_" + self.format.replace(".", "_"))(name, source, stat)
+                except Exception:
+                    # A file that failed half way is cut off again, so the next one starts where the shard ended before
+                    self.file.seek(self.size)
+                    self.file.truncate()
+                    raise
+                return self.record(entry)
+
+    # Lets name point at the bytes of existing, a file this writer added before, such as a row that shared its download.
+    # Returns the new index entry, or None when existing was not added. A name that already holds the same content keeps
+    # its entry
+    def alias(self, name, existing) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(str(existing))
+            if entry is None:
+                return None
+            current = self.entries.get(str(name))
+            if current is not None and current.get("sha256") == entry.get("sha256"):
+                return dict(current, path=os.path.join(self.directory, current["shard"]))
+            if self.file is None:
+                self.open()
+            return self.record(dict(entry, name=name, alias=True))
+
+    def record(self, entry: dict) -> dict:
+        self.index.write(json.dumps(entry) + "\n")
+        # Aliases name the shard they point into, which may be an earlier one
+        shard = entry.get("shard", os.path.basename(self.shard_path(self.number)))
+        self.remember(dict(entry, shard=shard))
+        if not entry.get("alias"):
+            self.members.append(entry)
+        self.unsynced += 1
+        # The shard is flushed before the index, so the index never lists bytes the shard does not hold yet
+        self.file.flush()
+        self.index.flush()
+        if self.fsync_every and self.unsynced >= self.fsync_every:
+            self.sync()
+        if self.size >= self.max_bytes or len(self.members) >= ZIP_MAX_MEMBERS and self.format == "zip":
+            self.finish()
+        return dict(entry, path=os.path.join(self.directory, shard))
+
+    def sync(self) -> None:
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+        self.unsynced = 0
+
+    # Streams source through write, returning the number of bytes, their sha256 and their crc32
+    def copy(self, source, write) -> tuple:
+        digest = hashlib.sha256()
+        crc = 0
+        written = 0
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+            crc = zlib.crc32(chunk, crc)
+            write(chunk)
+            written += len(chunk)
+        return written, digest.hexdigest(), crc
+
+    def write_zip(self, name, source, stat) -> dict:
+        encoded = f"{name}.pdf".encode("utf-8")
+        clock, date = dos_time(stat.st_mtime)
+        header = ZIP_LOCAL_HEADER.pack(b"PK\x03\x04", 20, ZIP_FLAGS, 0, clock, date, 0, 0, 0, len(encoded), 0)
+        self.file.write(header + encoded)
+        offset = self.size + len(header) + len(encoded)
+        written, sha256, crc = self.copy(source, self.file.write)
+        self.file.write(ZIP_DESCRIPTOR.pack(b"PK\x07\x08", crc, written, written))
+        self.size = offset + written + ZIP_DESCRIPTOR.size
+        return {"name": name, "offset": offset, "length": written, "size": written, "sha256": sha256, "crc": crc, "mtime": int(stat.st_mtime)}
+
+    def tar_header(self, name, stat) -> bytes:
+        info = tarfile.TarInfo(f"{name}.pdf")
+        info.size = stat.st_size
+        info.mtime = int(stat.st_mtime)
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.PAX_FORMAT)
+
+    def write_tar(self, name, source, stat) -> dict:
+        header = self.tar_header(name, stat)
+        self.file.write(header)
+        offset = self.size + len(header)
+        written, sha256, _ = self.copy(source, self.file.write)
+        if written != stat.st_size:
+            raise OSError(f"{source.name} changed while it was archived")
+        self.file.write(b"\0" * ((-written) % TAR_BLOCK))
+        self.size = offset + written + (-written) % TAR_BLOCK
+        return {"name": name, "offset": offset, "length": written, "size": written, "sha256": sha256}
+
+    def write_tar_zst(self, name, source, stat) -> dict:
+        header = self.tar_header(name, stat)
+        padding = (-stat.st_size) % TAR_BLOCK
+        frame = self.compressor.compressobj(size=len(header) + stat.st_size + padding)
+        write = lambda data: self.file.write(frame.compress(data))
+        write(header)
+        written, sha256, _ = self.copy(source, write)
+        if written != stat.st_size:
+            raise OSError(f"{source.name} changed while it was archived")
+        write(b"\0" * padding)
+        self.file.write(frame.flush())
+        offset = self.size
+        self.size = self.file.tell()
+        return {"name": name, "offset": offset, "length": self.size - offset, "skip": len(header), "size": written, "sha256": sha256}
+
+    # Writes the trailer of the open shard and gives it its final name
+    def finish(self) -> None:
+        if self.file is None:
+            return
+        if self.format == "zip":
+            directory = bytearray()
+            for entry in self.members:
+                encoded = f"{entry['name']}.pdf".encode("utf-8")
+                clock, date = dos_time(entry["mtime"])
+                header_offset = entry["offset"] - ZIP_LOCAL_HEADER.size - len(encoded)
+                directory += ZIP_CENTRAL_HEADER.pack(
+                    b"PK\x01\x02", 20, 20, ZIP_FLAGS, 0, clock, date, entry["crc"], entry["size"], entry["size"], len(encoded), 0, 0, 0, 0, 0o644 << 16, header_offset
+                )
+                directory += encoded
+            self.file.write(directory)
+            self.file.write(ZIP_END.pack(b"PK\x05\x06", 0, 0, len(self.members), len(self.members), len(directory), self.size, 0))
+        elif self.format == "tar":
+            self.file.write(b"\0" * 2 * TAR_BLOCK)
+        else:
+            self.file.write(self.compressor.compress(b"\0" * 2 * TAR_BLOCK))
+        self.file.flush()
+        self.sync()
+        self.file.close()
+        self.index.close()
+        os.replace(self.shard_path(self.number) + ".part", self.shard_path(self.number))
+        self.file = None
+        self.index = None
+
+    def close(self) -> None:
+        with self.lock:
+            self.finish()
+
+
+# Reads the pdfs of the archive shards in directory by name, without extracting them. Shards still being written are
+# read up to the last file their index lists. A name archived more than once is read from the latest shard
+class ArchiveReader(object):
+
+    def __init__(self, directory: str, prefix: str = "pdfs") -> None:
+        self.directory = directory
+        self.prefix = prefix
+        # name -> (shard path, format, index entry)
+        self.entries = {}
+        self.load()
+
+    def load(self) -> None:
+        self.entries = {}
+        for index_path in sorted(glob.glob(os.path.join(glob.escape(self.directory), glob.escape(self.prefix) + "*" + INDEX_SUFFIX))):
+            base = index_path[: -len(INDEX_SUFFIX)]
+            for archive_format in ARCHIVE_FORMATS:
+                shard_path = next((path for path in (f"{base}.{archive_format}", f"{base}.{archive_format}.part") if os.path.isfile(path)), None)
+                if shard_path is not None:
+                    for entry in read_index(index_path, shard_path, archive_format):
+                        self.entries[str(entry["name"])] = (self.find_shard(entry["shard"]) if "shard" in entry else shard_path, archive_format, entry)
+                    break
+
+    # The path of a shard by name, finished or still being written
+    def find_shard(self, name: str) -> str:
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else path + ".part"
+
+    def __contains__(self, name) -> bool:
+        return str(name) in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def names(self) -> list:
+        return list(self.entries)
+
+    # The shard, offset, length, size and sha256 of a file
+    def entry(self, name) -> dict:
+        shard_path, archive_format, entry = self.entries[str(name)]
+        return dict(entry, shard=shard_path, format=archive_format)
+
+    # The bytes of the pdf archived under name. Raises KeyError for names not in the archive
+    def read(self, name) -> bytes:
+        shard_path, archive_format, entry = self.entries[str(name)]
+        with open(shard_path, "rb") as file:
+            file.seek(entry["offset"])
+            data = file.read(entry["length"])
+        if archive_format == "tar.zst":
+            if zstandard is None:
+                raise ImportError("tar.zst archives require zstandard, install it with 'pip install zstandard'")
+            data = zstandard.ZstdDecompressor().decompress(data)[entry["skip"] : entry["skip"] + entry["size"]]
+        return data
@@ -0,0 +1,127 @@
+import os
+import re
+from html.parser import HTMLParser
+from typing import Optional
+from urllib.parse import urljoin, urlparse
+
+# A pdf starts with %PDF- somewhere in its first kilobyte and ends with %%EOF somewhere in its last kilobyte
+PDF_MAGIC = b"%PDF-"
+PDF_EOF = b"%%EOF"
+SNIFF_BYTES = 1024
+TAIL_BYTES = 1024
+# How much of an html landing page is read when looking for a link to the pdf
+LANDING_PAGE_BYTES = 512 * 1024
+
+
+# Raised as soon as the first bytes of a body show it is not a pdf. head holds the bytes read so far
+class NotPdfError(IOError):
+
+    def __init__(self, message: str, head: bytes = b"") -> None:
+        super().__init__(message)
+        self.head = head
+
+    @property
+    def html(self) -> bool:
+        return looks_like_html(self.head)
+
+
+# Raised when a body starts like a pdf but is not a complete one
+class BadPdfError(IOError):
+    pass
+
+
+def looks_like_html(data: bytes) -> bool:
+    start = data[:SNIFF_BYTES].lstrip().lower()
+    return start.startswith((b"<!doctype html", b"<html", b"<head", b"<body", b"<meta", b"<script")) or b"<html" in start
+
+
+# Checks a body while it streams past. The first SNIFF_BYTES are checked for the pdf header, so a body that is not a
+# pdf is abandoned after its first chunk, and the last TAIL_BYTES are kept to look for the %%EOF trailer at the end
+class PdfValidator(object):
+
+    def __init__(self) -> None:
+        self.head = b""
+        self.sniffed = False
+        self.tail = b""
+
+    def feed(self, chunk: bytes) -> None:
+        if not self.sniffed:
+            self.head += chunk
+            if len(self.head) >= SNIFF_BYTES:
+                self.sniff()
+        # Only the end of a large chunk is copied
+        self.tail = chunk[-TAIL_BYTES:] if len(chunk) >= TAIL_BYTES else (self.tail + chunk)[-TAIL_BYTES:]
+
+    def sniff(self) -> None:
+        if PDF_MAGIC not in self.head[:SNIFF_BYTES]:
+            raise NotPdfError("Body does not start with a pdf header", self.head)
+        self.sniffed = True
+        self.head = b""
+
+    # Called once the whole body has arrived. A file shorter than SNIFF_BYTES is only sniffed here
+    def finish(self) -> None:
+        if not self.sniffed:
+            self.sniff()
+        if PDF_EOF not in self.tail:
+            raise BadPdfError("Pdf has no %%EOF trailer")
+
+    # Cheap sanity check of the cross-reference table: the startxref offset in the trailer has to point inside the
+    # file at an xref table or an xref stream object. Only reads a few bytes of the file at path
+    def check_xref(self, path: str) -> None:
+        match = re.search(rb"startxref\s+(\d+)\s+%%EOF", self.tail)
+        if match is None:
+            raise BadPdfError("Pdf has no startxref")
+        offset = int(match.group(1))
+        if offset >= os.path.getsize(path):
+            raise BadPdfError("startxref points past the end of the file")
+        with open(path, "rb") as file:
+            file.seek(offset)
+            start = file.read(32).lstrip()
+        if not (start.startswith(b"xref") or re.match(rb"\d+\s+\d+\s+obj", start)):
+            raise BadPdfError("startxref does not point at a cross-reference table")
+
+
+# Collects the links of an html page that may lead to the pdf it is a landing page for
+class PdfLinkParser(HTMLParser):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attrs = dict(attrs)
+        if tag == "meta" and (attrs.get("http-equiv") or "").lower() == "refresh":
+            link = re.search(r"url\s*=\s*['\"]?([^'\";]+)", attrs.get("content") or "", re.IGNORECASE)
+            if link:
+                self.links.append(link.group(1).strip())
+        elif tag == "meta" and (attrs.get("name") or "").lower() == "citation_pdf_url":
+            self.links.append(attrs.get("content"))
+        for name in ("href", "src", "data"):
+            if attrs.get(name) and tag in ("a", "link", "iframe", "embed", "object", "frame"):
+                self.links.append(attrs[name])
+
+
+# Returns the absolute http(s) links of an html page that most likely point at a pdf, best guesses first. Links whose
+# path ends in .pdf come first, then links that mention pdf anywhere in them
+def extract_pdf_links(html: bytes, base_url: Optional[str], limit: int = 3) -> list:
+    parser = PdfLinkParser()
+    try:
+        parser.feed(html.decode("utf-8", errors="replace"))
+        parser.close()
+    except Exception:
+        pass
+    ranked = []
+    seen = set()
+    for link in parser.links:
+        if not link:
+            continue
+        url = urljoin(base_url or "", link.strip())
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or url in seen or url == base_url:
+            continue
+        seen.add(url)
+        if parsed.path.lower().endswith(".pdf"):
+            ranked.append((0, len(ranked), url))
+        elif "pdf" in url.lower():
+            ranked.append((1, len(ranked), url))
+    return [url for _, _, url in sorted(ranked)][:limit]
@@ -1,12 +1,48 @@
-from Downloader import Downloader
+from Downloader import Downloader, DownloadResult, RetryPolicy, PERMANENT_FAILURES, create_session, connection_stats
+from Async_Downloader import AsyncDownloader
+from Status_Journal import StatusJournal
+from Status_Store import StatusStore
+from Download_Metrics import DownloadMetrics
+from Progress_Reporter import ProgressReporter
+from Host_Scheduler import HostScheduler, host_of
+from Dns_Cache import DnsCache
+from Circuit_Breaker import CircuitBreaker
+from Status_Collector import StatusCollector
+from Concurrency_Tuner import ConcurrencyTuner
+from Request_Coalescer import RequestCoalescer
+from Redirect_Cache import RedirectCache
+from Disk_Manifest import DiskManifest, LOST_FAILURES, PDF_NAME
+from Destination_Layout import DestinationLayout
+from Pdf_Archive import ArchiveReader, ArchiveWriter
 import os
+import logging
+import multiprocessing
+import shutil
+import signal
 from pathlib import Path
 import threading
-from typing import Optional
-from queue import Queue
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Union
+from urllib.parse import urlparse
 import polars as pl
 from xlsxwriter import Workbook
 
+logger = logging.getLogger(__name__)
+
+
+# Hardlinks existing to path, or copies it where the file system has no hardlinks. path is replaced in one step
+def link_or_copy(existing: str, path: str) -> None:
+    if os.path.exists(path) and os.path.samefile(existing, path):
+        return
+    temp_path = path + ".link"
+    try:
+        os.link(existing, temp_path)
+    except OSError:
+        shutil.copyfile(existing, temp_path)
+    os.replace(temp_path, path)
+
 
 # Class for handling a file with download links
 class FileHandler(object):
@@ -17,89 +53,904 @@ class FileHandler(object):
         url_file: str,
         meta_file: str,
         destination: str,
-        number_of_threads: Optional[int] = 10,
+        number_of_threads: Optional[Union[int, str]] = 10,
+        chunk_size: Optional[int] = 64 * 1024,
+        engine: Optional[str] = "threads",
+        per_host_limit: Optional[int] = 8,
+        rate_per_host: Optional[float] = 5.0,
+        journal_file: Optional[str] = None,
+        refresh: Optional[bool] = False,
+        max_attempts: Optional[int] = 3,
+        retry_budget: Optional[int] = None,
+        skip_permanent_failures: Optional[bool] = False,
+        parallel_ranges: Optional[int] = 1,
+        parallel_threshold: Optional[int] = 64 * 1024 * 1024,
+        batch_size: Optional[int] = 10_000,
+        status_store: Optional[str] = None,
+        export_xlsx: Optional[bool] = True,
+        shard: Optional[tuple] = None,
+        shard_by: Optional[str] = "id",
+        metrics_hooks: Optional[list] = None,
+        progress_interval: Optional[float] = 5.0,
+        check_xref: Optional[bool] = False,
+        dns_ttl: Optional[float] = 300.0,
+        prefetch_dns: Optional[bool] = False,
+        happy_eyeballs_delay: Optional[float] = 0.25,
+        circuit_threshold: Optional[int] = 5,
+        circuit_reset_timeout: Optional[float] = 30.0,
+        prioritize: Optional[bool] = True,
+        deadline: Optional[float] = None,
+        min_transfer_rate: Optional[float] = None,
+        rate_grace: Optional[float] = 10.0,
+        max_threads: Optional[int] = 64,
+        coalesce: Optional[bool] = True,
+        redirect_ttl: Optional[float] = 7 * 24 * 3600.0,
+        redirect_cache: Optional[str] = None,
+        manifest_file: Optional[str] = None,
+        layout: Optional[str] = "flat",
+        archive: Optional[str] = None,
+        archive_shard_bytes: Optional[int] = 1024**3,
+        compact_parts: Optional[int] = 32,
     ) -> None:
-        self.number_of_threads = number_of_threads
-        self.url_file = url_file
+        # "auto" tunes the number of concurrent downloads while the run goes, between 1 and max_threads
+        self.auto_concurrency = number_of_threads == "auto"
+        self.number_of_threads = max_threads if self.auto_concurrency else number_of_threads
+        self.chunk_size = chunk_size
+        # "threads" runs one OS thread per worker, "async" runs number_of_threads concurrent downloads on one event loop
+        self.engine = engine
+        # Upper bounds for the downloads in flight against one host and the requests per second sent to it
+        self.per_host_limit = per_host_limit
+        self.rate_per_host = rate_per_host
+        # One url file or a list of them, downloaded one after the other by the same workers
+        self.url_files = [url_file] if isinstance(url_file, (str, os.PathLike)) else list(url_file)
+        self.url_file = self.url_files[0]
+        # Number of input rows read and queued at a time
+        self.batch_size = batch_size
         self.meta_file = meta_file
         self.destination = destination
+        # "flat" puts every file straight into the destination, "hash" and "prefix" spread them over subdirectories so
+        # folders stay small with millions of files. The path of every file is stored with its status
+        self.layout = DestinationLayout(destination, layout)
 
-        self.download_status_list = []
-        self.list_lock = threading.RLock()
+        # Statuses of this run, collected per worker thread and turned into columns once the workers are done
+        self.statuses = StatusCollector()
+        self.state_lock = threading.Lock()
         self.ID = "BRnum"
+        # Statuses are kept in a directory of Parquet files that every run appends one part to. During a run every status
+        # is appended to the journal the moment it arrives, so a crashed run can resume where it stopped. The journal is
+        # folded into the store when the run ends, and the parts are compacted into one once there are more than
+        # compact_parts of them. 0 or None never compacts. The meta workbook is only an optional export
+        self.compact_parts = compact_parts
+        if status_store is None:
+            status_store = os.path.splitext(meta_file)[0] + ".status"
+        # (index, count) to only download the rows of one shard. Rows are split by a hash of their id, or of their
+        # host with shard_by="host" so every host is only contacted from one shard
+        self.shard = shard
+        self.shard_by = shard_by
+        suffix = f".shard-{shard[0]}-of-{shard[1]}" if shard else ""
+        if journal_file is None:
+            journal_file = os.path.splitext(meta_file)[0] + suffix + ".journal.jsonl"
+        self.status_store = StatusStore(status_store)
+        self.journal = StatusJournal(journal_file)
+        # Size, modification time and SHA-256 of the files in the destination as of the last verify
+        if manifest_file is None:
+            manifest_file = os.path.splitext(meta_file)[0] + suffix + ".manifest.parquet"
+        self.manifest_file = manifest_file
+        self.resumed_from_store = False
+        self.export_xlsx = export_xlsx
+        # With refresh every row is requested again, conditionally where the journal holds validators for it
+        self.refresh = refresh
+        # Details of earlier downloads by id, and the path of the first file seen with a given SHA-256
+        self.validators = {}
+        self.content_index = {}
+        self.index_lock = threading.Lock()
+        # Transient failures are retried with backoff, at most retry_budget extra requests over the whole run
+        self.retry_budget = retry_budget
+        self.retry_policy = RetryPolicy(max_attempts, budget=retry_budget)
+        # Skips rows whose last attempt failed in a way retrying will not fix, such as a 404 or an html page
+        self.skip_permanent_failures = skip_permanent_failures
+        # Files of at least parallel_threshold bytes are split into parallel_ranges concurrent range requests
+        self.parallel_ranges = parallel_ranges
+        self.parallel_threshold = parallel_threshold
+        # Every body is sniffed for the pdf header and trailer, check_xref also checks its cross-reference table
+        self.check_xref = check_xref
+        # Shared by all workers for the whole run so keep-alive connections are reused across files and hosts
+        self.session = None
+        # Phase timings of every download go to the hooks, such as a JSONL trace file or a Prometheus text file
+        self.metrics = DownloadMetrics(metrics_hooks)
+        self.tuner = ConcurrencyTuner(self.metrics, maximum=max_threads) if self.auto_concurrency else None
+        # Seconds between progress reports, None or 0 turns them off
+        self.progress_interval = progress_interval
+        # Host names are resolved once per dns_ttl seconds for all workers, 0 or None leaves it to the system resolver.
+        # prefetch_dns resolves every host of the input before the downloads start. Rows whose hosts did not resolve, in
+        # the prefetch or in a lookup during the run the cache still remembers, go straight to their alternative url or
+        # are recorded as failed without a request
+        self.dns_ttl = dns_ttl
+        self.dns_cache = DnsCache(ttl=dns_ttl) if dns_ttl else None
+        self.prefetch_dns = prefetch_dns
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self.dead_hosts = set()
+        self.dead_rows = 0
+        # After circuit_threshold consecutive connect failures or timeouts against a host its remaining rows fail at once,
+        # until a probe after circuit_reset_timeout seconds finds it back. 0 or None turns the circuit breaker off
+        self.circuit_breaker = CircuitBreaker(circuit_threshold, circuit_reset_timeout) if circuit_threshold else None
+        # With prioritize rows never tried before are downloaded first and rows that failed before last, smaller files
+        # first where earlier runs recorded their size
+        self.prioritize = prioritize
+        # No download starts more than deadline seconds after the run started and transfers still going are cut off.
+        # Rows left over are picked up by the next run
+        self.deadline = deadline
+        self.deadline_at = None
+        self.skipped_rows = 0
+        # A transfer slower than min_transfer_rate bytes per second after rate_grace seconds is abandoned and put back at
+        # the end of the queue, from where it runs once more without the floor, resuming its partial file where it can
+        self.min_transfer_rate = min_transfer_rate
+        self.rate_grace = rate_grace
+        self.slow_names = set()
+        # Worker threads live as long as the handler so several url files and runs reuse them. Setting cancelled stops
+        # the run, which Ctrl+C does while the handler runs in the main thread
+        self.pool = None
+        self.scheduler = None
+        self.cancelled = threading.Event()
+        # With coalesce rows that share the same urls are downloaded once and the file is linked to all of them
+        self.coalescer = RequestCoalescer() if coalesce else None
+        # Where urls redirected to is remembered for redirect_ttl seconds, in a file next to the meta file so later runs
+        # go straight to the final urls. 0 or None turns it off
+        if redirect_cache is None:
+            redirect_cache = os.path.splitext(meta_file)[0] + ".redirects.json"
+        self.redirect_cache = RedirectCache(redirect_cache, redirect_ttl) if redirect_ttl else None
+        # With archive set to "zip", "tar" or "tar.zst" every finished download is moved into archive shards of about
+        # archive_shard_bytes in the destination instead of staying a file of its own
+        self.archive = ArchiveWriter(destination, archive, archive_shard_bytes, prefix="pdfs" + suffix) if archive else None
 
-    def add_download_status(self, item):
-        with self.list_lock:  # Lock can be acquired multiple times by the same thread
-            self.download_status_list.append(item)
+    # Records the status of a download. details are the validators, hash and path of a downloaded file, and result the
+    # DownloadResult the bytes and time of the download are taken from
+    def add_download_status(self, item, details: Optional[dict] = None, result: Optional[DownloadResult] = None):
+        if details and item[1] == "yes" and details.get("path"):
+            if self.archive is not None:
+                details = self.archive_download(item[0], details, result is not None and result.not_modified)
+            elif details.get("sha256"):
+                self.deduplicate(details["path"], details["sha256"])
+        self.record_status(item, details, result)
 
-    # Function that starts a download instance using the downloader class. Used in threads
-    def thread_downloader(self, queue: Queue) -> None:
-        while not queue.empty():
+    # Records a status as it is, for the run's statuses, the journal and the rows that shared the download
+    def record_status(self, item, details: Optional[dict] = None, result: Optional[DownloadResult] = None) -> None:
+        if result is not None:
+            self.statuses.add(item[0], item[1] == "yes", result.bytes_received, sum(result.timings.values()))
+        else:
+            self.statuses.add(item[0], item[1] == "yes")
+        record = dict(zip([self.ID, "pdf_downloaded"], item))
+        if details:
+            record.update(details)
+        self.journal.append(record)
+        if self.coalescer is not None:
+            for follower in self.coalescer.complete(item[0], (item[1], details, item[0])):
+                self.share_download(follower, item[1], details, item[0])
+
+    # Moves a finished download into the archive and returns its details with the path of the shard. A file the server
+    # confirmed unchanged keeps its entry, and a file whose content is archived already points at those bytes. A file
+    # that can not be archived stays where it is
+    def archive_download(self, name, details: dict, not_modified: bool = False) -> dict:
+        entry = self.archive.find(name) if not_modified else None
+        if entry is not None:
+            return dict(details, path=entry["path"])
+        existing = self.archive.duplicate(details.get("sha256"))
+        try:
+            if existing == str(name):
+                entry = self.archive.find(name)
+            elif existing is not None:
+                entry = self.archive.alias(name, existing)
+            if entry is None:
+                entry = self.archive.add(name, details["path"])
+        except (OSError, ValueError) as error:
+            logger.warning("Could not archive %s, keeping it at %s: %s", name, details["path"], error)
+            return details
+        try:
+            os.remove(details["path"])
+        except OSError:
+            pass
+        return dict(details, path=entry["path"])
+
+    # Gives a row the outcome of the row with the same urls whose download it shared. The downloaded file is hardlinked
+    # to the row's own path, or copied where the file system has no hardlinks. In an archive the row's index entry
+    # points at the bytes of the leader's file instead
+    def share_download(self, name, status: str, details: Optional[dict], leader=None) -> None:
+        details = dict(details or {}, attempts=0)
+        if status == "yes" and details.get("path"):
+            entry = self.archive.alias(name, leader) if self.archive is not None else None
+            if entry is not None:
+                self.record_status((name, status), dict(details, path=entry["path"]))
+                return
+            path = self.layout.path(name)
+            try:
+                link_or_copy(details["path"], path)
+            except OSError as error:
+                logger.warning("Could not share the download of %s with %s: %s", details["path"], name, error)
+                self.add_download_status((name, "no"), {"failure": "other", "attempts": 0})
+                return
+            details["path"] = path
+        self.add_download_status((name, status), details)
+
+    # Replaces a file with a hardlink to an earlier file with the same content so identical reports are only stored once
+    def deduplicate(self, path: str, sha256: str) -> None:
+        with self.index_lock:
+            existing = self.content_index.get(sha256)
+            if existing is None or existing == path or not os.path.exists(existing):
+                self.content_index[sha256] = path
+                return
+        try:
+            if os.path.samefile(existing, path):
+                return
+            link_path = path + ".link"
+            os.link(existing, link_path)
+            os.replace(link_path, path)
+        except OSError:
+            # Hardlinks are an optimisation, a file system without them just keeps the copy
+            pass
 
-            link, destination, name, alt_link = queue.get()
+    # Loads the validators and content hashes of earlier downloads
+    def load_cache(self, statuses) -> None:
+        if "sha256" not in statuses.columns:
+            return
+        columns = [column for column in ["url", "etag", "last_modified", "content_length", "sha256", "path"] if column in statuses.columns]
+        cached = statuses.filter((pl.col("pdf_downloaded") == "yes") & pl.col("sha256").is_not_null())
+        for row in cached.select([self.ID] + columns).iter_rows(named=True):
+            # An archived file is not at its own path, but still allows a conditional request
+            if self.archive is not None and row[self.ID] in self.archive:
+                row["archived"] = True
+            self.validators[row[self.ID]] = row
+            # Only loose files can be hardlinked, not the archive shards a path may point at
+            if row.get("path") and row["path"].endswith(".pdf"):
+                self.content_index.setdefault(row["sha256"], row["path"])
 
-            downloader = Downloader()
+    # Function that starts a download instance using the downloader class. Used in threads
+    def thread_downloader(self, scheduler: HostScheduler) -> None:
+        downloader = Downloader(
+            self.session,
+            self.chunk_size,
+            self.retry_policy,
+            self.parallel_ranges,
+            self.parallel_threshold,
+            check_xref=self.check_xref,
+            circuit_breaker=self.circuit_breaker,
+            min_transfer_rate=self.min_transfer_rate,
+            rate_grace=self.rate_grace,
+            deadline=self.deadline_at,
+            cancelled=self.cancelled,
+            redirect_cache=self.redirect_cache,
+        )
+        while True:
+            task = scheduler.get()
+            if task is None:
+                break
+            host, item = task
+            try:
+                self.download_item(downloader, scheduler, item)
+            except Exception:
+                # One broken row must not take the worker down with it
+                logger.exception("Unexpected error while downloading %s", item[2])
+            finally:
+                scheduler.task_done(host)
+
+    # Downloads one row handed out by the scheduler and records its status
+    def download_item(self, downloader: Downloader, scheduler: HostScheduler, item) -> None:
+        link, destination, name, alt_link = item
+        # Rows handed out after the deadline or after cancelling are left for the next run
+        if self.past_deadline() or self.cancelled.is_set():
+            with self.state_lock:
+                self.skipped_rows += 1
+            return
+        path = os.path.join(destination, f"{name}.pdf")
+        started = self.metrics.started()
+        with self.state_lock:
+            rate_floor = name not in self.slow_names
+        try:
             downloaded = downloader.download_handling(
                 url=link,
-                destination_path=os.path.join(destination, name + ".pdf"),
+                destination_path=path,
                 alt_url=alt_link,
+                validators=self.validators.get(name),
+                rate_floor=rate_floor,
             )
+        except Exception:
+            logger.exception("Unexpected error while downloading %s", name)
+            downloaded = DownloadResult()
+            downloaded.failure = "other"
 
-            if downloaded:
-                state = "yes"
-            else:
-                state = "no"
-            self.add_download_status((name, state))
-            queue.task_done()
+        # Lets the scheduler adapt the limits of every host that was contacted
+        for url, status_code, latency, retry_after in downloaded.responses:
+            scheduler.report(host_of(url), status_code, latency, retry_after)
 
-    def import_data_files(self):
-        file_data = pl.read_excel(source=self.url_file, columns=["BRnum", "Pdf_URL", "Report Html Address"])
+        # A straggler goes to the back of its host's queue so it no longer holds up the rest of the run, and a download
+        # cut off by cancelling is left for the next run
+        if downloaded.failure == "slow" and rate_floor:
+            with self.state_lock:
+                self.slow_names.add(name)
+            self.metrics.finished(name, downloaded, started, completed=False)
+            scheduler.put(item, force=True)
+            return
+        if downloaded.failure == "cancelled":
+            self.metrics.finished(name, downloaded, started, completed=False)
+            return
+        self.metrics.finished(name, downloaded, started)
+
+        if downloaded:
+            self.add_download_status((name, "yes"), dict(downloaded.details(), path=path), downloaded)
+        else:
+            self.add_download_status((name, "no"), downloaded.details(), downloaded)
+
+    def past_deadline(self) -> bool:
+        return self.deadline_at is not None and time.monotonic() >= self.deadline_at
+
+    # Returns a lazy query over the url file. csv and parquet files are scanned, workbooks have to be read whole.
+    # Ids are always strings, as they name the files, so an id such as 1001 is the same id whatever the format
+    def scan_url_file(self) -> pl.LazyFrame:
+        columns = ["BRnum", "Pdf_URL", "Report Html Address"]
+        extension = os.path.splitext(self.url_file)[1].lower()
+        if extension == ".csv":
+            file_data = pl.scan_csv(self.url_file, schema_overrides={self.ID: pl.String}).select(columns)
+        elif extension in (".parquet", ".pq"):
+            file_data = pl.scan_parquet(self.url_file).select(columns)
+        else:
+            file_data = pl.read_excel(source=self.url_file, columns=columns).lazy()
+        return file_data.with_columns(pl.col(self.ID).cast(pl.String))
+
+    # Keeps the rows that belong to this shard. Rows are split by the CRC-32 of their key rather than a polars hash,
+    # which is only stable within one polars version, so shards run on machines with different versions still agree
+    def shard_filter(self, file_data: pl.LazyFrame) -> pl.LazyFrame:
+        index, count = self.shard
+        if self.shard_by == "host":
+            link = pl.when(pl.col("Pdf_URL").fill_null("") != "").then(pl.col("Pdf_URL")).otherwise(pl.col("Report Html Address"))
+            key = link.str.extract(r"^[^:/?#]+://([^/?#]+)", 1).str.to_lowercase().fill_null("")
+        else:
+            key = pl.col(self.ID).cast(pl.String)
+        return file_data.filter(key.map_batches(shard_hash, return_dtype=pl.UInt32) % count == index)
+
+    # Returns the rows still to download as a lazy query, together with the statuses of the files already downloaded
+    def scan_data_files(self):
+        file_data = self.scan_url_file()
+        if self.shard is not None:
+            file_data = self.shard_filter(file_data)
 
         # Initiates empty dataframe
         meta_data = pl.DataFrame()
+        # Resumes from the status store and the journal of an unfinished run, and only falls back to parsing the meta
+        # workbook when neither exists
+        self.resumed_from_store = self.status_store.exists() or self.journal.exists()
+        if self.resumed_from_store:
+            downloaded = self.read_statuses("yes")
+            if not downloaded.is_empty():
+                self.load_cache(downloaded)
+                meta_data = downloaded.select([self.ID, "pdf_downloaded"])
+            failed = self.read_statuses("no") if self.prioritize or self.skip_permanent_failures and not self.refresh else pl.DataFrame()
+            if self.skip_permanent_failures and not self.refresh and not failed.is_empty():
+                permanent = failed.filter(pl.col("failure").is_in(list(PERMANENT_FAILURES)))
+                file_data = file_data.join(permanent.select(pl.col(self.ID).cast(pl.String)).lazy(), on=self.ID, how="anti")
         # Tries reading the files listed as not downloaded
-        if os.path.exists(self.meta_file):
+        elif os.path.exists(self.meta_file):
             meta_data = pl.read_excel(self.meta_file, columns=[self.ID, "pdf_downloaded"])
             meta_data = meta_data.filter(pl.col("pdf_downloaded") == "yes")
-            # Sort out files that are downloaded
-            file_data = file_data.join(meta_data, on=self.ID, how="anti")
+        if not meta_data.is_empty():
+            meta_data = meta_data.with_columns(pl.col(self.ID).cast(pl.String))
+        # Sort out files that are downloaded, unless they are all being revalidated
+        if not meta_data.is_empty() and not self.refresh:
+            file_data = file_data.join(meta_data.lazy(), on=self.ID, how="anti")
+        if self.prioritize and self.resumed_from_store:
+            file_data = self.prioritize_rows(file_data, downloaded if self.refresh else pl.DataFrame(), failed)
 
         return file_data, meta_data
 
-    def thread_handler(self, file_data):
-        queue = Queue()
-
-        #    # counter to only download 20 files
-        #    j = 0
-        # We thru each br number and starts a download
-        for row in file_data.rows(named=True):
-            #        if j == 20:
-            #            break
-            alt_link = row["Report Html Address"]
-            link = row["Pdf_URL"]
-            index = row[self.ID]
-            # Creates a new thread and adds them to the list so that we can make sure all downloads are done before exiting
-            queue.put([link, self.destination, index, alt_link])
-        #        j += 1
-        # Makes sure each thread is done
-        for i in range(self.number_of_threads):
-            thread = threading.Thread(target=self.thread_downloader, args=(queue,))
-            thread.start()
-
-        queue.join()
-
-    # Starts downlaoding files from urls listed in url_file which will be placed in the destination, and reported in the meta file
+    # Orders the rows so the ones never tried before come first, then revalidations of downloaded files, then the ones
+    # that failed before. Within each group the files of unknown size come first and the rest go from small to large.
+    # Sorting reads the whole input before the first download starts, so it is only done when there is history to use
+    def prioritize_rows(self, file_data: pl.LazyFrame, downloaded: pl.DataFrame, failed: pl.DataFrame) -> pl.LazyFrame:
+        history = []
+        for priority, statuses in ((1, downloaded), (2, failed)):
+            if not statuses.is_empty():
+                history.append(statuses.select(self.ID, pl.col("content_length").cast(pl.Int64), pl.lit(priority, dtype=pl.Int8).alias("priority")))
+        if not history:
+            return file_data
+        schema = file_data.collect_schema()
+        history = pl.concat(history).unique(subset=self.ID, keep="first", maintain_order=True).with_columns(pl.col(self.ID).cast(schema[self.ID], strict=False))
+        return (
+            file_data.join(history.lazy(), on=self.ID, how="left")
+            .with_columns(pl.col("priority").fill_null(0))
+            .sort(["priority", "content_length"], nulls_last=False, maintain_order=True)
+            .select(schema.names())
+        )
+
+    # Latest record of every id whose status is pdf_downloaded, from the status store and the journal of an unfinished
+    # run. The filter is pushed down into the Parquet scan so only matching rows are read. A file stays on disk once
+    # downloaded, so any "yes" counts even if a later revalidation of it failed, unless verify found it missing or
+    # corrupt since
+    def read_statuses(self, pdf_downloaded: str) -> pl.DataFrame:
+        matching = pl.col("pdf_downloaded") == pdf_downloaded
+        if pdf_downloaded == "yes":
+            matching = matching | pl.col("failure").is_in(list(LOST_FAILURES))
+        frames = []
+        stored = self.status_store.read(self.ID, matching)
+        if not stored.is_empty():
+            frames.append(stored)
+        journaled = self.journal.read(self.ID)
+        if not journaled.is_empty():
+            journaled = self.status_store.normalize(journaled, self.ID).filter(matching)
+            if not journaled.is_empty():
+                frames.append(journaled.cast({self.ID: stored.schema[self.ID]}) if frames else journaled)
+        if not frames:
+            return pl.DataFrame()
+        statuses = pl.concat(frames).unique(subset=self.ID, keep="last", maintain_order=True)
+        return statuses.filter(pl.col("pdf_downloaded") == pdf_downloaded)
+
+    def import_data_files(self):
+        file_data, meta_data = self.scan_data_files()
+        return file_data.collect(), meta_data
+
+    # Yields the rows of a DataFrame or LazyFrame in batches. A LazyFrame is evaluated in streaming mode where polars
+    # supports it, so the first batch is available before the whole input has been read
+    def iter_batches(self, file_data):
+        if isinstance(file_data, pl.LazyFrame):
+            if hasattr(file_data, "collect_batches"):
+                yield from file_data.collect_batches(chunk_size=self.batch_size)
+                return
+            file_data = file_data.collect()
+        yield from file_data.iter_slices(self.batch_size)
+
+    # Yields (id, link, alt link) for every row, read column by column so no dict is built per row
+    def iter_download_rows(self, file_data):
+        for batch in self.iter_batches(file_data):
+            yield from zip(batch[self.ID].to_list(), batch["Pdf_URL"].to_list(), batch["Report Html Address"].to_list())
+
+    # Resolves every distinct host of the rows to download in parallel and remembers the ones that do not resolve.
+    # Only the distinct host names are collected, not the rows
+    def prefetch_hosts(self, file_data) -> None:
+        if self.dns_cache is None:
+            return
+        netloc = r"^[^:/?#]+://([^/?#]+)"
+        links = pl.col("Pdf_URL").cast(pl.String).str.extract(netloc, 1).append(pl.col("Report Html Address").cast(pl.String).str.extract(netloc, 1))
+        netlocs = file_data.lazy().select(links.str.to_lowercase().unique().alias("netloc")).collect()["netloc"].drop_nulls().to_list()
+        hosts = set()
+        for value in netlocs:
+            try:
+                hosts.add(urlparse("//" + value).hostname)
+            except ValueError:
+                pass
+        self.dead_hosts = self.dns_cache.prefetch(hosts)
+        if self.dead_hosts:
+            logger.info("%d of %d hosts do not resolve, their rows use the alternative url or fail", len(self.dead_hosts), len(hosts))
+
+    # Yields (id, link, alt link) like iter_download_rows, with the links on hosts that do not resolve removed. A row
+    # left without any link is recorded as a dns failure straight away. A row whose urls a row before it already has
+    # is not yielded but shares that row's download
+    # Stops at the deadline or when the run is cancelled, leaving the rows not yet read for the next run
+    def download_rows(self, file_data):
+        for index, link, alt_link in self.iter_download_rows(file_data):
+            if self.past_deadline() or self.cancelled.is_set():
+                return
+            key = (link, alt_link)
+            if self.dead_hosts or self.dns_cache is not None:
+                live_link = link if self.resolvable(link) else None
+                live_alt_link = alt_link if self.resolvable(alt_link) else None
+                if (link or alt_link) and not (live_link or live_alt_link):
+                    self.dead_rows += 1
+                    self.add_download_status((index, "no"), {"failure": "dns", "attempts": 0})
+                    continue
+                link, alt_link = live_link, live_alt_link
+            # Rows without any url have nothing to share
+            if self.coalescer is not None and (key[0] or key[1]):
+                role, outcome = self.coalescer.claim(key, index)
+                if role == "follow":
+                    continue
+                if role == "done":
+                    self.share_download(index, *outcome)
+                    continue
+            yield index, link, alt_link
+
+    # A url is not resolvable when its host failed the prefetch, or failed a lookup during the run that the cache still
+    # remembers
+    def resolvable(self, url: Optional[str]) -> bool:
+        if not url:
+            return False
+        try:
+            host = urlparse(url).hostname
+        except ValueError:
+            return True
+        return host not in self.dead_hosts and not (self.dns_cache is not None and self.dns_cache.is_dead(host))
+
+    # Downloads the rows with number_of_threads worker threads. The workers start right away and the rows are fed
+    # to them while the input is still being read. With auto concurrency the tuner decides how many of the workers
+    # download at a time. Returns the number of rows queued
+    def thread_handler(self, file_data) -> int:
+        # Hands the rows to the workers round-robin across hosts, within each host's rate and concurrency limits.
+        # At most two batches wait in the scheduler so memory does not grow with the input
+        queue = HostScheduler(
+            rate_per_host=self.rate_per_host,
+            max_concurrency_per_host=self.per_host_limit,
+            max_pending=2 * self.batch_size,
+            circuit_breaker=self.circuit_breaker,
+            max_in_flight=self.tuner.workers if self.tuner is not None else 0,
+        )
+        if self.session is None:
+            self.session = create_session(self.number_of_threads, dns_cache=self.dns_cache, happy_eyeballs_delay=self.happy_eyeballs_delay)
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.number_of_threads, thread_name_prefix="download")
+        self.metrics.queue_depth = queue.qsize
+        self.scheduler = queue
+
+        # Every worker runs until the scheduler is closed and drained, then goes back to the pool for the next url file
+        workers = [self.pool.submit(self.thread_downloader, queue) for _ in range(self.number_of_threads)]
+        if self.tuner is not None:
+            self.tuner.apply = queue.set_max_in_flight
+            self.tuner.start()
+
+        queued = 0
+        try:
+            try:
+                # We thru each br number and starts a download
+                for index, link, alt_link in self.download_rows(file_data):
+                    queue.put([link, self.layout.directory(index), index, alt_link])
+                    queued += 1
+            finally:
+                queue.close()
+
+            queue.join()
+            for worker in workers:
+                worker.result()
+        finally:
+            if self.tuner is not None:
+                self.tuner.stop()
+            self.scheduler = None
+        return queued
+
+    # Downloads the rows with the asyncio engine. number_of_threads is used as the global concurrency limit, which the
+    # tuner lowers with auto concurrency
+    def async_handler(self, file_data) -> int:
+        queued = 0
+
+        def items():
+            nonlocal queued
+            for index, link, alt_link in self.download_rows(file_data):
+                queued += 1
+                yield link, self.layout.directory(index), index, alt_link
+
+        # Handling a result writes the journal, links duplicate files and may copy the file into an archive shard, all of
+        # which would stall every download on the event loop, so the results are handled by a writer thread
+        results = ThreadPoolExecutor(1, thread_name_prefix="results")
+        downloader = AsyncDownloader(
+            self.number_of_threads,
+            self.per_host_limit,
+            self.chunk_size,
+            retry_policy=self.retry_policy,
+            metrics=self.metrics,
+            check_xref=self.check_xref,
+            dns_ttl=self.dns_ttl,
+            happy_eyeballs_delay=self.happy_eyeballs_delay,
+            circuit_breaker=self.circuit_breaker,
+            min_transfer_rate=self.min_transfer_rate,
+            rate_grace=self.rate_grace,
+            deadline=self.deadline_at,
+            cancelled=self.cancelled,
+            redirect_cache=self.redirect_cache,
+            result_executor=results,
+        )
+        if self.tuner is not None:
+            downloader.limit = self.tuner.workers
+            self.tuner.apply = downloader.set_limit
+            self.tuner.start()
+        try:
+            downloader.run(items(), self.add_download_status, self.validators)
+        finally:
+            if self.tuner is not None:
+                self.tuner.stop()
+            results.shutdown(wait=True)
+        self.skipped_rows += downloader.skipped
+        return queued
+
+    # Moves the statuses of the journal into a new part of the status store. The part is written before the journal is
+    # removed, so a crash in between only leaves statuses that are stored twice. A store of more than compact_parts
+    # parts is compacted afterwards
+    def fold_journal(self) -> None:
+        if self.journal.exists():
+            statuses = self.journal.read(self.ID)
+            if not statuses.is_empty():
+                self.status_store.append(statuses, self.ID)
+            self.journal.remove()
+        # Shards append to the store at the same time, so only a run of its own may rewrite the parts
+        if self.shard is None and self.compact_parts and len(self.status_store.parts()) > self.compact_parts:
+            self.status_store.compact(self.ID)
+
+    # Scans the destination and reconciles the files on disk with the status store. Rows recorded as downloaded whose
+    # file is gone, is no complete pdf or is not the file that was downloaded are recorded as failed with "missing" or
+    # "corrupt", so the next run downloads them again, and complete pdfs of rows without a download recorded are
+    # recorded as downloaded. Files whose size and modification time did not change since the last verify are not
+    # hashed again, the others are hashed by processes processes. Returns the counts of every outcome
+    def verify(self, processes: Optional[int] = None) -> dict:
+        Path(self.destination).mkdir(exist_ok=True)
+        # Statuses left in the journal by an unfinished run are older than the ones recorded here
+        self.fold_journal()
+        manifest = DiskManifest(self.manifest_file, processes, self.check_xref)
+        files = manifest.scan(self.destination, self.ID)
+        # Archived files were checked as pdfs when they were downloaded, and their index holds their size and SHA-256
+        archived = ArchiveReader(self.destination)
+        if len(archived):
+            entries = [archived.entry(name) for name in archived.names()]
+            files = pl.concat(
+                [
+                    files,
+                    pl.DataFrame(
+                        {
+                            self.ID: archived.names(),
+                            "path": [entry["shard"] for entry in entries],
+                            "size": [entry["size"] for entry in entries],
+                            "sha256": [entry["sha256"] for entry in entries],
+                            "valid": [True] * len(entries),
+                        }
+                    ),
+                ],
+                how="diagonal_relaxed",
+            )
+        ids = self.url_file_ids()
+        id_type = ids.schema[self.ID]
+        # A row whose id has several files, say in different folders, is checked against a complete one where it has one
+        files = (
+            files.with_columns(pl.col(self.ID).cast(id_type, strict=False))
+            .join(ids, on=self.ID, how="semi")
+            .sort("valid", descending=True, maintain_order=True)
+            .unique(subset=self.ID, keep="first", maintain_order=True)
+        )
+        downloaded = self.read_statuses("yes")
+        if downloaded.is_empty():
+            downloaded = self.status_store.normalize(pl.DataFrame(schema={self.ID: id_type}), self.ID)
+        downloaded = downloaded.with_columns(pl.col(self.ID).cast(id_type, strict=False)).join(ids, on=self.ID, how="semi")
+
+        checked = downloaded.select(self.ID, "content_length", "sha256").join(
+            files.select(self.ID, "size", "valid", pl.col("sha256").alias("found_sha256")), on=self.ID, how="left"
+        )
+        changed = (pl.col("sha256").is_not_null() & (pl.col("sha256") != pl.col("found_sha256"))) | (
+            pl.col("content_length").is_not_null() & (pl.col("content_length") != pl.col("size"))
+        )
+        failure = pl.when(pl.col("valid").is_null()).then(pl.lit("missing")).when(~pl.col("valid") | changed).then(pl.lit("corrupt"))
+        lost = checked.select(self.ID, pl.lit("no").alias("pdf_downloaded"), failure.alias("failure")).drop_nulls("failure")
+        # A file found corrupt before stays so until it is downloaded again, even when it is a complete pdf
+        known = [downloaded.select(self.ID)]
+        failed = self.read_statuses("no")
+        if not failed.is_empty():
+            known.append(failed.filter(pl.col("failure").is_in(list(LOST_FAILURES))).select(pl.col(self.ID).cast(id_type, strict=False)))
+        recovered = (
+            files.filter(pl.col("valid"))
+            .join(pl.concat(known), on=self.ID, how="anti")
+            .select(self.ID, pl.lit("yes").alias("pdf_downloaded"), pl.col("size").alias("content_length"), "sha256", "path")
+        )
+        self.status_store.append(pl.concat([lost, recovered], how="diagonal"), self.ID)
+
+        counts = {
+            "files": files.height,
+            "hashed": manifest.hashed,
+            "missing": lost.filter(pl.col("failure") == "missing").height,
+            "corrupt": lost.filter(pl.col("failure") == "corrupt").height,
+            "recovered": recovered.height,
+        }
+        logger.info(
+            "Verified %d files, %d of them hashed: %d downloads missing, %d corrupt, %d found on disk",
+            counts["files"],
+            counts["hashed"],
+            counts["missing"],
+            counts["corrupt"],
+            counts["recovered"],
+        )
+        return counts
+
+    # Moves the files already downloaded to where the layout puts them, such as from a flat destination to a hashed
+    # one, and records their new paths with their statuses so later runs and verify find them without a scan. Returns
+    # the number of files moved
+    def migrate_layout(self) -> int:
+        self.fold_journal()
+        moved = self.layout.migrate()
+        if not moved:
+            return 0
+        DiskManifest(self.manifest_file).move(moved, self.ID)
+        downloaded = self.read_statuses("yes")
+        if not downloaded.is_empty():
+            paths = pl.DataFrame({"path": [target for _, target in moved]}, schema={"path": pl.String}).with_columns(
+                pl.col("path").str.extract(PDF_NAME, 1).cast(downloaded.schema[self.ID], strict=False).alias(self.ID)
+            )
+            self.status_store.append(downloaded.drop("path").join(paths.drop_nulls(self.ID), on=self.ID, how="inner"), self.ID)
+        logger.info("Moved %d files to the %s layout", len(moved), self.layout.scheme)
+        return len(moved)
+
+    # The ids of every url file, restricted to this shard
+    def url_file_ids(self) -> pl.DataFrame:
+        frames = []
+        for url_file in self.url_files:
+            self.url_file = url_file
+            file_data = self.scan_url_file()
+            if self.shard is not None:
+                file_data = self.shard_filter(file_data)
+            frames.append(file_data.select(self.ID).collect())
+        self.url_file = self.url_files[0]
+        id_type = frames[0].schema[self.ID]
+        return pl.concat([frame.cast({self.ID: id_type}, strict=False) for frame in frames]).drop_nulls().unique(maintain_order=True)
+
+    # Writes the statuses of this run together with the earlier downloaded files to the meta workbook
+    def export_meta_file(self, meta_data) -> None:
+        # The statuses are already columns, so the frame is built without going through the rows
+        finished_data_frame = self.statuses.frame(self.ID).select([self.ID, "pdf_downloaded"])
+
+        if not meta_data.is_empty():
+            # Files revalidated in this run are already part of the new statuses
+            if self.refresh:
+                meta_data = meta_data.join(finished_data_frame, on=self.ID, how="anti")
+            finished_data_frame = pl.concat([finished_data_frame, meta_data], rechunk=True)
+        with Workbook(self.meta_file) as file:
+            finished_data_frame.write_excel(workbook=file)
+
+    # Writes the latest status of every id in the status store to the meta workbook, sorted by id so the workbook is
+    # the same whatever order the shards finished in
+    def export_status_store(self) -> None:
+        statuses = self.status_store.read(self.ID)
+        if statuses.is_empty():
+            return
+        with Workbook(self.meta_file) as file:
+            statuses.select([self.ID, "pdf_downloaded"]).sort(self.ID).write_excel(workbook=file)
+
+    # Clears what an earlier call of handler left behind, so a run only exports, counts and retries its own rows
+    def reset_run(self) -> None:
+        self.statuses = StatusCollector()
+        self.slow_names = set()
+        self.dead_hosts = set()
+        self.dead_rows = 0
+        self.skipped_rows = 0
+        self.retry_policy.budget = self.retry_budget
+        if self.coalescer is not None:
+            self.coalescer = RequestCoalescer()
+
+    # Starts downlaoding files from urls listed in url_file which will be placed in the destination, and reported in the meta file.
+    # Ctrl+C cancels the run: downloads in flight are cut off with their partial files kept for resuming, and every
+    # status that already arrived is saved as usual. A second Ctrl+C stops at once
     def handler(self) -> None:
         # Tests if Path exist and if not creates directory
         Path(self.destination).mkdir(exist_ok=True)
+        self.deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        self.cancelled.clear()
+        self.reset_run()
+        previous_interrupt = None
+        if threading.current_thread() is threading.main_thread():
+            previous_interrupt = signal.signal(signal.SIGINT, self.interrupt)
+        self.metrics.start()
+        if self.redirect_cache is not None:
+            self.redirect_cache.load()
+        queued = 0
+        meta_data = None
+        try:
+            for url_file in self.url_files:
+                if self.past_deadline() or self.cancelled.is_set():
+                    break
+                self.url_file = url_file
+                file_queued, file_meta_data = self.handle_url_file()
+                queued += file_queued
+                # Only the first url file is compared against earlier runs alone, later ones already see this run
+                if meta_data is None:
+                    meta_data = file_meta_data
+        finally:
+            if previous_interrupt is not None:
+                signal.signal(signal.SIGINT, previous_interrupt)
+            self.journal.close()
+            self.metrics.close()
+            if self.redirect_cache is not None:
+                self.redirect_cache.save()
+            if self.archive is not None:
+                self.archive.close()
+        self.fold_journal()
+        if (queued or self.dead_rows) and self.export_xlsx:
+            self.export_meta_file(meta_data)
+
+        snapshot = self.metrics.snapshot()
+        if snapshot["completed"]:
+            logger.info(
+                "Downloads: %d succeeded, %d failed, %.1f files/s, %.1f MB/s. Seconds spent per phase: %s",
+                snapshot["succeeded"],
+                snapshot["failed"],
+                snapshot["files_per_second"],
+                snapshot["bytes_per_second"] / (1024 * 1024),
+                ", ".join(f"{phase} {seconds:.1f}" for phase, seconds in snapshot["phase_seconds"].items()),
+            )
+        if self.cancelled.is_set():
+            logger.warning("Run cancelled, the rows not downloaded yet are left for the next run")
+        elif self.past_deadline():
+            logger.warning("Deadline of %g seconds reached, the rows not downloaded yet are left for the next run", self.deadline)
+        if self.circuit_breaker is not None and self.circuit_breaker.open_hosts():
+            logger.info("Hosts left unreachable: %s", ", ".join(self.circuit_breaker.open_hosts()))
+        if self.coalescer is not None and self.coalescer.coalesced:
+            logger.info("%d rows shared the download of an earlier row with the same urls", self.coalescer.coalesced)
+        if self.redirect_cache is not None and self.redirect_cache.hits:
+            logger.info("%d requests went straight to the url they redirected to before", self.redirect_cache.hits)
+        if self.tuner is not None:
+            logger.info("Auto concurrency ended at %d concurrent downloads, pass it as the number of threads to pin it", self.tuner.workers)
+        if self.session is not None:
+            stats = connection_stats(self.session)
+            logger.info("HTTP requests: %d, connections opened: %d, connections reused: %d", stats["requests"], stats["connections"], stats["reused"])
+
+    # Downloads the rows of the current url file. Returns the number of rows queued and the statuses of the files
+    # downloaded before
+    def handle_url_file(self):
+        # The rows are only read as the downloads consume them, so whether there is anything to do is known afterwards
+        file_data, meta_data = self.scan_data_files()
+        # A meta workbook from before the status store existed is copied into it so later runs never parse the workbook.
+        # The first shard copies it for all of them
+        if not self.resumed_from_store and not meta_data.is_empty() and (self.shard is None or self.shard[0] == 0):
+            self.journal.append_many(dict(zip([self.ID, "pdf_downloaded"], row)) for row in meta_data.iter_rows())
+        if self.prefetch_dns:
+            self.prefetch_hosts(file_data)
+        progress = None
+        if self.progress_interval:
+            count_rows = None
+            if isinstance(file_data, pl.LazyFrame):
+                done = self.metrics.snapshot()["completed"]
+                count_rows = lambda: done + file_data.select(pl.len()).collect().item()
+            progress = ProgressReporter(self.metrics, self.progress_interval, count_rows)
+            progress.start()
+        try:
+            if self.engine == "async":
+                return self.async_handler(file_data), meta_data
+            return self.thread_handler(file_data), meta_data
+        finally:
+            if progress is not None:
+                progress.stop()
+
+    # SIGINT handler installed while the handler runs. The scheduler is cancelled from another thread because the
+    # signal may arrive while the main thread holds the scheduler's lock
+    def interrupt(self, signum, frame) -> None:
+        if self.cancelled.is_set():
+            raise KeyboardInterrupt
+        logger.warning("Cancelling the run, press Ctrl+C again to stop at once")
+        threading.Thread(target=self.cancel, name="cancel").start()
+
+    # Stops the run: rows not started yet are dropped and downloads in flight are cut off
+    def cancel(self) -> None:
+        self.cancelled.set()
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.cancel()
+
+    # Stops the worker threads and closes the connections. The handler can not be run again afterwards
+    def close(self) -> None:
+        if self.archive is not None:
+            self.archive.close()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# CRC-32 of every key, the same on every machine and polars version. A missing key hashes like an empty one
+def shard_hash(keys: pl.Series) -> pl.Series:
+    return pl.Series(keys.name, [zlib.crc32((key or "").encode("utf-8")) for key in keys], dtype=pl.UInt32)
+
+
+# Runs one shard in a worker process. Each shard has its own journal and appends its own parts to the status store
+def run_shard(arguments: dict, index: int, count: int) -> int:
+    with FileHandler(**arguments, shard=(index, count), export_xlsx=False) as file_handler:
+        file_handler.handler()
+        return len(file_handler.statuses)
 
-        file_data, meta_data = self.import_data_files()
-        if not file_data.is_empty():
-            self.thread_handler(file_data)
-            # Creates a dataframe from the dictionary of downloads
-            finished_data_frame = pl.DataFrame(self.download_status_list, schema=[self.ID, "pdf_downloaded"])
 
-            if not meta_data.is_empty():
-                finished_data_frame = pl.concat([finished_data_frame, meta_data], rechunk=True)
-            with Workbook(self.meta_file) as file:
-                finished_data_frame.write_excel(workbook=file)
+# Splits the url file into one shard per process so hashing, validation and the polars work use every core, then merges
+# the status shards into the meta workbook once all of them are done
+def run_sharded(processes: int, **arguments) -> int:
+    Path(arguments["destination"]).mkdir(exist_ok=True)
+    # Polars' thread pool deadlocks in forked children, so the workers are spawned
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(run_shard, arguments, index, processes) for index in range(processes)]
+        finished = sum(future.result() for future in futures)
+    # The shards are done, so the parts they appended can be compacted
+    file_handler = FileHandler(**arguments)
+    file_handler.fold_journal()
+    file_handler.export_status_store()
+    return finished
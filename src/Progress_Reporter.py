@@ -0,0 +1,83 @@
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Formats a number of seconds as h:mm:ss
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+# Reports the progress of a run every interval seconds from its own thread. It only reads the aggregates of a
+# DownloadMetrics, which the workers update in one short critical section per file, so the workers never wait on it.
+# Progress goes to a single overwritten line on a terminal and to the log otherwise. count_rows returns the number of
+# rows in the run. It is called on the reporter thread because counting a large input takes a while, and the ETA
+# is shown as ? until it returns
+class ProgressReporter(object):
+
+    def __init__(self, metrics, interval: float = 5.0, count_rows: Optional[Callable[[], int]] = None, stream=None) -> None:
+        self.metrics = metrics
+        self.interval = interval
+        self.count_rows = count_rows
+        self.stream = stream if stream is not None else sys.stderr
+        self.total = None
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="progress", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.report(final=True)
+
+    def run(self) -> None:
+        if self.count_rows is not None:
+            try:
+                self.total = self.count_rows()
+            except Exception:
+                logger.debug("Could not count the rows to download", exc_info=True)
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    # Builds the progress line. Rates are taken over the last interval, the ETA from the rate of the whole run
+    def line(self, snapshot: dict) -> str:
+        now = snapshot["elapsed"]
+        if self.last is not None and now > self.last["elapsed"]:
+            bytes_per_second = (snapshot["bytes"] - self.last["bytes"]) / (now - self.last["elapsed"])
+        else:
+            bytes_per_second = snapshot["bytes_per_second"]
+        self.last = snapshot
+        eta = None
+        if self.total is not None and snapshot["files_per_second"] > 0:
+            eta = max(self.total - snapshot["completed"], 0) / snapshot["files_per_second"]
+        done = f"{snapshot['completed']}/{self.total}" if self.total is not None else str(snapshot["completed"])
+        queued = snapshot["queue_depth"] if snapshot["queue_depth"] is not None else "?"
+        return (
+            f"{done} done ({snapshot['succeeded']} ok, {snapshot['failed']} failed), {snapshot['in_flight']} in flight, {queued} queued, "
+            f"{bytes_per_second / (1024 * 1024):.1f} MB/s, {snapshot['files_per_second']:.1f} files/s, "
+            f"elapsed {format_duration(now)}, ETA {format_duration(eta)}"
+        )
+
+    def report(self, final: bool = False) -> None:
+        snapshot = self.metrics.snapshot()
+        if not snapshot["completed"] and not snapshot["in_flight"] and final:
+            return
+        line = self.line(snapshot)
+        if getattr(self.stream, "isatty", lambda: False)():
+            self.stream.write("\r\033[K" + line + ("\n" if final else ""))
+            self.stream.flush()
+        else:
+            logger.info(line)
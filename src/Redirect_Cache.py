@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Failures of a request to a cached target that suggest the redirect changed, after which the original url is asked
+STALE_FAILURES = {"http_4xx", "not_pdf", "dns", "connect"}
+
+
+# Remembers where urls redirected to, so later requests go straight to the final url instead of paying for every hop
+# of url shorteners and CDN bounces again. Entries expire after ttl seconds and a target that stops answering is
+# forgotten. With a path the cache is loaded from and saved to a JSON file, so later runs start with it. Expiry times
+# are stored as wall clock times for that reason
+class RedirectCache(object):
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 7 * 24 * 3600) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # url -> (final url, expires)
+        self.entries = {}
+        # Urls whose target stopped answering, so a copy saved by another process is not taken over
+        self.forgotten = set()
+        self.changed = False
+        self.hits = 0
+
+    # Returns the url the request for url should go to
+    def resolve(self, url: str) -> str:
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return url
+            if entry[1] <= time.time():
+                del self.entries[url]
+                self.changed = True
+                return url
+            self.hits += 1
+            return entry[0]
+
+    # Remembers that url ended up at final_url
+    def record(self, url: str, final_url: str) -> None:
+        if not url or not final_url or url == final_url:
+            return
+        with self.lock:
+            self.entries[url] = (final_url, time.time() + self.ttl)
+            self.forgotten.discard(url)
+            self.changed = True
+
+    def forget(self, url: str) -> None:
+        with self.lock:
+            if self.entries.pop(url, None) is not None:
+                self.forgotten.add(url)
+                self.changed = True
+
+    def load(self) -> None:
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        entries = self.read()
+        now = time.time()
+        with self.lock:
+            for url, (final_url, expires) in entries.items():
+                if expires > now and url not in self.entries:
+                    self.entries[url] = (final_url, expires)
+
+    def read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return {url: tuple(entry) for url, entry in json.load(file).items()}
+        except (OSError, ValueError, TypeError) as error:
+            logger.warning("Could not read the redirect cache %s: %s", self.path, error)
+            return {}
+
+    # Writes the live entries. Entries another process saved in the meantime are kept unless this cache knows better,
+    # so shards running side by side do not drop each other's redirects. The file is replaced in one step
+    def save(self) -> None:
+        if self.path is None or not self.changed:
+            return
+        now = time.time()
+        stored = self.read() if os.path.isfile(self.path) else {}
+        with self.lock:
+            merged = {url: entry for url, entry in stored.items() if entry[1] > now and url not in self.forgotten}
+            merged.update((url, entry) for url, entry in self.entries.items() if entry[1] > now)
+            self.changed = False
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(merged, file)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+# Lets rows that share the same urls ride on a single download. Every row claims its key as it is read, so nothing
+# about the input has to be known up front. The first row of a key leads and is downloaded, rows claiming the key while
+# the leader is in flight follow it, and rows claiming it after the leader finished take the leader's outcome straight
+# away. Only the keys in flight and the outcomes of the last max_finished keys are tracked, so memory stays bounded
+# however long the input is. A key that comes up again after its outcome was dropped is downloaded again
+class RequestCoalescer(object):
+
+    def __init__(self, max_finished: int = 100_000) -> None:
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+        # name of a leader in flight -> its key, and key -> names of the rows following it
+        self.leaders = {}
+        self.followers = {}
+        # key -> outcome of its leader, least recently used first
+        self.finished = OrderedDict()
+        self.coalesced = 0
+
+    # Returns ("lead", None) when the row has to be downloaded, ("follow", None) when it gets the outcome of a leader
+    # in flight once that finishes, and ("done", outcome) when the leader already finished
+    def claim(self, key, name) -> tuple:
+        with self.lock:
+            if key in self.finished:
+                self.coalesced += 1
+                self.finished.move_to_end(key)
+                return "done", self.finished[key]
+            if key in self.followers:
+                self.coalesced += 1
+                self.followers[key].append(name)
+                return "follow", None
+            self.followers[key] = []
+            self.leaders[name] = key
+            return "lead", None
+
+    # Records the outcome of a row and returns the names of the rows following it, which share that outcome
+    def complete(self, name, outcome) -> list:
+        with self.lock:
+            key = self.leaders.pop(name, None)
+            if key is None:
+                return []
+            if self.max_finished:
+                self.finished[key] = outcome
+                if len(self.finished) > self.max_finished:
+                    self.finished.popitem(last=False)
+            return self.followers.pop(key, [])
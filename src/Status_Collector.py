@@ -0,0 +1,76 @@
+import threading
+from array import array
+import polars as pl
+
+# Type codes of the numeric columns of a StatusBuffer
+TYPECODES = {"downloaded": "b", "bytes": "q", "seconds": "d"}
+
+
+# Columns of the statuses one thread recorded. Only that thread appends to them, so no lock is needed, and the numbers
+# are kept in typed arrays at a few bytes per status instead of a tuple per row
+class StatusBuffer(object):
+
+    def __init__(self) -> None:
+        self.names = []
+        self.downloaded = array(TYPECODES["downloaded"])
+        self.bytes = array(TYPECODES["bytes"])
+        self.seconds = array(TYPECODES["seconds"])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+# Collects the status of every download of a run as columns. Every thread appends to a buffer of its own, so recording
+# a status never waits for another worker, and the buffers are concatenated column by column into a DataFrame once the
+# workers are done
+class StatusCollector(object):
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+        self.buffers = []
+
+    # The buffer of the calling thread, registered the first time the thread records a status
+    def buffer(self) -> StatusBuffer:
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = self.local.buffer = StatusBuffer()
+            # list.append is atomic, so registering needs no lock either
+            self.buffers.append(buffer)
+        return buffer
+
+    # Records one status. bytes_received and seconds are the bytes and time the download took
+    def add(self, name, downloaded: bool, bytes_received: int = 0, seconds: float = 0.0) -> None:
+        buffer = self.buffer()
+        buffer.names.append(name)
+        buffer.downloaded.append(1 if downloaded else 0)
+        buffer.bytes.append(bytes_received or 0)
+        buffer.seconds.append(seconds or 0.0)
+
+    def __len__(self) -> int:
+        return sum(len(buffer) for buffer in list(self.buffers))
+
+    # The statuses recorded so far as (name, "yes"/"no") tuples, in the order every thread recorded them
+    def rows(self) -> list:
+        return [(name, "yes" if downloaded else "no") for buffer in list(self.buffers) for name, downloaded in zip(buffer.names, buffer.downloaded)]
+
+    # The statuses as a DataFrame with the id_column, pdf_downloaded, bytes and seconds columns. Meant to be called once
+    # the workers have stopped, a status recorded while the columns are copied may be missed
+    def frame(self, id_column: str) -> pl.DataFrame:
+        buffers = [buffer for buffer in list(self.buffers) if len(buffer)]
+        downloaded = pl.Series("pdf_downloaded", self.concat(buffers, "downloaded"), dtype=pl.Int8)
+        return pl.DataFrame(
+            [
+                pl.Series(id_column, [name for buffer in buffers for name in buffer.names]),
+                downloaded.replace_strict({1: "yes", 0: "no"}, return_dtype=pl.String),
+                pl.Series("bytes", self.concat(buffers, "bytes"), dtype=pl.Int64),
+                pl.Series("seconds", self.concat(buffers, "seconds"), dtype=pl.Float64),
+            ]
+        )
+
+    # Joins one numeric column of every buffer into a single array, which copies the memory as a whole
+    @staticmethod
+    def concat(buffers: list, column: str) -> array:
+        joined = array(TYPECODES[column])
+        for buffer in buffers:
+            joined.extend(getattr(buffer, column))
+        return joined
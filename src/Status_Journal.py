@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Iterable, Optional
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+
+# Append-only JSONL journal of download statuses. Records are put on a queue and written by one writer thread, so the
+# threads recording statuses never wait for each other or for the disk. The writer hands every record to the OS as
+# soon as it arrives so a crashed run keeps everything it finished, while fsync is batched to keep its cost down
+class StatusJournal(object):
+
+    def __init__(self, path: str, fsync_every: Optional[int] = 100, fsync_interval: Optional[float] = 1.0) -> None:
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self.file = None
+        self.lock = threading.Lock()
+        self.queue = None
+        self.writer = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def exists(self) -> bool:
+        self.flush()
+        return os.path.isfile(self.path)
+
+    # The file is only opened on the first write so reading a journal never creates one
+    def open(self) -> None:
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+
+    # The writer is started on the first record, and again after the journal was closed
+    def start(self) -> None:
+        with self.lock:
+            if self.writer is None:
+                self.queue = queue.SimpleQueue()
+                self.writer = threading.Thread(target=self.write_records, args=(self.queue,), name="status-journal", daemon=True)
+                self.writer.start()
+
+    def append(self, record: dict) -> None:
+        if self.writer is None:
+            self.start()
+        self.queue.put(record)
+
+    def append_many(self, records: Iterable[dict]) -> None:
+        records = list(records)
+        if not records:
+            return
+        if self.writer is None:
+            self.start()
+        self.queue.put(records)
+
+    # Waits until every record appended so far is handed to the OS, and with fsync also synced to disk
+    def flush(self, fsync: bool = False) -> None:
+        writer = self.writer
+        if writer is None:
+            return
+        written = threading.Event()
+        self.queue.put((written, fsync))
+        while not written.wait(1.0):
+            if not writer.is_alive():
+                return
+
+    def sync(self) -> None:
+        self.flush(fsync=True)
+
+    # Runs on the writer thread. Writes whatever records are waiting in one go, and syncs the records that are still
+    # unsynced once the queue stayed empty for fsync_interval
+    def write_records(self, records: queue.SimpleQueue) -> None:
+        while True:
+            try:
+                message = records.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                self.sync_file()
+                continue
+            lines = []
+            waiting = []
+            stop = False
+            while True:
+                if message is None:
+                    stop = True
+                    break
+                if isinstance(message, tuple):
+                    waiting.append(message)
+                else:
+                    lines.extend(json.dumps(record, default=str) + "\n" for record in ([message] if isinstance(message, dict) else message))
+                try:
+                    message = records.get_nowait()
+                except queue.Empty:
+                    break
+            self.write_lines(lines)
+            if stop or any(fsync for _, fsync in waiting):
+                self.sync_file()
+            for written, _ in waiting:
+                written.set()
+            if stop:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                return
+
+    def write_lines(self, lines: list) -> None:
+        if not lines:
+            return
+        try:
+            self.open()
+            self.file.write("".join(lines))
+            self.file.flush()
+        except Exception:
+            # Losing the journal must not stop the downloads, the statuses are still collected for the run
+            logger.exception("Could not write %d statuses to %s", len(lines), self.path)
+            return
+        self.unsynced += len(lines)
+        if self.fsync_every and self.unsynced >= self.fsync_every or self.fsync_interval is not None and time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync_file()
+
+    def sync_file(self) -> None:
+        if self.file is not None and self.unsynced:
+            try:
+                os.fsync(self.file.fileno())
+            except OSError:
+                logger.exception("Could not sync %s", self.path)
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    # Writes and syncs every record appended so far and stops the writer
+    def close(self) -> None:
+        with self.lock:
+            writer = self.writer
+            if writer is None:
+                return
+            self.queue.put(None)
+            writer.join()
+            self.writer = None
+
+    # Closes and deletes the journal once its statuses are stored elsewhere
+    def remove(self) -> None:
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    # Reads the journal and keeps the latest record for every id
+    def read(self, id_column: str) -> pl.DataFrame:
+        if not self.exists() or os.path.getsize(self.path) == 0:
+            return pl.DataFrame()
+        try:
+            records = pl.read_ndjson(self.path, infer_schema_length=None)
+        except Exception:
+            # A crash can leave a torn last line, so fall back to parsing line by line and skip what cannot be decoded
+            rows = []
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        continue
+            if not rows:
+                return pl.DataFrame()
+            records = pl.DataFrame(rows, infer_schema_length=None)
+        return records.unique(subset=id_column, keep="last", maintain_order=True)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+import polars as pl
+
+# Columns stored for every status next to the id column. Every part file is written with this schema so the parts
+# can be scanned together and filters on them are pushed down into the Parquet reader
+STATUS_SCHEMA = {
+    "pdf_downloaded": pl.String,
+    "failure": pl.String,
+    "attempts": pl.Int64,
+    "url": pl.String,
+    "etag": pl.String,
+    "last_modified": pl.String,
+    "content_length": pl.Int64,
+    "sha256": pl.String,
+    "path": pl.String,
+}
+
+
+# Columnar store of download statuses. Each run appends its statuses as a new Parquet part file in a directory,
+# so nothing that was written before is ever rewritten. Later parts take precedence over earlier ones
+class StatusStore(object):
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def parts(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".parquet"))
+
+    def exists(self) -> bool:
+        return bool(self.parts())
+
+    # Brings a frame of statuses to the store schema, filling the columns it lacks with nulls. Ids are stored as strings
+    def normalize(self, frame: pl.DataFrame, id_column: str) -> pl.DataFrame:
+        columns = [pl.col(id_column).cast(pl.String)]
+        for name, dtype in STATUS_SCHEMA.items():
+            if name in frame.columns:
+                columns.append(pl.col(name).cast(dtype, strict=False))
+            else:
+                columns.append(pl.lit(None, dtype=dtype).alias(name))
+        return frame.select(columns)
+
+    # Writes the statuses as a new part file. The file is renamed into place so a crash never leaves a broken part
+    def append(self, frame: pl.DataFrame, id_column: str) -> Optional[str]:
+        if frame.is_empty():
+            return None
+        os.makedirs(self.path, exist_ok=True)
+        # Part names sort in the order they were written
+        name = f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet"
+        part_path = os.path.join(self.path, name)
+        self.normalize(frame, id_column).write_parquet(part_path + ".tmp")
+        os.replace(part_path + ".tmp", part_path)
+        return part_path
+
+    # Lazy scan over every part in the order they were written. Parts written before ids were always strings may hold
+    # integer ids, so every part is brought to string ids on its own
+    def scan(self, id_column: str) -> pl.LazyFrame:
+        return pl.concat([pl.scan_parquet(part).with_columns(pl.col(id_column).cast(pl.String)) for part in self.parts()])
+
+    # Latest status of every id among the statuses matching predicate. The predicate is applied inside the scan
+    def read(self, id_column: str, predicate: Optional[pl.Expr] = None) -> pl.DataFrame:
+        if not self.exists():
+            return pl.DataFrame()
+        statuses = self.scan(id_column)
+        if predicate is not None:
+            statuses = statuses.filter(predicate)
+        return statuses.unique(subset=id_column, keep="last", maintain_order=True).collect()
+
+    # Rewrites all parts into one holding only the latest status of every id
+    def compact(self, id_column: str) -> None:
+        parts = self.parts()
+        if len(parts) < 2:
+            return
+        self.append(self.read(id_column), id_column)
+        for part in parts:
+            os.remove(part)
+
+    # Copies the parts of other stores, such as the status shards written on other machines, into this one.
+    # Part names are unique, so merging the same store twice copies nothing new
+    def merge(self, *paths: str) -> int:
+        os.makedirs(self.path, exist_ok=True)
+        copied = 0
+        for part in sorted(part for path in paths for part in StatusStore(path).parts()):
+            target = os.path.join(self.path, os.path.basename(part))
+            if os.path.exists(target):
+                continue
+            shutil.copyfile(part, target + ".tmp")
+            os.replace(target + ".tmp", target)
+            copied += 1
+        return copied
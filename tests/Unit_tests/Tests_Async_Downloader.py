@@ -0,0 +1,277 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import sys
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Async_Downloader import AsyncDownloader
+from Downloader import DownloadResult, RetryPolicy
+
+
+class MockContent(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunked(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def read(self, size):
+        return b"".join(self.chunks)[:size]
+
+
+class MockResponse(object):
+    def __init__(self, status=200, content_type="application/pdf", chunks=(b"%PDF-1.4",), content_length=None, headers=None):
+        self.status = status
+        self.headers = dict(headers or {}, **{"content-type": content_type})
+        self.content = MockContent(chunks)
+        self.content_length = content_length
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class TestAsyncFetch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "id1.pdf")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_fetch_success(self):
+        # Arrange
+        session = MagicMock()
+        session.get.return_value = MockResponse(chunks=[b"%PDF", b"-1.4\n%%EOF"], content_length=14)
+        downloader = AsyncDownloader()
+
+        # Act
+        result = asyncio.run(downloader.fetch(session, "http://test.com/test.pdf", self.destination, DownloadResult()))
+
+        # Assert
+        self.assertTrue(result)
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), b"%PDF-1.4\n%%EOF")
+
+    def test_fetch_sniffs_html_served_as_binary(self):
+        # Arrange
+        page = b'<!DOCTYPE html><html><body><a href="/files/report.pdf">Report</a></body></html>'
+        session = MagicMock()
+        session.get.return_value = MockResponse(content_type="application/octet-stream", chunks=[page])
+        result = DownloadResult()
+
+        # Act
+        fetched = asyncio.run(AsyncDownloader().fetch(session, "http://test.com/report", self.destination, result))
+
+        # Assert
+        self.assertFalse(fetched)
+        self.assertEqual(result.failure, "not_pdf")
+        self.assertEqual(result.landing_links, ["http://test.com/files/report.pdf"])
+        self.assertFalse(os.path.exists(self.destination + ".part"))
+
+    def test_fetch_non_pdf(self):
+        # Arrange
+        session = MagicMock()
+        session.get.return_value = MockResponse(content_type="text/html")
+        downloader = AsyncDownloader()
+
+        # Act
+        result = asyncio.run(downloader.fetch(session, "http://test.com/test.html", self.destination, DownloadResult()))
+
+        # Assert
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.destination))
+
+    def test_fetch_classifies_failures(self):
+        # Arrange
+        session = MagicMock()
+        session.get.return_value = MockResponse(status=503)
+        result = DownloadResult()
+
+        # Act
+        asyncio.run(AsyncDownloader().fetch(session, "http://test.com/test.pdf", self.destination, result))
+
+        # Assert
+        self.assertEqual(result.failure, "http_5xx")
+
+    def test_fetch_truncated(self):
+        # Arrange
+        session = MagicMock()
+        session.get.return_value = MockResponse(chunks=[b"%PDF"], content_length=1000)
+        downloader = AsyncDownloader()
+
+        # Act
+        result = asyncio.run(downloader.fetch(session, "http://test.com/test.pdf", self.destination, DownloadResult()))
+
+        # Assert
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.destination + ".part"))
+
+    def test_retry_waits_as_long_as_retry_after_asks(self):
+        # Arrange
+        session = MagicMock()
+        session.get.side_effect = [MockResponse(status=429, headers={"retry-after": "7"}), MockResponse(status=503), MockResponse(chunks=[b"%PDF-1.4\n%%EOF"])]
+        downloader = AsyncDownloader(retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+
+        # Act
+        with patch("Async_Downloader.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+            result = asyncio.run(downloader.download_handling(session, "http://test.com/test.pdf", self.destination))
+
+        # Assert the first retry waited what the server asked, the second only the backoff
+        self.assertTrue(result)
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(delays[0], 7.0)
+        self.assertLess(delays[1], 1.0)
+        self.assertEqual([response[1] for response in result.responses], [429, 503, 200])
+
+    def test_fetch_not_modified(self):
+        # Arrange
+        with open(self.destination, "wb") as file:
+            file.write(b"%PDF-1.4")
+        session = MagicMock()
+        session.get.return_value = MockResponse(status=304)
+        validators = {"url": "http://test.com/test.pdf", "etag": '"abc"', "sha256": "cafe"}
+        result = DownloadResult()
+
+        # Act
+        fetched = asyncio.run(AsyncDownloader().fetch(session, "http://test.com/test.pdf", self.destination, result, validators))
+
+        # Assert
+        self.assertTrue(fetched)
+        self.assertTrue(result.not_modified)
+        self.assertEqual(result.sha256, "cafe")
+        self.assertEqual(session.get.call_args.kwargs["headers"], {"If-None-Match": '"abc"'})
+
+
+class TestAsyncDownloadAll(unittest.TestCase):
+    @patch.object(AsyncDownloader, "fetch", new_callable=AsyncMock)
+    def test_alt_url_fallback_and_result_shape(self, mock_fetch):
+        # Arrange
+        # Only the alt url of id2 and the main url of id1 succeed
+        mock_fetch.side_effect = lambda session, url, path, result, validators: url in ("main_1", "alt_2")
+        items = [("main_1", "dest", "id1", "alt_1"), ("main_2", "dest", "id2", "alt_2"), ("main_3", "dest", "id3", None)]
+        results = []
+        downloader = AsyncDownloader(max_concurrency=2)
+
+        # Act
+        downloader.run(items, lambda status, details=None, result=None: results.append(status))
+
+        # Assert
+        self.assertEqual(sorted(results), [("id1", "yes"), ("id2", "yes"), ("id3", "no")])
+
+    @patch.object(AsyncDownloader, "fetch", new_callable=AsyncMock)
+    def test_limit_caps_downloads_in_flight(self, mock_fetch):
+        # Arrange
+        downloader = AsyncDownloader(max_concurrency=8)
+        downloader.limit = 2
+        peak = 0
+
+        async def fetch(session, url, path, result, validators):
+            nonlocal peak
+            peak = max(peak, downloader.active)
+            await asyncio.sleep(0.01)
+            return True
+
+        mock_fetch.side_effect = fetch
+        items = [(f"main_{i}", "dest", f"id{i}", None) for i in range(10)]
+        results = []
+
+        # Act
+        downloader.run(items, lambda status, details=None, result=None: results.append(status))
+
+        # Assert
+        self.assertEqual(len(results), 10)
+        self.assertEqual(peak, 2)
+
+    @patch.object(AsyncDownloader, "fetch", new_callable=AsyncMock)
+    def test_results_handed_to_the_executor_do_not_stall_the_loop(self, mock_fetch):
+        # Arrange a result handler that blocks until the second download finishes
+        second_done = threading.Event()
+
+        async def fetch(session, url, path, result, validators):
+            if url == "main_1":
+                await asyncio.sleep(0.05)
+                second_done.set()
+            return True
+
+        mock_fetch.side_effect = fetch
+        waited = []
+        threads = set()
+
+        def on_result(status, details=None, result=None):
+            threads.add(threading.current_thread().name)
+            if status[0] == "id0":
+                waited.append(second_done.wait(2))
+
+        items = [(f"main_{i}", "dest", f"id{i}", None) for i in range(2)]
+
+        # Act
+        with ThreadPoolExecutor(1, thread_name_prefix="archive") as executor:
+            AsyncDownloader(max_concurrency=2, result_executor=executor).run(items, on_result)
+
+        # Assert the second download went on while the first result was handled, off the event loop
+        self.assertEqual(waited, [True])
+        self.assertEqual(threads, {"archive_0"})
+
+    @patch.object(AsyncDownloader, "download_handling", new_callable=AsyncMock)
+    def test_unexpected_errors_are_logged_as_failures(self, mock_handling):
+        # Arrange
+        mock_handling.side_effect = KeyError("boom")
+        results = []
+
+        # Act
+        with self.assertLogs("Async_Downloader", "ERROR") as logs:
+            AsyncDownloader(max_concurrency=2).run([("main_1", "dest", "id1", None)], lambda status, details=None, result=None: results.append((status, result.failure)))
+
+        # Assert
+        self.assertEqual(results, [(("id1", "no"), "other")])
+        self.assertIn("KeyError: 'boom'", logs.output[0])
+
+    @patch.object(AsyncDownloader, "fetch", new_callable=AsyncMock)
+    def test_failing_result_handler_does_not_end_the_run(self, mock_fetch):
+        # Arrange a result handler that fails for the first item
+        mock_fetch.return_value = True
+        results = []
+
+        def on_result(status, details=None, result=None):
+            if status[0] == "id0":
+                raise OSError("disk full")
+            results.append(status)
+
+        items = [(f"main_{i}", "dest", f"id{i}", None) for i in range(4)]
+
+        # Act
+        with self.assertLogs("Async_Downloader", "ERROR"):
+            with ThreadPoolExecutor(1) as executor:
+                AsyncDownloader(max_concurrency=1, result_executor=executor).run(items, on_result)
+
+        # Assert
+        self.assertEqual(results, [("id1", "yes"), ("id2", "yes"), ("id3", "yes")])
+
+    @patch.object(AsyncDownloader, "fetch", new_callable=AsyncMock)
+    def test_failing_items_end_the_input_but_not_the_run(self, mock_fetch):
+        # Arrange
+        mock_fetch.return_value = True
+        results = []
+
+        def items():
+            yield "main_0", "dest", "id0", None
+            raise ValueError("broken row")
+
+        # Act
+        with self.assertLogs("Async_Downloader", "ERROR"):
+            AsyncDownloader(max_concurrency=2).run(items(), lambda status, details=None, result=None: results.append(status))
+
+        # Assert
+        self.assertEqual(results, [("id0", "yes")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Circuit_Breaker import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    @patch("Circuit_Breaker.time.monotonic", return_value=100.0)
+    def test_opens_after_consecutive_host_failures(self, mock_monotonic):
+        # Arrange
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+
+        # Act
+        breaker.record("a.com", "connect")
+        breaker.record("a.com", "read_timeout")
+        allowed_before = breaker.allow("a.com")
+        breaker.record("a.com", "connect")
+
+        # Assert
+        self.assertTrue(allowed_before)
+        self.assertFalse(breaker.allow("a.com"))
+        self.assertTrue(breaker.is_open("a.com"))
+        self.assertTrue(breaker.allow("b.com"))
+        self.assertEqual(breaker.open_hosts(), ["a.com"])
+
+    def test_answers_reset_the_failure_count(self):
+        # Arrange
+        breaker = CircuitBreaker(failure_threshold=2)
+
+        # Act a 404 is an answer, so the host is alive
+        breaker.record("a.com", "connect")
+        breaker.record("a.com", "http_4xx")
+        breaker.record("a.com", "connect")
+
+        # Assert
+        self.assertTrue(breaker.allow("a.com"))
+        self.assertEqual(breaker.open_hosts(), [])
+
+    @patch("Circuit_Breaker.time.monotonic")
+    def test_half_open_lets_one_probe_through(self, mock_monotonic):
+        # Arrange
+        mock_monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+        breaker.record("a.com", "connect")
+
+        # Act
+        mock_monotonic.return_value = 131.0
+        probe = breaker.allow("a.com")
+        second = breaker.allow("a.com")
+
+        # Assert only the first caller probes, the others keep failing fast
+        self.assertTrue(probe)
+        self.assertFalse(second)
+        self.assertTrue(breaker.is_open("a.com"))
+
+    @patch("Circuit_Breaker.time.monotonic")
+    def test_failed_probe_doubles_the_wait(self, mock_monotonic):
+        # Arrange
+        mock_monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+        breaker.record("a.com", "connect")
+        mock_monotonic.return_value = 131.0
+        breaker.allow("a.com")
+
+        # Act
+        breaker.record("a.com", "connect")
+
+        # Assert
+        mock_monotonic.return_value = 180.0
+        self.assertFalse(breaker.allow("a.com"))
+        mock_monotonic.return_value = 192.0
+        self.assertTrue(breaker.allow("a.com"))
+
+    @patch("Circuit_Breaker.time.monotonic")
+    def test_successful_probe_closes_the_circuit(self, mock_monotonic):
+        # Arrange
+        mock_monotonic.return_value = 100.0
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30.0)
+        breaker.record("a.com", "dns")
+        mock_monotonic.return_value = 131.0
+        breaker.allow("a.com")
+
+        # Act
+        breaker.record("a.com", None)
+
+        # Assert
+        self.assertTrue(breaker.allow("a.com"))
+        self.assertTrue(breaker.allow("a.com"))
+        self.assertFalse(breaker.is_open("a.com"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from unittest.mock import MagicMock
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Concurrency_Tuner import ConcurrencyTuner
+
+
+class TestConcurrencyTuner(unittest.TestCase):
+    def test_grows_while_throughput_improves_and_settles_at_the_knee(self):
+        # Arrange files/s that grow with the count up to 9 workers and stay flat from there
+        applied = []
+        tuner = ConcurrencyTuner(MagicMock(), apply=applied.append, initial=4, maximum=64)
+
+        # Act
+        with self.assertLogs("Concurrency_Tuner", level="INFO") as logs:
+            while not tuner.settled:
+                tuner.observe(min(tuner.workers, 9) * 10.0, 0.0, 0.1)
+
+        # Assert
+        self.assertEqual(applied, [6, 9, 14, 9])
+        self.assertEqual(tuner.workers, 9)
+        self.assertIn("settled at 9", logs.output[-1])
+
+    def test_stops_growing_at_the_maximum(self):
+        # Arrange
+        tuner = ConcurrencyTuner(MagicMock(), initial=4, maximum=8)
+
+        # Act
+        while not tuner.settled:
+            with self.assertNoLogs("Concurrency_Tuner", level="WARNING"):
+                tuner.observe(tuner.workers * 10.0, 0.0, 0.1)
+
+        # Assert
+        self.assertEqual(tuner.workers, 8)
+
+    def test_backs_off_when_errors_rise(self):
+        # Arrange
+        tuner = ConcurrencyTuner(MagicMock(), initial=16)
+        tuner.observe(100.0, 0.05, 0.1)
+
+        # Act
+        with self.assertLogs("Concurrency_Tuner", level="INFO"):
+            workers = tuner.observe(100.0, 0.3, 0.1)
+
+        # Assert the count had grown to 24 after the first window and is halved
+        self.assertEqual(workers, 12)
+        self.assertFalse(tuner.settled)
+
+    def test_backs_off_when_latency_rises(self):
+        # Arrange
+        tuner = ConcurrencyTuner(MagicMock(), initial=16)
+        tuner.observe(100.0, 0.0, 0.1)
+
+        # Act
+        with self.assertLogs("Concurrency_Tuner", level="INFO"):
+            workers = tuner.observe(100.0, 0.0, 0.5)
+
+        # Assert
+        self.assertEqual(workers, 12)
+        self.assertIsNone(tuner.best_workers)
+
+    def test_waits_for_enough_downloads_before_deciding(self):
+        # Arrange
+        metrics = MagicMock()
+        metrics.snapshot.return_value = {"elapsed": 0.0, "completed": 0, "failed": 0, "phase_seconds": {"total": 0.0}}
+        tuner = ConcurrencyTuner(metrics, initial=4, min_samples=20)
+        tuner.window = tuner.sample()
+
+        # Act
+        metrics.snapshot.return_value = {"elapsed": 1.0, "completed": 10, "failed": 0, "phase_seconds": {"total": 1.0}}
+        first = tuner.tick()
+        metrics.snapshot.return_value = {"elapsed": 2.0, "completed": 40, "failed": 0, "phase_seconds": {"total": 4.0}}
+        second = tuner.tick()
+
+        # Assert
+        self.assertEqual(first, 4)
+        self.assertEqual(second, 6)
+        self.assertEqual(tuner.best_rate, 20.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import patch
+import argparse
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Controller import Controller, build_parser, parse_threads
+
+
+class TestController(unittest.TestCase):
+    def test_parse_threads(self):
+        # Act & Assert
+        self.assertEqual(parse_threads("8"), 8)
+        self.assertEqual(parse_threads("auto"), "auto")
+        for value in ["0", "many"]:
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_threads(value)
+
+    def test_command_line_options(self):
+        # Act
+        args = build_parser().parse_args(["-d", "out", "-rf", "meta.xlsx", "-uf", "a.xlsx", "b.xlsx", "-t", "auto", "--engine", "async"])
+
+        # Assert
+        self.assertEqual(args.destination, "out")
+        self.assertEqual(args.report_file, "meta.xlsx")
+        self.assertEqual(args.url_file, ["a.xlsx", "b.xlsx"])
+        self.assertEqual(args.threads, "auto")
+        self.assertEqual(args.engine, "async")
+        self.assertIsNone(args.archive)
+        self.assertEqual(build_parser().parse_args(["--archive", "tar.zst"]).archive, "tar.zst")
+
+    @patch("Controller.FileHandler")
+    def test_run_passes_the_options_on(self, mock_file_handler):
+        # Arrange
+        controller = Controller(url_file_name="urls.xlsx", report_file_name="meta.xlsx", destination="out", number_of_threads=16, engine="async")
+
+        # Act
+        controller.run()
+
+        # Assert the run is no longer limited to a single thread
+        args, kwargs = mock_file_handler.call_args
+        self.assertEqual(args, ("urls.xlsx", "meta.xlsx", "out", 16))
+        self.assertEqual(kwargs["engine"], "async")
+        mock_file_handler.return_value.__enter__.return_value.handler.assert_called_once()
+
+    @patch("Controller.FileHandler")
+    def test_verify_runs_before_the_download(self, mock_file_handler):
+        # Arrange
+        controller = Controller(url_file_name="urls.xlsx", report_file_name="meta.xlsx", destination="out", verify=True)
+        file_handler = mock_file_handler.return_value.__enter__.return_value
+
+        # Act
+        controller.run()
+
+        # Assert
+        self.assertTrue(build_parser().parse_args(["--verify"]).verify)
+        self.assertEqual([call[0] for call in file_handler.method_calls], ["verify", "handler"])
+
+    @patch("Controller.FileHandler")
+    def test_migrate_moves_files_to_the_layout_before_the_download(self, mock_file_handler):
+        # Arrange
+        args = build_parser().parse_args(["--layout", "hash", "--migrate"])
+        controller = Controller(url_file_name="urls.xlsx", report_file_name="meta.xlsx", destination="out", layout=args.layout, migrate=args.migrate)
+        file_handler = mock_file_handler.return_value.__enter__.return_value
+
+        # Act
+        controller.run()
+
+        # Assert
+        self.assertEqual([call[0] for call in file_handler.method_calls], ["migrate_layout", "handler"])
+        self.assertTrue(all(call.kwargs["layout"] == "hash" for call in mock_file_handler.call_args_list))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Destination_Layout import DestinationLayout
+
+
+class TestDestinationLayout(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, *parts):
+        path = os.path.join(self.destination, *parts)
+        with open(path, "wb") as file:
+            file.write(b"%PDF-1.4 report %%EOF")
+        return path
+
+    def test_flat_layout_uses_the_destination(self):
+        # Arrange
+        layout = DestinationLayout(self.destination)
+
+        # Act & Assert
+        self.assertEqual(layout.directory("BR1"), self.destination)
+        self.assertEqual(layout.path(12), os.path.join(self.destination, "12.pdf"))
+
+    def test_hash_layout_spreads_files_over_sub_folders(self):
+        # Arrange
+        layout = DestinationLayout(self.destination, "hash")
+
+        # Act
+        folders = {name: layout.folders(name) for name in range(200)}
+        path = layout.path(7)
+
+        # Assert the same id always goes to the same folder, which is created on first use
+        self.assertTrue(all(len(parts) == 2 and all(len(part) == 2 for part in parts) for parts in folders.values()))
+        self.assertEqual(layout.folders(7), folders[7])
+        self.assertGreater(len({parts[0] for parts in folders.values()}), 100)
+        self.assertEqual(path, os.path.join(self.destination, *folders[7], "7.pdf"))
+        self.assertTrue(os.path.isdir(os.path.dirname(path)))
+
+    def test_prefix_layout_uses_the_start_of_the_id(self):
+        # Arrange
+        layout = DestinationLayout(self.destination, "prefix", depth=2, width=2)
+
+        # Act & Assert
+        self.assertEqual(layout.folders("BR12345"), ["BR", "12"])
+        self.assertEqual(layout.folders("7"), ["7_", "__"])
+        self.assertEqual(layout.folders("a/b.c"), ["a_", "b_"])
+
+    def test_unknown_layout_is_rejected(self):
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            DestinationLayout(self.destination, "random")
+
+    def test_migrate_moves_a_flat_folder(self):
+        # Arrange
+        layout = DestinationLayout(self.destination, "prefix", depth=1, width=2)
+        self.write("BR1.pdf")
+        self.write("CD2.pdf")
+        self.write("CD2.pdf.part")
+        os.makedirs(os.path.join(self.destination, "old", "level"))
+        self.write("old", "level", "EF3.pdf")
+
+        # Act
+        moved = layout.migrate()
+
+        # Assert the files are renamed into their folders and the folders left empty are removed
+        self.assertEqual(
+            sorted(os.path.relpath(target, self.destination) for _, target in moved), [os.path.join("BR", "BR1.pdf"), os.path.join("CD", "CD2.pdf"), os.path.join("EF", "EF3.pdf")]
+        )
+        self.assertFalse(os.path.exists(os.path.join(self.destination, "old")))
+        self.assertTrue(os.path.exists(os.path.join(self.destination, "CD2.pdf.part")))
+        self.assertEqual(layout.migrate(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
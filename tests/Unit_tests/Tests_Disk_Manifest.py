@@ -0,0 +1,109 @@
+import unittest
+from unittest.mock import patch
+import hashlib
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Disk_Manifest import DiskManifest, inspect_file, list_pdfs
+
+PDF = b"%PDF-1.4\n" + b"x" * 4000 + b"\n%%EOF\n"
+
+
+class TestDiskManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "files")
+        os.makedirs(os.path.join(self.destination, "ab"))
+        self.manifest_path = os.path.join(self.temp_dir.name, "meta.manifest.parquet")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.destination, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def test_inspect_file_hashes_and_checks_the_pdf(self):
+        # Arrange
+        complete = self.write("BR1.pdf", PDF)
+        truncated = self.write("BR2.pdf", PDF[:2000])
+        html = self.write("BR3.pdf", b"<html>" + b"x" * 2000 + b"%%EOF")
+        empty = self.write("BR4.pdf", b"")
+
+        # Act
+        results = {path: inspect_file(path) for path in (complete, truncated, html, empty)}
+
+        # Assert
+        self.assertEqual(results[complete], (complete, len(PDF), os.stat(complete).st_mtime_ns, hashlib.sha256(PDF).hexdigest(), True, None))
+        self.assertEqual(results[truncated][4:], (False, "no_trailer"))
+        self.assertEqual(results[html][4:], (False, "no_header"))
+        self.assertEqual(results[empty][4:], (False, "empty"))
+        self.assertEqual(inspect_file(os.path.join(self.destination, "gone.pdf"))[4:], (False, "unreadable"))
+
+    def test_list_pdfs_walks_sub_folders_and_skips_partial_files(self):
+        # Arrange
+        self.write("BR1.pdf", PDF)
+        self.write(os.path.join("ab", "BR2.pdf"), PDF)
+        self.write("BR3.pdf.part", PDF[:100])
+        self.write("BR4.pdf.link", PDF)
+
+        # Act
+        names = sorted(os.path.basename(path) for path, size, mtime_ns in list_pdfs(self.destination))
+
+        # Assert
+        self.assertEqual(names, ["BR1.pdf", "BR2.pdf"])
+
+    def test_scan_names_files_by_id_and_saves_the_manifest(self):
+        # Arrange
+        self.write("BR1.pdf", PDF)
+        self.write(os.path.join("ab", "BR2.pdf"), PDF[:2000])
+        manifest = DiskManifest(self.manifest_path, processes=1)
+
+        # Act
+        scanned = manifest.scan(self.destination, "BRnum").sort("BRnum")
+
+        # Assert
+        self.assertEqual(scanned["BRnum"].to_list(), ["BR1", "BR2"])
+        self.assertEqual(scanned["valid"].to_list(), [True, False])
+        self.assertEqual(manifest.hashed, 2)
+        self.assertEqual(manifest.read("BRnum").sort("BRnum").to_dicts(), scanned.to_dicts())
+
+    def test_rescan_only_hashes_changed_files(self):
+        # Arrange
+        self.write("BR1.pdf", PDF)
+        changed = self.write("BR2.pdf", PDF)
+        DiskManifest(self.manifest_path, processes=1).scan(self.destination, "BRnum")
+        self.write("BR2.pdf", PDF[:2000])
+        os.utime(changed, ns=(1, 1))
+        manifest = DiskManifest(self.manifest_path, processes=1)
+
+        # Act
+        with patch("Disk_Manifest.inspect_file", wraps=inspect_file) as inspect:
+            scanned = manifest.scan(self.destination, "BRnum").sort("BRnum")
+
+        # Assert
+        self.assertEqual([call.args[0] for call in inspect.call_args_list], [changed])
+        self.assertEqual(manifest.hashed, 1)
+        self.assertEqual(scanned["valid"].to_list(), [True, False])
+
+    def test_scan_spreads_many_files_over_processes(self):
+        # Arrange
+        for index in range(20):
+            self.write(f"BR{index}.pdf", PDF + str(index).encode())
+        manifest = DiskManifest(self.manifest_path, processes=2)
+
+        # Act
+        scanned = manifest.scan(self.destination, "BRnum")
+
+        # Assert
+        self.assertEqual(scanned.height, 20)
+        self.assertEqual(scanned["sha256"].n_unique(), 20)
+        self.assertTrue(all(scanned["valid"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import unittest
+from unittest.mock import patch
+import socket
+import sys
+import os
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Dns_Cache import DnsCache, happy_eyeballs_connect, interleave_families
+
+IPV4 = (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", 0))
+IPV6 = (socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::1", 0, 0, 0))
+
+
+def fake_getaddrinfo(host, port, *args):
+    if host == "dead.example":
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    if ".." in host:
+        raise UnicodeError("encoding with 'idna' codec failed (UnicodeError: label empty or too long)")
+    return [IPV4]
+
+
+class TestDnsCache(unittest.TestCase):
+    @patch("Dns_Cache.socket.getaddrinfo", side_effect=fake_getaddrinfo)
+    def test_answers_are_cached_with_the_port_filled_in(self, mock_getaddrinfo):
+        # Arrange
+        cache = DnsCache()
+
+        # Act
+        first = cache.resolve("a.example", 80)
+        second = cache.resolve("a.example", 443)
+
+        # Assert the resolver was only asked once
+        self.assertEqual(mock_getaddrinfo.call_count, 1)
+        self.assertEqual(first[0][4], ("127.0.0.1", 80))
+        self.assertEqual(second[0][4], ("127.0.0.1", 443))
+        self.assertEqual(cache.hits, 1)
+
+    @patch("Dns_Cache.socket.getaddrinfo", side_effect=fake_getaddrinfo)
+    def test_failed_lookups_are_cached(self, mock_getaddrinfo):
+        # Arrange
+        cache = DnsCache()
+
+        # Act
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                cache.resolve("dead.example", 80)
+
+        # Assert
+        self.assertEqual(mock_getaddrinfo.call_count, 1)
+        self.assertTrue(cache.is_dead("dead.example"))
+        self.assertFalse(cache.is_dead("a.example"))
+
+    @patch("Dns_Cache.socket.getaddrinfo", side_effect=fake_getaddrinfo)
+    def test_invalid_host_names_are_cached_as_failed_lookups(self, mock_getaddrinfo):
+        # Arrange
+        cache = DnsCache()
+        errors = []
+
+        def resolve():
+            try:
+                cache.resolve("a..b.com", 80)
+            except UnicodeError as error:
+                errors.append(error)
+
+        # Act a second lookup of the host, which used to wait forever for the first one
+        resolve()
+        thread = threading.Thread(target=resolve, daemon=True)
+        thread.start()
+        thread.join(5)
+
+        # Assert
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(mock_getaddrinfo.call_count, 1)
+        self.assertTrue(cache.is_dead("a..b.com"))
+        self.assertEqual(cache.resolving, {})
+
+    @patch("Dns_Cache.socket.getaddrinfo", side_effect=fake_getaddrinfo)
+    def test_expired_answers_are_resolved_again(self, mock_getaddrinfo):
+        # Arrange
+        cache = DnsCache(ttl=0.0)
+
+        # Act
+        cache.resolve("a.example", 80)
+        cache.resolve("a.example", 80)
+
+        # Assert
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+
+    def test_concurrent_lookups_of_a_host_share_one_request(self):
+        # Arrange
+        calls = []
+
+        def slow_getaddrinfo(host, port, *args):
+            calls.append(host)
+            time.sleep(0.05)
+            return [IPV4]
+
+        cache = DnsCache()
+
+        # Act
+        with patch("Dns_Cache.socket.getaddrinfo", side_effect=slow_getaddrinfo):
+            threads = [threading.Thread(target=cache.resolve, args=("a.example", 80)) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Assert
+        self.assertEqual(calls, ["a.example"])
+
+    @patch("Dns_Cache.socket.getaddrinfo", side_effect=fake_getaddrinfo)
+    def test_prefetch_returns_the_hosts_that_do_not_resolve(self, mock_getaddrinfo):
+        # Act
+        dead = DnsCache().prefetch(["a.example", "dead.example", "a.example", "a..b.com", None])
+
+        # Assert
+        self.assertEqual(dead, {"dead.example", "a..b.com"})
+        self.assertEqual(mock_getaddrinfo.call_count, 3)
+
+
+class TestHappyEyeballs(unittest.TestCase):
+    def test_families_are_interleaved(self):
+        # Act
+        ordered = interleave_families([IPV6, IPV6, IPV4, IPV4])
+
+        # Assert
+        self.assertEqual([address[0] for address in ordered], [socket.AF_INET6, socket.AF_INET, socket.AF_INET6, socket.AF_INET])
+
+    def test_connects_to_the_address_that_answers(self):
+        # Arrange a listening socket and a closed port in front of it
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        closed_port = closed.getsockname()[1]
+        closed.close()
+        addresses = [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", closed_port)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", server.getsockname()),
+        ]
+
+        # Act
+        sock = happy_eyeballs_connect(addresses, timeout=5, delay=0.05)
+
+        # Assert
+        try:
+            self.assertEqual(sock.getpeername(), server.getsockname())
+            self.assertEqual(sock.gettimeout(), 5)
+        finally:
+            sock.close()
+            server.close()
+
+    def test_raises_when_every_address_fails(self):
+        # Arrange
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        address = (socket.AF_INET, socket.SOCK_STREAM, 6, "", closed.getsockname())
+        closed.close()
+
+        # Act & Assert
+        with self.assertRaises(ConnectionRefusedError):
+            happy_eyeballs_connect([address], timeout=5, delay=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Downloader import DownloadResult
+from Download_Metrics import DownloadMetrics, JsonlMetricsHook, PrometheusMetricsHook
+
+
+class TestDownloadMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def result(self, success: bool, size: int) -> DownloadResult:
+        result = DownloadResult()
+        result.success = success
+        result.bytes_received = size
+        result.attempts = 1
+        result.timings["ttfb"] = 0.5
+        return result
+
+    def test_aggregates(self):
+        # Arrange
+        metrics = DownloadMetrics()
+        metrics.queue_depth = lambda: 7
+
+        # Act
+        first = metrics.started()
+        second = metrics.started()
+        metrics.finished("id1", self.result(True, 100), first)
+        snapshot = metrics.snapshot()
+        metrics.finished("id2", self.result(False, 0), second)
+
+        # Assert
+        self.assertEqual(snapshot["in_flight"], 1)
+        self.assertEqual(snapshot["queue_depth"], 7)
+        self.assertEqual(metrics.snapshot()["completed"], 2)
+        self.assertEqual(metrics.snapshot()["failed"], 1)
+        self.assertEqual(metrics.snapshot()["bytes"], 100)
+        self.assertEqual(metrics.snapshot()["phase_seconds"]["ttfb"], 1.0)
+
+    def test_hooks(self):
+        # Arrange
+        trace = os.path.join(self.temp_dir.name, "trace.jsonl")
+        prometheus = os.path.join(self.temp_dir.name, "metrics.prom")
+        metrics = DownloadMetrics([JsonlMetricsHook(trace), PrometheusMetricsHook(prometheus, interval=3600)])
+
+        # Act
+        metrics.finished("id1", self.result(True, 100), metrics.started())
+        metrics.close()
+
+        # Assert
+        with open(trace) as file:
+            event = json.loads(file.readline())
+        self.assertEqual(event["id"], "id1")
+        self.assertEqual(event["bytes"], 100)
+        self.assertIn("total", event)
+        with open(prometheus) as file:
+            text = file.read()
+        self.assertIn('pdf_downloads_total{result="success"} 1', text)
+        self.assertIn('pdf_download_phase_seconds_total{phase="ttfb"} 0.500000', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,38 +2,85 @@ import unittest
 from unittest.mock import mock_open, patch, MagicMock
 import sys
 import os
+import tempfile
+import hashlib
+import json
+import threading
+import socket
+import requests
 
 # Add the src directory to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
-from Downloader import Downloader
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../benchmarks")))
+from Mock_Pdf_Server import MockPdfServer, ServerConfig
+from Circuit_Breaker import CircuitBreaker
+from Dns_Cache import DnsCache
+from Redirect_Cache import RedirectCache
+from Downloader import (
+    Downloader,
+    DownloadResult,
+    RetryPolicy,
+    SlowTransferError,
+    DeadlineExceededError,
+    check_pace,
+    classify_exception,
+    PooledAdapter,
+    create_session,
+    connection_stats,
+    preallocate,
+)
 
 
 class TestSaveToFile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "mock_path.pdf")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
     def test_save_to_file_success(self):
         # Arrange
-        # Create a mock response object
+        # Create a mock response object that streams its body in chunks
         mock_response = MagicMock()
-        mock_response.content = b"Mock file content"
+        mock_response.headers = {"content-length": "17"}
+        mock_response.iter_content.return_value = [b"Mock file", b" content"]
+        downloader = Downloader(MagicMock(), chunk_size=9, validate_pdf=False)
 
-        # Mock the open function
-        with patch("builtins.open", mock_open()) as mocked_file:
-            downloader = Downloader()
+        # Act
+        sut = downloader.save_to_file(self.destination, mock_response)
 
-            # Act
-            sut = downloader.save_to_file("mock_path.txt", mock_response)
+        # Assert
+        self.assertTrue(sut)
+        mock_response.iter_content.assert_called_once_with(chunk_size=9)
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), b"Mock file content")
+        self.assertFalse(os.path.exists(self.destination + ".part"))
 
-            # Assert
-            self.assertTrue(sut)
+    def test_save_to_file_records_hash(self):
+        # Arrange
+        mock_response = MagicMock()
+        mock_response.headers = {}
+        mock_response.iter_content.return_value = [b"Mock file content"]
+        result = DownloadResult()
+
+        # Act
+        Downloader(MagicMock(), validate_pdf=False).save_to_file(self.destination, mock_response, result)
+
+        # Assert
+        self.assertEqual(result.content_length, 17)
+        self.assertEqual(result.sha256, hashlib.sha256(b"Mock file content").hexdigest())
 
     def test_save_to_file_failure(self):
         # Arrange
         # Create a mock response object
         mock_response = MagicMock()
-        mock_response.content = b"Mock file content"
+        mock_response.headers = {}
+        mock_response.iter_content.return_value = [b"Mock file content"]
 
         # Mock the open function and make write raise an exception
         with patch("builtins.open", mock_open()) as mocked_file:
-            downloader = Downloader()
+            downloader = Downloader(MagicMock())
             mocked_file().write.side_effect = IOError("Mocked error")  # Simulate write failure
 
             # Act
@@ -42,32 +89,66 @@ class TestSaveToFile(unittest.TestCase):
             # Assertions
             self.assertFalse(result)
 
+    def test_save_to_file_truncated_transfer(self):
+        # Arrange
+        # The server promised more bytes than it sent
+        mock_response = MagicMock()
+        mock_response.headers = {"content-length": "1000"}
+        mock_response.iter_content.return_value = [b"Mock file content"]
+        downloader = Downloader(MagicMock())
+
+        # Act
+        result = downloader.save_to_file(self.destination, mock_response)
+
+        # Assert no partial file is left behind
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertFalse(os.path.exists(self.destination + ".part"))
+
+    def test_save_to_file_connection_dropped(self):
+        # Arrange
+        def broken_stream(chunk_size):
+            yield b"Mock"
+            raise ConnectionError("Connection reset")
+
+        mock_response = MagicMock()
+        mock_response.headers = {}
+        mock_response.iter_content.side_effect = broken_stream
+        downloader = Downloader(MagicMock())
+
+        # Act
+        result = downloader.save_to_file(self.destination, mock_response)
+
+        # Assert
+        self.assertFalse(result)
+        self.assertFalse(os.path.exists(self.destination))
+
 
 class TestDownloader(unittest.TestCase):
-    @patch("Downloader.requests.get")  # Mock requests.get
-    def test_download_success_pdf(self, mock_get):
+    def test_download_success_pdf(self):
         # Mock response for a successful PDF download
+        mock_session = MagicMock()
         mock_response = MagicMock()
         mock_response.headers = {"content-type": "application/pdf"}
         mock_response.status_code = 200
-        mock_get.return_value = mock_response
+        mock_session.get.return_value = mock_response
 
         # Create instance and call the method
-        downloader = Downloader()
+        downloader = Downloader(mock_session)
         success, response = downloader.download("http://test.com/test.pdf")
 
         # Assertions
         self.assertTrue(success)
         self.assertEqual(response, mock_response)
 
-    @patch("Downloader.requests.get")  # Mock requests.get
-    def test_download_failure_non_pdf(self, mock_get):
+    def test_download_failure_non_pdf(self):
         # Arrange
+        mock_session = MagicMock()
         mock_response = MagicMock()
         mock_response.headers = {"content-type": "text/html"}
         mock_response.status_code = 200
-        mock_get.return_value = mock_response
-        downloader = Downloader()
+        mock_session.get.return_value = mock_response
+        downloader = Downloader(mock_session)
 
         # Act
         success, response = downloader.download("http://test.com/test.html")
@@ -76,11 +157,11 @@ class TestDownloader(unittest.TestCase):
         self.assertFalse(success)
         self.assertIsNone(response)
 
-    @patch("Downloader.requests.get")  # Mock requests.get
-    def test_download_failure_exception(self, mock_get):
+    def test_download_failure_exception(self):
         # Arrange
-        mock_get.side_effect = Exception("Connection error")
-        downloader = Downloader()
+        mock_session = MagicMock()
+        mock_session.get.side_effect = Exception("Connection error")
+        downloader = Downloader(mock_session)
 
         # Act
         success, response = downloader.download("http://test.com/test.pdf")
@@ -89,6 +170,572 @@ class TestDownloader(unittest.TestCase):
         self.assertFalse(success)
         self.assertIsNone(response)
 
+    def test_download_uses_shared_session(self):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.return_value.headers = {"content-type": "application/pdf"}
+        mock_session.get.return_value.status_code = 200
+        downloader = Downloader(mock_session)
+
+        # Act
+        downloader.download("http://test.com/a.pdf")
+        downloader.download("http://test.com/b.pdf")
+
+        # Assert both requests went through the same session
+        self.assertEqual(mock_session.get.call_count, 2)
+
+
+class TestConditionalDownload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "id1.pdf")
+        with open(self.destination, "wb") as file:
+            file.write(b"%PDF-1.4")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_not_modified_keeps_file(self):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.return_value.status_code = 304
+        validators = {"url": "http://test.com/test.pdf", "etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT", "sha256": "abc"}
+        downloader = Downloader(mock_session)
+
+        # Act
+        result = downloader.download_handling("http://test.com/test.pdf", self.destination, validators=validators)
+
+        # Assert
+        self.assertTrue(result)
+        self.assertTrue(result.not_modified)
+        self.assertEqual(result.sha256, "abc")
+        headers = mock_session.get.call_args.kwargs["headers"]
+        self.assertEqual(headers, {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})
+
+    def test_validators_ignored_when_file_missing(self):
+        # Arrange
+        os.remove(self.destination)
+        mock_session = MagicMock()
+        mock_session.get.return_value.headers = {"content-type": "text/html"}
+        mock_session.get.return_value.status_code = 200
+        downloader = Downloader(mock_session)
+
+        # Act
+        downloader.download_handling("http://test.com/test.pdf", self.destination, validators={"url": "http://test.com/test.pdf", "etag": '"v1"'})
+
+        # Assert the request was unconditional
+        self.assertEqual(mock_session.get.call_args.kwargs["headers"], {})
+
+
+class TestRetry(unittest.TestCase):
+    def response(self, status_code, content_type="application/pdf"):
+        mock_response = MagicMock()
+        mock_response.status_code = status_code
+        mock_response.headers = {"content-type": content_type}
+        return mock_response
+
+    @patch("Downloader.time.sleep")
+    @patch.object(Downloader, "save_to_file", return_value=True)
+    def test_transient_failure_is_retried(self, mock_save_to_file, mock_sleep):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.side_effect = [self.response(503), requests.exceptions.ReadTimeout(), self.response(200)]
+        downloader = Downloader(mock_session, retry_policy=RetryPolicy(max_attempts=3))
+
+        # Act
+        result = downloader.download_handling("http://test.com/test.pdf", "mock_path.pdf")
+
+        # Assert
+        self.assertTrue(result)
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    @patch("Downloader.time.sleep")
+    def test_permanent_failure_is_not_retried(self, mock_sleep):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.side_effect = [self.response(404), self.response(200, "text/html")]
+        downloader = Downloader(mock_session, retry_policy=RetryPolicy(max_attempts=3))
+
+        # Act
+        result = downloader.download_handling("http://test.com/test.pdf", "mock_path.pdf", "http://test.com/page.html")
+
+        # Assert each url was tried once and the last failure is recorded
+        self.assertFalse(result)
+        self.assertEqual(result.attempts, 2)
+        self.assertEqual(result.details(), {"failure": "not_pdf", "attempts": 2})
+        mock_sleep.assert_not_called()
+
+    @patch("Downloader.time.sleep")
+    def test_retry_budget_is_shared(self, mock_sleep):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.return_value = self.response(429)
+        policy = RetryPolicy(max_attempts=5, budget=2)
+        downloader = Downloader(mock_session, retry_policy=policy)
+
+        # Act
+        first = downloader.download_handling("http://test.com/1.pdf", "mock_path.pdf")
+        second = downloader.download_handling("http://test.com/2.pdf", "mock_path.pdf")
+
+        # Assert
+        self.assertEqual((first.attempts, second.attempts), (3, 1))
+        self.assertEqual(second.failure, "http_429")
+
+    @patch("Downloader.time.sleep")
+    def test_open_circuit_skips_to_alt_url(self, mock_sleep):
+        # Arrange a host that times out on every connect
+        def get(url, **kwargs):
+            if "dead.com" in url:
+                raise requests.exceptions.ConnectTimeout()
+            return self.response(404)
+
+        mock_session = MagicMock()
+        mock_session.get.side_effect = get
+        downloader = Downloader(mock_session, retry_policy=RetryPolicy(max_attempts=2), circuit_breaker=CircuitBreaker(failure_threshold=2))
+
+        # Act
+        first = downloader.download_handling("http://dead.com/1.pdf", "mock_path.pdf")
+        second = downloader.download_handling("http://dead.com/2.pdf", "mock_path.pdf", "http://alt.com/2.pdf")
+
+        # Assert the second row never contacted the dead host and went straight to its alternative url
+        self.assertEqual(first.attempts, 2)
+        self.assertEqual(second.attempts, 1)
+        self.assertEqual([call.args[0] for call in mock_session.get.call_args_list], ["http://dead.com/1.pdf", "http://dead.com/1.pdf", "http://alt.com/2.pdf"])
+        self.assertEqual(downloader.download_handling("http://dead.com/3.pdf", "mock_path.pdf").details(), {"failure": "circuit_open", "attempts": 0})
+
+    @patch("Downloader.time.perf_counter", return_value=20.0)
+    def test_check_pace(self, mock_perf_counter):
+        # Act & Assert a transfer is only judged after the grace period, and the deadline always applies
+        check_pace(15.0, 0, 1000.0, 10.0, None)
+        check_pace(5.0, 20_000, 1000.0, 10.0, None)
+        with self.assertRaises(SlowTransferError):
+            check_pace(5.0, 10_000, 1000.0, 10.0, None)
+        with self.assertRaises(DeadlineExceededError):
+            check_pace(15.0, 0, None, 10.0, 0.0)
+        self.assertEqual(classify_exception(SlowTransferError()), "slow")
+
+    @patch.object(Downloader, "attempt")
+    def test_slow_transfer_does_not_move_on_to_alt_url(self, mock_attempt):
+        # Arrange
+        def attempt(url, destination_path, validators, result):
+            result.failure = "slow"
+            result.content_length = 5000
+            return False
+
+        mock_attempt.side_effect = attempt
+        downloader = Downloader(MagicMock(), min_transfer_rate=1000.0)
+
+        # Act
+        result = downloader.download_handling("http://test.com/1.pdf", "mock_path.pdf", "http://test.com/2.pdf")
+
+        # Assert the row is handed back to be put back in the queue, with its size for the next run
+        self.assertEqual(mock_attempt.call_count, 1)
+        self.assertEqual(result.details(), {"failure": "slow", "attempts": 1, "content_length": 5000})
+        self.assertEqual(result.min_transfer_rate, 1000.0)
+        self.assertIsNone(downloader.download_handling("http://test.com/1.pdf", "mock_path.pdf", rate_floor=False).min_transfer_rate)
+
+    def test_delay_honors_retry_after(self):
+        # Arrange
+        policy = RetryPolicy(base_delay=0.5, max_delay=30)
+
+        # Assert
+        self.assertLessEqual(policy.delay(1), 0.5)
+        self.assertLessEqual(policy.delay(10), 30)
+        self.assertEqual(policy.delay(1, 12.0), 12.0)
+
+    def test_classify_exception(self):
+        self.assertEqual(classify_exception(requests.exceptions.ConnectTimeout()), "connect")
+        self.assertEqual(classify_exception(requests.exceptions.ReadTimeout()), "read_timeout")
+        self.assertEqual(classify_exception(requests.exceptions.ConnectionError(socket.gaierror(-2, "Name or service not known"))), "dns")
+        self.assertEqual(classify_exception(requests.exceptions.ChunkedEncodingError()), "truncated")
+        self.assertEqual(classify_exception(ValueError()), "other")
+
+
+class TestRangedDownload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "id1.pdf")
+        self.url = "http://test.com/test.pdf"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def response(self, status_code, chunks, headers):
+        mock_response = MagicMock()
+        mock_response.status_code = status_code
+        mock_response.headers = dict(headers, **{"content-type": "application/pdf", "etag": '"v1"'})
+        mock_response.iter_content.return_value = chunks
+        mock_response.url = self.url
+        return mock_response
+
+    def test_truncated_transfer_is_resumed(self):
+        # Arrange
+        # The first response breaks off after 4 of 8 bytes, the second continues from byte 4
+        def broken_stream(chunk_size):
+            yield b"%PDF"
+            raise requests.exceptions.ChunkedEncodingError()
+
+        first = self.response(200, None, {"accept-ranges": "bytes", "content-length": "8"})
+        first.iter_content.side_effect = broken_stream
+        second = self.response(206, [b"-1.4"], {"content-range": "bytes 4-7/8", "content-length": "4"})
+        mock_session = MagicMock()
+        mock_session.get.side_effect = [first, second]
+        downloader = Downloader(mock_session, retry_policy=RetryPolicy(max_attempts=2, base_delay=0), validate_pdf=False)
+
+        # Act
+        result = downloader.download_handling(self.url, self.destination)
+
+        # Assert
+        self.assertTrue(result)
+        self.assertEqual(mock_session.get.call_args.kwargs["headers"], {"Range": "bytes=4-", "If-Range": '"v1"'})
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), b"%PDF-1.4")
+        self.assertEqual(result.sha256, hashlib.sha256(b"%PDF-1.4").hexdigest())
+        self.assertFalse(os.path.exists(self.destination + ".part.json"))
+
+    def test_resumable_partial_file_is_not_preallocated(self):
+        # Arrange a transfer that is cut off as hard as a crash would, before the file could be truncated
+        def broken_stream(chunk_size):
+            yield b"%PDF"
+            raise KeyboardInterrupt
+
+        response = self.response(200, None, {"accept-ranges": "bytes", "content-length": "8"})
+        response.iter_content.side_effect = broken_stream
+        mock_session = MagicMock()
+        mock_session.get.return_value = response
+        downloader = Downloader(mock_session, retry_policy=RetryPolicy(max_attempts=1), validate_pdf=False)
+
+        # Act
+        with patch("Downloader.preallocate", wraps=preallocate) as mock_preallocate, self.assertRaises(KeyboardInterrupt):
+            downloader.download_handling(self.url, self.destination)
+
+        # Assert nothing was reserved that a crash could leave behind, so the next run resumes after the bytes received
+        mock_preallocate.assert_not_called()
+        self.assertEqual(os.path.getsize(self.destination + ".part"), 4)
+        self.assertEqual(downloader.resume_state(self.destination, self.url)["offset"], 4)
+
+    @unittest.skipUnless(hasattr(os, "posix_fallocate"), "posix_fallocate is not available")
+    def test_file_that_can_not_be_resumed_is_preallocated(self):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.return_value = self.response(200, [b"%PDF", b"-2.0"], {"content-length": "8"})
+        downloader = Downloader(mock_session, validate_pdf=False)
+
+        # Act
+        with patch("Downloader.os.posix_fallocate", wraps=os.posix_fallocate) as mock_fallocate:
+            result = downloader.download_handling(self.url, self.destination)
+
+        # Assert
+        self.assertTrue(result)
+        self.assertEqual(mock_fallocate.call_args.args[1:], (0, 8))
+        self.assertEqual(os.path.getsize(self.destination), 8)
+
+    def test_changed_file_restarts_from_zero(self):
+        # Arrange
+        with open(self.destination + ".part", "wb") as file:
+            file.write(b"%PDF")
+        with open(self.destination + ".part.json", "w") as file:
+            file.write('{"url": "http://test.com/test.pdf", "etag": "\\"v0\\"", "total": 8}')
+        # If-Range did not match, so the server sends the whole new file
+        mock_session = MagicMock()
+        mock_session.get.return_value = self.response(200, [b"%PDF-2.0"], {"accept-ranges": "bytes", "content-length": "8"})
+        downloader = Downloader(mock_session, validate_pdf=False)
+
+        # Act
+        result = downloader.download_handling(self.url, self.destination)
+
+        # Assert
+        self.assertTrue(result)
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), b"%PDF-2.0")
+
+    def test_parallel_ranges(self):
+        # Arrange
+        body = b"%PDF-1.4 large report"
+
+        def get(url, stream, timeout, headers):
+            if "Range" not in headers:
+                return self.response(200, [], {"accept-ranges": "bytes", "content-length": str(len(body))})
+            start, end = (int(value) for value in headers["Range"].split("=")[1].split("-"))
+            return self.response(206, [body[start : end + 1]], {"content-range": f"bytes {start}-{end}/{len(body)}"})
+
+        mock_session = MagicMock()
+        mock_session.get.side_effect = get
+        downloader = Downloader(mock_session, parallel_ranges=4, parallel_threshold=10, validate_pdf=False)
+
+        # Act
+        result = downloader.download_handling(self.url, self.destination)
+
+        # Assert
+        self.assertTrue(result)
+        self.assertEqual(mock_session.get.call_count, 5)
+        self.assertEqual([status for _, status, _, _ in result.responses], [200, 206, 206, 206, 206])
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), body)
+        self.assertFalse(os.path.exists(self.destination + ".part.ranges.json"))
+
+    def test_parallel_ranges_resume_where_they_stopped(self):
+        # Arrange a body of four ranges whose third range breaks off after half of its bytes in the first attempt
+        body = b"%PDF-1.4 " + b"x" * 22 + b" %%EOF\n"
+        requested = []
+
+        def get(url, stream, timeout, headers):
+            if "Range" not in headers:
+                return self.response(200, [], {"accept-ranges": "bytes", "content-length": str(len(body))})
+            requested.append(headers["Range"])
+            start, end = (int(value) for value in headers["Range"].split("=")[1].split("-"))
+            if start == 20 and len(requested) <= 4:
+                end = 24
+            return self.response(206, [body[start : end + 1]], {"content-range": f"bytes {start}-{end}/{len(body)}"})
+
+        mock_session = MagicMock()
+        mock_session.get.side_effect = get
+        downloader = Downloader(mock_session, retry_policy=RetryPolicy(max_attempts=1), parallel_ranges=4, parallel_threshold=10)
+
+        # Act
+        first = downloader.download_handling(self.url, self.destination)
+        with open(self.destination + ".part.ranges.json") as file:
+            progress = json.load(file)["progress"]
+        requested.clear()
+        second = downloader.download_handling(self.url, self.destination)
+
+        # Assert the second attempt only asked for what was missing, which includes the second half of the third range.
+        # The other ranges may have been stopped by the failing one at any point
+        self.assertFalse(first)
+        self.assertEqual(first.failure, "truncated")
+        self.assertEqual(progress[2], 25)
+        self.assertTrue(second)
+        ends = [9, 19, 29, 37]
+        self.assertEqual(sorted(requested), [f"bytes={position}-{end}" for position, end in zip(progress, ends) if position <= end])
+        with open(self.destination, "rb") as file:
+            self.assertEqual(file.read(), body)
+
+    def test_parallel_ranges_stop_when_the_run_is_cancelled(self):
+        # Arrange a run that is cancelled as soon as the first range was asked for
+        body = b"%PDF-1.4 " + b"x" * 22 + b" %%EOF\n"
+        cancelled = threading.Event()
+
+        def get(url, stream, timeout, headers):
+            if "Range" not in headers:
+                return self.response(200, [], {"accept-ranges": "bytes", "content-length": str(len(body))})
+            cancelled.set()
+            start, end = (int(value) for value in headers["Range"].split("=")[1].split("-"))
+            return self.response(206, [body[start : end + 1]], {"content-range": f"bytes {start}-{end}/{len(body)}"})
+
+        mock_session = MagicMock()
+        mock_session.get.side_effect = get
+        downloader = Downloader(mock_session, parallel_ranges=4, parallel_threshold=10, cancelled=cancelled)
+
+        # Act
+        result = downloader.download_handling(self.url, self.destination)
+
+        # Assert nothing was written, and the partial file is kept for the next run
+        self.assertFalse(result)
+        self.assertEqual(result.failure, "cancelled")
+        self.assertFalse(os.path.exists(self.destination))
+        self.assertTrue(os.path.exists(self.destination + ".part"))
+        with open(self.destination + ".part.ranges.json") as file:
+            self.assertEqual(json.load(file)["progress"], [0, 10, 20, 30])
+
+    def test_parallel_ranges_respect_the_circuit_breaker(self):
+        # Arrange a circuit that opens once the download is under way
+        body = b"%PDF-1.4 " + b"x" * 22 + b" %%EOF\n"
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+
+        def get(url, stream, timeout, headers):
+            if "Range" not in headers:
+                breaker.record("test.com", "connect")
+                return self.response(200, [], {"accept-ranges": "bytes", "content-length": str(len(body))})
+            start, end = (int(value) for value in headers["Range"].split("=")[1].split("-"))
+            return self.response(206, [body[start : end + 1]], {"content-range": f"bytes {start}-{end}/{len(body)}"})
+
+        mock_session = MagicMock()
+        mock_session.get.side_effect = get
+        downloader = Downloader(mock_session, parallel_ranges=4, parallel_threshold=10, circuit_breaker=breaker)
+
+        # Act
+        result = downloader.download_handling(self.url, self.destination)
+
+        # Assert no range was asked for after the circuit opened, and the circuit stays open
+        self.assertFalse(result)
+        self.assertEqual(result.failure, "circuit_open")
+        self.assertEqual(mock_session.get.call_count, 1)
+        self.assertFalse(breaker.allow("test.com"))
+
+
+class TestSessionPool(unittest.TestCase):
+    def test_create_session_sizes_pool_to_threads(self):
+        # Act
+        session = create_session(25)
+
+        # Assert
+        adapter = session.get_adapter("https://test.com")
+        self.assertIsInstance(adapter, PooledAdapter)
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertIs(adapter, session.get_adapter("http://test.com"))
+
+    def test_connection_stats_counts_reuse(self):
+        # Arrange
+        session = create_session(2)
+        adapter = session.get_adapter("https://test.com")
+        pool = MagicMock(num_requests=10, num_connections=2)
+        adapter.retire_pool(pool)
+
+        # Act
+        stats = connection_stats(session)
+
+        # Assert
+        self.assertEqual(stats, {"requests": 10, "connections": 2, "reused": 8})
+        pool.close.assert_called_once()
+
+    def test_invalid_host_name_fails_as_dns_every_time(self):
+        # Arrange a host name that fails IDNA encoding, which used to leave later lookups of it waiting forever
+        downloader = Downloader(create_session(1, dns_cache=DnsCache()), retry_policy=RetryPolicy(max_attempts=1))
+
+        # Act
+        results = [downloader.download_handling("http://a..b.com/1.pdf", os.path.join(tempfile.gettempdir(), "invalid.pdf")) for _ in range(2)]
+
+        # Assert
+        self.assertEqual([result.failure for result in results], ["dns", "dns"])
+
+
+class TestPdfSniffing(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "id1.pdf")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def response(self, content_type, body, url="http://test.com/report"):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.url = url
+        mock_response.headers = {"content-type": content_type} if content_type else {}
+        mock_response.iter_content.return_value = iter([body[:4], body[4:]])
+        return mock_response
+
+    def test_pdf_without_pdf_content_type(self):
+        for content_type in ("application/octet-stream", None):
+            # Arrange
+            mock_session = MagicMock()
+            mock_session.get.return_value = self.response(content_type, b"%PDF-1.4 report\n%%EOF\n")
+
+            # Act
+            result = Downloader(mock_session).download_handling("http://test.com/report", self.destination)
+
+            # Assert
+            self.assertTrue(result)
+
+    def test_non_pdf_body_is_rejected(self):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.return_value = self.response("application/pdf", b"Not found" * 200)
+
+        # Act
+        result = Downloader(mock_session).download_handling("http://test.com/report.pdf", self.destination)
+
+        # Assert
+        self.assertFalse(result)
+        self.assertEqual(result.failure, "not_pdf")
+        self.assertFalse(os.path.exists(self.destination + ".part"))
+
+    def test_pdf_without_trailer_is_rejected(self):
+        # Arrange
+        mock_session = MagicMock()
+        mock_session.get.return_value = self.response("application/pdf", b"%PDF-1.4 cut short")
+
+        # Act
+        result = Downloader(mock_session).download_handling("http://test.com/report.pdf", self.destination)
+
+        # Assert
+        self.assertFalse(result)
+        self.assertEqual(result.failure, "bad_pdf")
+
+    def test_landing_page_link_is_followed(self):
+        # Arrange
+        page = b'<html><body><a href="/files/report.pdf">Download the report</a></body></html>'
+        mock_session = MagicMock()
+        mock_session.get.side_effect = [self.response("text/html; charset=utf-8", page), self.response("application/pdf", b"%PDF-1.4 report\n%%EOF\n")]
+
+        # Act
+        result = Downloader(mock_session).download_handling("http://test.com/report", self.destination)
+
+        # Assert
+        self.assertTrue(result)
+        self.assertEqual(result.source, "landing")
+        self.assertEqual(result.url, "http://test.com/files/report.pdf")
+
+
+class TestDownloadTimings(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_phases_are_timed(self):
+        with MockPdfServer(ServerConfig(min_size=50_000, max_size=50_000, latency=0.02)) as server:
+            downloader = Downloader(create_session(1))
+
+            # Act
+            first = downloader.download_handling(server.url("1.pdf"), os.path.join(self.temp_dir.name, "1.pdf"))
+            second = downloader.download_handling("http://[::1", os.path.join(self.temp_dir.name, "2.pdf"), alt_url=server.url("2.pdf"))
+
+        # Assert the first download opened the connection, the second reused it and came from the alt url
+        self.assertGreater(first.timings["connect"], 0.0)
+        self.assertGreaterEqual(first.timings["ttfb"], 0.02)
+        self.assertEqual(first.metrics()["bytes"], 50_000)
+        self.assertEqual(first.source, "primary")
+        self.assertEqual(second.timings["connect"], 0.0)
+        self.assertEqual(second.source, "alt")
+
+
+class TestRedirectCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_later_requests_skip_the_redirects(self):
+        with MockPdfServer(ServerConfig(min_size=1000, max_size=1000)) as server:
+            # Arrange
+            cache = RedirectCache()
+            downloader = Downloader(create_session(1), redirect_cache=cache)
+            url = server.url("redirect/2/reports/1.pdf")
+
+            # Act
+            first = downloader.download_handling(url, os.path.join(self.temp_dir.name, "1.pdf"))
+            second = downloader.download_handling(url, os.path.join(self.temp_dir.name, "2.pdf"))
+
+        # Assert the second download went straight to the pdf, but is still recorded under the url it was asked for
+        self.assertTrue(first and second)
+        self.assertEqual(cache.resolve(url), server.url("reports/1.pdf"))
+        self.assertEqual(server.log.requests["/redirect/2/reports/1.pdf"], 1)
+        self.assertEqual(server.log.requests["/reports/1.pdf"], 2)
+        self.assertEqual(second.url, url)
+
+    def test_stale_target_falls_back_to_the_original_url(self):
+        # Arrange
+        cache = RedirectCache()
+        cache.record("http://short/a", "http://cdn/gone.pdf")
+        gone = MagicMock(status_code=404, headers={})
+        found = MagicMock(status_code=200, headers={"content-type": "application/pdf"})
+        found.history = []
+        session = MagicMock()
+        session.get.side_effect = [gone, found]
+        downloader = Downloader(session, redirect_cache=cache)
+
+        # Act
+        downloaded, response = downloader.download("http://short/a", result=DownloadResult())
+
+        # Assert
+        self.assertTrue(downloaded)
+        self.assertEqual([call.args[0] for call in session.get.call_args_list], ["http://cdn/gone.pdf", "http://short/a"])
+        self.assertEqual(cache.resolve("http://short/a"), "http://short/a")
+
 
 class TestDownloadHandling(unittest.TestCase):
 
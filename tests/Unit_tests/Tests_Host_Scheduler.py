@@ -0,0 +1,208 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Circuit_Breaker import CircuitBreaker
+from Host_Scheduler import HostScheduler, host_of, parse_retry_after
+
+
+def item(url, name):
+    return [url, "dest", name, None]
+
+
+class TestHostScheduler(unittest.TestCase):
+    def test_round_robin_across_hosts(self):
+        # Arrange
+        scheduler = HostScheduler(rate_per_host=100, burst=100, initial_concurrency=8)
+        for i in range(3):
+            scheduler.put(item(f"http://a.com/{i}.pdf", f"a{i}"))
+        scheduler.put(item("http://b.com/0.pdf", "b0"))
+        scheduler.put(item("http://c.com/0.pdf", "c0"))
+
+        # Act
+        order = [scheduler.get()[1][2] for _ in range(5)]
+
+        # Assert the first round visits every host before a host gets its second item
+        self.assertEqual(order[:3], ["a0", "b0", "c0"])
+        self.assertEqual(order[3:], ["a1", "a2"])
+
+    def test_concurrency_limit_per_host(self):
+        # Arrange
+        scheduler = HostScheduler(rate_per_host=100, burst=100, initial_concurrency=1)
+        scheduler.put(item("http://a.com/0.pdf", "a0"))
+        scheduler.put(item("http://a.com/1.pdf", "a1"))
+        scheduler.put(item("http://b.com/0.pdf", "b0"))
+
+        # Act
+        first = scheduler.get()
+        second = scheduler.get()
+
+        # Assert the second item of host a waits until the first is done
+        self.assertEqual((first[1][2], second[1][2]), ("a0", "b0"))
+        self.assertEqual(scheduler.hosts["a.com"].wait_time(0), None)
+        scheduler.task_done("a.com")
+        self.assertEqual(scheduler.get()[1][2], "a1")
+
+    def test_throttled_host_backs_off(self):
+        # Arrange
+        scheduler = HostScheduler(rate_per_host=10, initial_concurrency=4)
+        scheduler.put(item("http://a.com/0.pdf", "a0"))
+        host, _ = scheduler.get()
+
+        # Act
+        with patch("Host_Scheduler.time.monotonic", return_value=1000.0):
+            scheduler.report(host, 429, 0.1, 30.0)
+
+        # Assert
+        state = scheduler.hosts["a.com"]
+        self.assertEqual(state.concurrency, 2.0)
+        self.assertEqual(state.rate, 5.0)
+        self.assertEqual(state.blocked_until, 1030.0)
+
+    def test_open_circuit_is_not_throttled(self):
+        # Arrange a host that is out of tokens and download slots but whose circuit is open
+        breaker = CircuitBreaker(failure_threshold=1)
+        breaker.record("a.com", "connect")
+        scheduler = HostScheduler(rate_per_host=0.001, burst=1, initial_concurrency=1, circuit_breaker=breaker)
+        for i in range(3):
+            scheduler.put(item(f"http://a.com/{i}.pdf", f"a{i}"))
+
+        # Act
+        names = [scheduler.get()[1][2] for _ in range(3)]
+
+        # Assert its items are handed out at once to fail fast
+        self.assertEqual(names, ["a0", "a1", "a2"])
+
+    def test_max_in_flight_caps_downloads_over_all_hosts(self):
+        # Arrange
+        scheduler = HostScheduler(rate_per_host=100, burst=100, initial_concurrency=8, max_in_flight=2)
+        for host in "abc":
+            scheduler.put(item(f"http://{host}.com/1.pdf", host))
+        first = scheduler.get()
+        second = scheduler.get()
+        handed_out = []
+        waiter = threading.Thread(target=lambda: handed_out.append(scheduler.get()))
+
+        # Act
+        waiter.start()
+        waiter.join(0.2)
+        blocked = waiter.is_alive()
+        scheduler.set_max_in_flight(3)
+        waiter.join(5)
+
+        # Assert the third item only came once the cap was raised
+        self.assertTrue(blocked)
+        self.assertEqual(len(handed_out), 1)
+        self.assertEqual({first[0], second[0], handed_out[0][0]}, {"a.com", "b.com", "c.com"})
+
+    def test_cancel_drops_pending_items(self):
+        # Arrange
+        scheduler = HostScheduler(rate_per_host=100, burst=100, initial_concurrency=8)
+        for i in range(3):
+            scheduler.put(item(f"http://a.com/{i}.pdf", f"a{i}"))
+        host, _ = scheduler.get()
+
+        # Act
+        scheduler.cancel()
+        scheduler.put(item("http://a.com/3.pdf", "a3"))
+        scheduler.task_done(host)
+
+        # Assert only the download in flight had to finish
+        self.assertEqual(scheduler.qsize(), 0)
+        self.assertIsNone(scheduler.get())
+        scheduler.join()
+
+    def test_fast_host_gains_concurrency(self):
+        # Arrange
+        scheduler = HostScheduler(initial_concurrency=2, max_concurrency_per_host=3)
+        scheduler.put(item("http://a.com/0.pdf", "a0"))
+
+        # Act
+        for _ in range(10):
+            scheduler.report("a.com", 200, 0.1)
+
+        # Assert
+        self.assertEqual(scheduler.hosts["a.com"].concurrency, 3)
+
+    def test_get_returns_none_when_finished(self):
+        # Arrange
+        scheduler = HostScheduler()
+        scheduler.put(item(None, "none"))
+        scheduler.close()
+
+        # Act
+        host, _ = scheduler.get()
+        scheduler.task_done(host)
+
+        # Assert
+        self.assertIsNone(scheduler.get())
+        scheduler.join()
+
+    def test_get_waits_until_closed(self):
+        # Arrange
+        scheduler = HostScheduler()
+        results = []
+        worker = threading.Thread(target=lambda: results.append(scheduler.get()))
+        worker.start()
+
+        # Act
+        scheduler.put(item("http://a.com/0.pdf", "a0"))
+        worker.join(5)
+        host, _ = results[0]
+        scheduler.task_done(host)
+        scheduler.close()
+
+        # Assert an item put after the worker started is still picked up, and the worker is released on close
+        self.assertEqual(results[0][1][2], "a0")
+        self.assertIsNone(scheduler.get())
+
+    def test_put_blocks_at_max_pending(self):
+        # Arrange
+        scheduler = HostScheduler(max_pending=1)
+        scheduler.put(item("http://a.com/0.pdf", "a0"))
+        producer = threading.Thread(target=scheduler.put, args=(item("http://a.com/1.pdf", "a1"),))
+
+        # Act
+        producer.start()
+        producer.join(0.1)
+        blocked = producer.is_alive()
+        scheduler.get()
+        producer.join(5)
+
+        # Assert
+        self.assertTrue(blocked)
+        self.assertFalse(producer.is_alive())
+
+    def test_put_back_skips_max_pending(self):
+        # Arrange a full scheduler and a worker holding one of its items
+        scheduler = HostScheduler(max_pending=1)
+        scheduler.put(item("http://a.com/0.pdf", "a0"))
+        host, taken = scheduler.get()
+        scheduler.put(item("http://a.com/1.pdf", "a1"))
+
+        # Act the worker puts its item back while the scheduler is full
+        worker = threading.Thread(target=scheduler.put, args=(taken,), kwargs={"force": True})
+        worker.start()
+        worker.join(5)
+
+        # Assert
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(scheduler.pending, 2)
+
+
+class TestHelpers(unittest.TestCase):
+    def test_host_of(self):
+        self.assertEqual(host_of("https://IR.Example.com/report.pdf"), "ir.example.com")
+        self.assertEqual(host_of(None), "")
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("120"), 120.0)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../benchmarks")))
+from Mock_Pdf_Server import MockPdfServer, ServerConfig
+
+
+class TestMockPdfServer(unittest.TestCase):
+    def test_serves_the_same_pdf_for_a_path(self):
+        with MockPdfServer(ServerConfig(min_size=1000, max_size=2000)) as server:
+            # Act
+            first = requests.get(server.url("reports/1.pdf"), timeout=5)
+            second = requests.get(server.url("reports/1.pdf"), timeout=5)
+
+        # Assert
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers["content-type"], "application/pdf")
+        self.assertTrue(first.content.startswith(b"%PDF"))
+        self.assertTrue(1000 <= len(first.content) <= 2000)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(server.log.latencies()), 1)
+
+    def test_range_and_conditional_requests(self):
+        with MockPdfServer(ServerConfig(min_size=1000, max_size=1000)) as server:
+            # Act
+            whole = requests.get(server.url("1.pdf"), timeout=5)
+            part = requests.get(server.url("1.pdf"), headers={"Range": "bytes=10-"}, timeout=5)
+            unchanged = requests.get(server.url("1.pdf"), headers={"If-None-Match": whole.headers["etag"]}, timeout=5)
+
+        # Assert
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part.content, whole.content[10:])
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_failure_modes(self):
+        # Act
+        with MockPdfServer(ServerConfig(rate_limit_rate=1.0, retry_after=7)) as server:
+            limited = requests.get(server.url("1.pdf"), timeout=5)
+        with MockPdfServer(ServerConfig(html_rate=1.0)) as server:
+            html = requests.get(server.url("1.pdf"), timeout=5)
+
+        # Assert
+        self.assertEqual(limited.status_code, 429)
+        self.assertEqual(limited.headers["retry-after"], "7")
+        self.assertEqual(html.headers["content-type"], "text/html")
+        self.assertEqual(server.log.latencies(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
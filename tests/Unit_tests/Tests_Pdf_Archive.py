@@ -0,0 +1,168 @@
+import unittest
+import io
+import sys
+import os
+import tarfile
+import tempfile
+import zipfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+import Pdf_Archive
+from Pdf_Archive import ArchiveReader, ArchiveWriter
+
+
+class TestPdfArchive(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.temp_dir.name, "files")
+        self.bodies = {f"BR{index}": b"%PDF-1.4 " + bytes([65 + index]) * (1500 + index) + b" %%EOF" for index in range(5)}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def source(self, name):
+        path = os.path.join(self.temp_dir.name, f"{name}.pdf")
+        with open(path, "wb") as file:
+            file.write(self.bodies[name])
+        return path
+
+    def write_all(self, archive_format, max_bytes=1024**3):
+        writer = ArchiveWriter(self.directory, archive_format, max_bytes)
+        entries = [writer.add(name, self.source(name)) for name in self.bodies]
+        writer.close()
+        return entries
+
+    def shards(self, extension):
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(extension))
+
+    def test_zip_shards_are_plain_zip_files(self):
+        # Act
+        entries = self.write_all("zip", max_bytes=5000)
+
+        # Assert the shards roll over at the size cap and every file reads back from the shard it went to
+        shards = self.shards(".zip")
+        self.assertEqual(len(shards), 2)
+        self.assertEqual([entry["path"] for entry in entries], [shards[0]] * 4 + [shards[1]])
+        for shard in shards:
+            with zipfile.ZipFile(shard) as archive:
+                self.assertIsNone(archive.testzip())
+                for member in archive.namelist():
+                    self.assertEqual(archive.read(member), self.bodies[member[: -len(".pdf")]])
+
+    def test_tar_shards_are_plain_tar_files(self):
+        # Act
+        self.write_all("tar")
+
+        # Assert
+        with tarfile.open(self.shards(".tar")[0]) as archive:
+            self.assertEqual(archive.getnames(), [f"{name}.pdf" for name in self.bodies])
+            self.assertEqual(archive.extractfile("BR3.pdf").read(), self.bodies["BR3"])
+
+    @unittest.skipIf(Pdf_Archive.zstandard is None, "zstandard is not installed")
+    def test_tar_zst_shards_decompress_as_one_tar(self):
+        # Act
+        entries = self.write_all("tar.zst")
+
+        # Assert every file is a frame of its own, and the frames together are one tar
+        with open(self.shards(".tar.zst")[0], "rb") as file:
+            data = Pdf_Archive.zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True).read()
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            self.assertEqual(archive.getnames(), [f"{name}.pdf" for name in self.bodies])
+        self.assertEqual(len({entry["offset"] for entry in entries}), 5)
+
+    def test_reader_reads_files_by_name(self):
+        for archive_format in ("zip", "tar"):
+            with self.subTest(archive_format=archive_format):
+                # Arrange
+                self.write_all(archive_format, max_bytes=3000)
+
+                # Act
+                reader = ArchiveReader(self.directory)
+
+                # Assert
+                self.assertEqual(len(reader), 5)
+                self.assertIn("BR2", reader)
+                self.assertNotIn("BR7", reader)
+                self.assertEqual({name: reader.read(name) for name in reader.names()}, self.bodies)
+                with self.assertRaises(KeyError):
+                    reader.read("BR7")
+                for name in os.listdir(self.directory):
+                    os.remove(os.path.join(self.directory, name))
+
+    def test_alias_points_at_the_bytes_of_another_file(self):
+        # Arrange
+        writer = ArchiveWriter(self.directory, "zip", max_bytes=1)
+        writer.add("BR0", self.source("BR0"))
+        writer.add("BR1", self.source("BR1"))
+
+        # Act
+        entry = writer.alias("BR9", "BR0")
+        missing = writer.alias("BR8", "BR7")
+        writer.close()
+
+        # Assert the alias lives in the index of the newer shard and reads the file of the first one
+        reader = ArchiveReader(self.directory)
+        self.assertEqual(reader.read("BR9"), self.bodies["BR0"])
+        self.assertEqual(entry["path"], self.shards(".zip")[0])
+        self.assertIsNone(missing)
+        with zipfile.ZipFile(self.shards(".zip")[0]) as archive:
+            self.assertEqual(archive.namelist(), ["BR0.pdf"])
+
+    def test_later_writer_knows_the_files_of_earlier_runs(self):
+        # Arrange
+        writer = ArchiveWriter(self.directory, "zip")
+        entry = writer.add("BR0", self.source("BR0"))
+        writer.close()
+
+        # Act
+        later = ArchiveWriter(self.directory, "zip")
+        alias = later.alias("BR9", later.duplicate(entry["sha256"]))
+        later.close()
+        again = ArchiveWriter(self.directory, "zip")
+        repeated = again.alias("BR9", "BR0")
+        again.close()
+
+        # Assert the later writer finds the earlier file by name and by content, and aliases it without a second copy
+        self.assertIn("BR0", later)
+        self.assertNotIn("BR1", later)
+        self.assertEqual(later.find("BR0")["path"], entry["path"])
+        self.assertIsNone(later.duplicate("0" * 64))
+        self.assertEqual(alias["path"], entry["path"])
+        self.assertEqual(repeated["path"], entry["path"])
+        self.assertEqual(len(self.shards(".index.jsonl")), 2)
+        self.assertEqual(ArchiveReader(self.directory).read("BR9"), self.bodies["BR0"])
+        with zipfile.ZipFile(entry["path"]) as archive:
+            self.assertEqual(archive.namelist(), ["BR0.pdf"])
+
+    def test_crashed_shard_is_cut_back_and_continued(self):
+        # Arrange a writer that died half way through a file and an index line
+        writer = ArchiveWriter(self.directory, "zip")
+        writer.add("BR0", self.source("BR0"))
+        writer.add("BR1", self.source("BR1"))
+        writer.file.write(b"PK\x03\x04 half a file")
+        writer.index.write('{"name": "BR2", "offs')
+        writer.file.close()
+        writer.index.close()
+
+        # Act
+        reader = ArchiveReader(self.directory)
+        later = ArchiveWriter(self.directory, "zip")
+        later.add("BR2", self.source("BR2"))
+        later.close()
+
+        # Assert the unfinished shard could already be read, and is a complete zip once the next run closed it
+        self.assertEqual(reader.names(), ["BR0", "BR1"])
+        self.assertEqual(self.shards(".zip"), [os.path.join(self.directory, "pdfs-00000.zip")])
+        with zipfile.ZipFile(self.shards(".zip")[0]) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["BR0.pdf", "BR1.pdf", "BR2.pdf"])
+        self.assertEqual(ArchiveReader(self.directory).read("BR2"), self.bodies["BR2"])
+
+    def test_unknown_format_is_rejected(self):
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            ArchiveWriter(self.directory, "rar")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Pdf_Validation import BadPdfError, NotPdfError, PdfValidator, extract_pdf_links
+
+BODY = b"%PDF-1.4\n1 0 obj\n<<>>\nendobj\n"
+PDF = BODY + b"xref\n0 1\n0000000000 65535 f \ntrailer\n<<>>\nstartxref\n" + str(len(BODY)).encode() + b"\n%%EOF\n"
+
+
+class TestPdfValidator(unittest.TestCase):
+    def test_valid_pdf_in_small_chunks(self):
+        # Arrange
+        validator = PdfValidator()
+
+        # Act
+        for start in range(0, len(PDF), 7):
+            validator.feed(PDF[start : start + 7])
+        validator.finish()
+
+    def test_html_is_rejected_on_the_first_kilobyte(self):
+        # Arrange
+        validator = PdfValidator()
+
+        # Act and assert the error is raised before the rest of the body is read
+        with self.assertRaises(NotPdfError) as context:
+            validator.feed(b"<!DOCTYPE html><html>" + b" " * 2000)
+        self.assertTrue(context.exception.html)
+
+    def test_missing_trailer(self):
+        # Arrange
+        validator = PdfValidator()
+        validator.feed(PDF[:-7])
+
+        # Act and assert
+        with self.assertRaises(BadPdfError):
+            validator.finish()
+
+    def test_check_xref(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "report.pdf")
+            for body, valid in ((PDF, True), (PDF.replace(b"startxref\n" + str(len(BODY)).encode(), b"startxref\n3"), False)):
+                with open(path, "wb") as file:
+                    file.write(body)
+                validator = PdfValidator()
+                validator.feed(body)
+                validator.finish()
+
+                # Act and assert
+                if valid:
+                    validator.check_xref(path)
+                else:
+                    self.assertRaises(BadPdfError, validator.check_xref, path)
+
+
+class TestExtractPdfLinks(unittest.TestCase):
+    def test_pdf_links_come_first(self):
+        # Arrange
+        page = b"""<html><head><meta name="citation_pdf_url" content="https://cdn.test.com/a.pdf?download=1"></head>
+        <body><a href="/about">About</a><a href="view?type=pdf">View</a><a href="files/report.PDF">Report</a>
+        <a href="mailto:x@test.com">Mail</a></body></html>"""
+
+        # Act
+        links = extract_pdf_links(page, "http://test.com/reports/1")
+
+        # Assert
+        self.assertEqual(links, ["https://cdn.test.com/a.pdf?download=1", "http://test.com/reports/files/report.PDF", "http://test.com/reports/view?type=pdf"])
+
+    def test_meta_refresh(self):
+        # Act
+        links = extract_pdf_links(b'<meta http-equiv="refresh" content="0; url=/r.pdf">', "http://test.com/")
+
+        # Assert
+        self.assertEqual(links, ["http://test.com/r.pdf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
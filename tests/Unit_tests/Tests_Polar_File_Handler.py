@@ -1,15 +1,26 @@
 import unittest
+import hashlib
 from unittest.mock import MagicMock, patch
 from pathlib import Path
 import polars as pl
 import sys
 import os
+import tempfile
+import threading
+import time
+import zlib
+import zipfile
+import signal
+import socket
 from typing import Optional
 from queue import Queue
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
-from Downloader import Downloader
+from Downloader import Downloader, DownloadResult
 from Polar_File_Handler import FileHandler
+from Host_Scheduler import HostScheduler, host_of
+from Status_Store import StatusStore
+from Pdf_Archive import ArchiveReader, ArchiveWriter
 
 
 class Tests_Polar_File_Handler(unittest.TestCase):
@@ -18,7 +29,6 @@ class Tests_Polar_File_Handler(unittest.TestCase):
         self.mock_handler.destination = "mock_destination"
         self.mock_handler.meta_file = "mock_meta.xlsx"
         self.mock_handler.ID = "mock_id"
-        self.mock_handler.download_status_list = [("id1", "yes"), ("id2", "no")]
 
     @patch("pathlib.Path.mkdir")
     @patch("polars.DataFrame")
@@ -30,18 +40,19 @@ class Tests_Polar_File_Handler(unittest.TestCase):
         file_data_mock.is_empty.return_value = False
         meta_data_mock = MagicMock()
         meta_data_mock.is_empty.return_value = False
-        self.mock_handler.import_data_files.return_value = (file_data_mock, meta_data_mock)
+        self.mock_handler.scan_data_files.return_value = (file_data_mock, meta_data_mock)
 
         # Mock `thread_handler`
-        self.mock_handler.thread_handler = MagicMock()
+        self.mock_handler.thread_handler = MagicMock(return_value=2)
 
         # Instantiate and run
         handler_instance = FileHandler("url_file_name", "report_file_name", "destination", 1)
         handler_instance.destination = self.mock_handler.destination
         handler_instance.meta_file = self.mock_handler.meta_file
         handler_instance.ID = self.mock_handler.ID
-        handler_instance.download_status_list = self.mock_handler.download_status_list
-        handler_instance.import_data_files = self.mock_handler.import_data_files
+        handler_instance.statuses.add("id1", True)
+        handler_instance.statuses.add("id2", False)
+        handler_instance.scan_data_files = self.mock_handler.scan_data_files
         handler_instance.thread_handler = self.mock_handler.thread_handler
 
         handler_instance.handler()
@@ -49,7 +60,7 @@ class Tests_Polar_File_Handler(unittest.TestCase):
         # Assertions
         mock_mkdir.assert_called_once_with(exist_ok=True)
         self.mock_handler.thread_handler.assert_called_once_with(file_data_mock)
-        mock_concat.assert_called_once_with([mock_dataframe.return_value, meta_data_mock], rechunk=True)
+        mock_concat.assert_called_once_with([mock_dataframe.return_value.select.return_value, meta_data_mock], rechunk=True)
         mock_workbook.assert_called_once_with(self.mock_handler.meta_file)
 
     @patch("pathlib.Path.mkdir")
@@ -61,45 +72,99 @@ class Tests_Polar_File_Handler(unittest.TestCase):
         file_data_mock.is_empty.return_value = True
         meta_data_mock = MagicMock()
         meta_data_mock.is_empty.return_value = False
-        self.mock_handler.import_data_files.return_value = (file_data_mock, meta_data_mock)
+        self.mock_handler.scan_data_files.return_value = (file_data_mock, meta_data_mock)
 
-        # Mock `thread_handler`
-        self.mock_handler.thread_handler = MagicMock()
+        # Mock `thread_handler`, which finds no rows to queue
+        self.mock_handler.thread_handler = MagicMock(return_value=0)
 
         # Instantiate and run
         handler_instance = FileHandler("url_file_name", "report_file_name", "destination", 1)
         handler_instance.destination = self.mock_handler.destination
         handler_instance.meta_file = self.mock_handler.meta_file
         handler_instance.ID = self.mock_handler.ID
-        handler_instance.download_status_list = self.mock_handler.download_status_list
-        handler_instance.import_data_files = self.mock_handler.import_data_files
+        handler_instance.statuses.add("id1", True)
+        handler_instance.statuses.add("id2", False)
+        handler_instance.scan_data_files = self.mock_handler.scan_data_files
         handler_instance.thread_handler = self.mock_handler.thread_handler
 
         handler_instance.handler()
 
-        # Assertions
-        self.mock_handler.thread_handler.assert_not_called()
+        # Assertions: the rows are only known once they are streamed, so nothing is exported when none were queued
+        self.mock_handler.thread_handler.assert_called_once_with(file_data_mock)
         mock_dataframe.assert_not_called()
         mock_workbook.assert_not_called()
 
+    @patch("pathlib.Path.mkdir")
+    @patch("polars.DataFrame")
+    @patch("Polar_File_Handler.Workbook")
+    def test_async_engine_selected(self, mock_workbook, mock_dataframe, mock_mkdir):
+        # Arrange
+        file_data_mock = MagicMock()
+        file_data_mock.is_empty.return_value = False
+        handler_instance = FileHandler("url_file_name", "report_file_name", "destination", 4, engine="async")
+        handler_instance.scan_data_files = MagicMock(return_value=(file_data_mock, MagicMock()))
+        handler_instance.thread_handler = MagicMock()
+        handler_instance.async_handler = MagicMock(return_value=0)
+
+        # Act
+        handler_instance.handler()
+
+        # Assert
+        handler_instance.async_handler.assert_called_once_with(file_data_mock)
+        handler_instance.thread_handler.assert_not_called()
+
+    @patch("Polar_File_Handler.AsyncDownloader")
+    def test_async_handler_collects_statuses(self, mock_async):
+        # Arrange
+        file_data = pl.DataFrame({"BRnum": ["id1", "id2"], "Pdf_URL": ["url1", "url2"], "Report Html Address": ["html1", None]})
+        mock_async.return_value.run.side_effect = lambda items, on_result, validators: [on_result((name, "yes" if alt else "no")) for link, dest, name, alt in items]
+        handler_instance = FileHandler("url_file_name", "report_file_name", "destination", 4, engine="async")
+        handler_instance.journal = MagicMock()
+
+        # Act
+        handler_instance.async_handler(file_data)
+
+        # Assert results are handled off the event loop even without an archive
+        self.assertEqual(handler_instance.statuses.rows(), [("id1", "yes"), ("id2", "no")])
+        self.assertIsNotNone(mock_async.call_args.kwargs["result_executor"])
+
+    @patch("Polar_File_Handler.AsyncDownloader")
+    def test_async_handler_archives_off_the_event_loop(self, mock_async):
+        # Arrange
+        file_data = pl.DataFrame({"BRnum": ["id1"], "Pdf_URL": ["url1"], "Report Html Address": [None]})
+        with tempfile.TemporaryDirectory() as directory:
+            handler_instance = FileHandler("url_file_name", os.path.join(directory, "meta.xlsx"), directory, 4, engine="async", archive="zip")
+
+            # Act
+            handler_instance.async_handler(file_data)
+            handler_instance.close()
+
+        # Assert results go through a writer thread of their own, which is shut down with the run
+        executor = mock_async.call_args.kwargs["result_executor"]
+        self.assertIsNotNone(executor)
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+
 
 class TestFileHandlerThreadHandler(unittest.TestCase):
     def setUp(self):
         # Setup the FileHandler instance for tests
         self.file_handler = FileHandler("url_file_name", "report_file_name", "destination", 4)
         self.file_handler.ID = "mock_id"
-        self.file_handler.destination = "mock_destination"
+        self.file_handler.destination = self.file_handler.layout.destination = "mock_destination"
         self.file_handler.number_of_threads = 3  # Assuming 3 threads for this test
 
-    @patch("Polar_File_Handler.Queue")
+    @patch("Polar_File_Handler.HostScheduler")
     def test_queue_population(self, mock_queue):
         # Mock file_data with 25 rows (to check the behavior when there are multiple rows)
-        file_data_mock = MagicMock()
-        file_data_mock.rows.return_value = [{"Report Html Address": f"alt_link_{i}", "Pdf_URL": f"pdf_url_{i}", "mock_id": f"id_{i}"} for i in range(25)]
+        file_data_mock = pl.DataFrame(
+            {"Report Html Address": [f"alt_link_{i}" for i in range(25)], "Pdf_URL": [f"pdf_url_{i}" for i in range(25)], "mock_id": [f"id_{i}" for i in range(25)]}
+        )
 
         # Mock the queue
         mock_queue_instance = MagicMock()
         mock_queue.return_value = mock_queue_instance
+        mock_queue_instance.get.return_value = None  # Workers find no work and exit
 
         # Run the thread_handler function
         self.file_handler.thread_handler(file_data_mock)
@@ -111,42 +176,112 @@ class TestFileHandlerThreadHandler(unittest.TestCase):
         for i in range(25):
             mock_queue_instance.put.assert_any_call([f"pdf_url_{i}", "mock_destination", f"id_{i}", f"alt_link_{i}"])
 
-    @patch("threading.Thread")
-    def test_threads_creation(self, mock_thread):
+    def test_worker_pool_is_reused(self):
         # Mock file_data with 25 rows (to check thread creation)
-        file_data_mock = MagicMock()
-        file_data_mock.rows.return_value = [{"Report Html Address": f"alt_link_{i}", "Pdf_URL": f"pdf_url_{i}", "mock_id": f"id_{i}"} for i in range(25)]
-
-        # Run the thread_handler function
-        with patch("Polar_File_Handler.Queue") as mock_queue:
-            mock_queue_instance = MagicMock()
-            mock_queue.return_value = mock_queue_instance
+        file_data_mock = pl.DataFrame(
+            {"Report Html Address": [f"alt_link_{i}" for i in range(25)], "Pdf_URL": [f"pdf_url_{i}" for i in range(25)], "mock_id": [f"id_{i}" for i in range(25)]}
+        )
+        calls = []
+        self.file_handler.thread_downloader = lambda queue: calls.append(threading.current_thread().name)
 
-            # Run thread_handler method
+        # Run thread_handler twice, as for two url files
+        with patch("Polar_File_Handler.HostScheduler"):
             self.file_handler.thread_handler(file_data_mock)
+            pool = self.file_handler.pool
+            self.file_handler.thread_handler(file_data_mock)
+
+        # Assertions: every run started one worker per thread on the same pool, which no more than 3 threads serve
+        self.assertIs(self.file_handler.pool, pool)
+        self.assertEqual(len(calls), 2 * self.file_handler.number_of_threads)
+        self.assertLessEqual(len(set(calls)), self.file_handler.number_of_threads)
+        self.file_handler.close()
+        self.assertIsNone(self.file_handler.pool)
+
+    @patch.object(Downloader, "download_handling")
+    def test_worker_survives_unexpected_errors(self, mock_download_handling):
+        # Arrange a download that raises for one row
+        def download_handling(url, **kwargs):
+            if url == "pdf_url_1":
+                raise RuntimeError("boom")
+            result = DownloadResult()
+            result.success = True
+            return result
 
-            # Assertions: Ensure the correct number of threads are created (3 threads in this case)
-            self.assertEqual(mock_thread.call_count, self.file_handler.number_of_threads)
+        mock_download_handling.side_effect = download_handling
+        file_data = pl.DataFrame({"mock_id": [f"id_{i}" for i in range(4)], "Pdf_URL": [f"pdf_url_{i}" for i in range(4)], "Report Html Address": [None] * 4})
+        self.file_handler.journal = MagicMock()
+        self.file_handler.number_of_threads = 1
 
-            # Verify each thread is started with the correct arguments
-            for i in range(self.file_handler.number_of_threads):
-                mock_thread.assert_any_call(target=self.file_handler.thread_downloader, args=(mock_queue_instance,))
+        # Act
+        with self.assertLogs("Polar_File_Handler", level="ERROR"):
+            queued = self.file_handler.thread_handler(file_data)
+        self.file_handler.close()
 
-    @patch("Polar_File_Handler.Queue")
+        # Assert the one worker recorded the failure and went on with the other rows
+        self.assertEqual(queued, 4)
+        self.assertEqual(sorted(self.file_handler.statuses.rows()), [("id_0", "yes"), ("id_1", "no"), ("id_2", "yes"), ("id_3", "yes")])
+
+    @patch("Polar_File_Handler.HostScheduler")
     def test_queue_join_called(self, mock_queue):
         # Mock file_data with 25 rows (to check the queue join)
-        file_data_mock = MagicMock()
-        file_data_mock.rows.return_value = [{"Report Html Address": f"alt_link_{i}", "Pdf_URL": f"pdf_url_{i}", "mock_id": f"id_{i}"} for i in range(25)]
+        file_data_mock = pl.DataFrame(
+            {"Report Html Address": [f"alt_link_{i}" for i in range(25)], "Pdf_URL": [f"pdf_url_{i}" for i in range(25)], "mock_id": [f"id_{i}" for i in range(25)]}
+        )
 
         # Mock the queue
         mock_queue_instance = MagicMock()
         mock_queue.return_value = mock_queue_instance
+        mock_queue_instance.get.return_value = None  # Workers find no work and exit
 
         # Run the thread_handler function
         self.file_handler.thread_handler(file_data_mock)
 
         # Assertions: Ensure that the join method is called once to wait for threads to complete
         mock_queue_instance.join.assert_called_once()
+        mock_queue_instance.close.assert_called_once()
+
+    @patch("Polar_File_Handler.HostScheduler")
+    def test_lazy_input_is_streamed_in_batches(self, mock_queue):
+        # Arrange
+        file_data = pl.DataFrame({"mock_id": [f"id_{i}" for i in range(25)], "Pdf_URL": [f"pdf_url_{i}" for i in range(25)], "Report Html Address": [None] * 25}).lazy()
+        self.file_handler.batch_size = 10
+        mock_queue.return_value.get.return_value = None
+
+        # Act
+        queued = self.file_handler.thread_handler(file_data)
+
+        # Assert
+        self.assertEqual(queued, 25)
+        mock_queue.return_value.put.assert_any_call(["pdf_url_24", "mock_destination", "id_24", None])
+
+
+class TestFileHandlerThreadDownloader(unittest.TestCase):
+    @patch("Polar_File_Handler.Downloader")
+    def test_statuses_and_host_feedback(self, mock_downloader):
+        # Arrange
+        handler = FileHandler("url_file_name", "report_file_name", "destination", 1)
+        handler.add_download_status = MagicMock()
+        success = MagicMock(responses=[("http://a.com/1.pdf", 200, 0.1, None)])
+        success.__bool__.return_value = True
+        success.details.return_value = {"sha256": "abc"}
+        failure = MagicMock(responses=[("http://a.com/2.pdf", 429, 0.1, 5.0)])
+        failure.__bool__.return_value = False
+        failure.details.return_value = {"failure": "http_429", "attempts": 3}
+        mock_downloader.return_value.download_handling.side_effect = [success, failure]
+        scheduler = HostScheduler(initial_concurrency=1)
+        scheduler.report = MagicMock()
+        scheduler.put(["http://a.com/1.pdf", "destination", "id1", None])
+        scheduler.put(["http://a.com/2.pdf", "destination", "id2", None])
+        scheduler.close()
+
+        # Act
+        handler.thread_downloader(scheduler)
+
+        # Assert
+        handler.add_download_status.assert_any_call(("id1", "yes"), {"sha256": "abc", "path": os.path.join("destination", "id1.pdf")}, success)
+        handler.add_download_status.assert_any_call(("id2", "no"), {"failure": "http_429", "attempts": 3}, failure)
+        scheduler.report.assert_any_call("a.com", 429, 0.1, 5.0)
+        self.assertIsNone(scheduler.get())
 
 
 class TestFileHandlerImportDataFiles(unittest.TestCase):
@@ -174,7 +309,7 @@ class TestFileHandlerImportDataFiles(unittest.TestCase):
 
         # Assertions to check filtering results
         self.assertEqual(file_data.shape[0], 1)  # Only one file should be left after join
-        self.assertEqual(file_data["BRnum"].to_list(), [3])  # Only the record with BRnum 3 remains
+        self.assertEqual(file_data["BRnum"].to_list(), ["3"])  # Only the record with BRnum 3 remains
 
         # Check if meta_data is correctly filtered (pdf_downloaded == "yes")
         self.assertEqual(meta_data.shape[0], 2)  # Both entries should remain since pdf_downloaded is "yes"
@@ -199,10 +334,666 @@ class TestFileHandlerImportDataFiles(unittest.TestCase):
 
         # Assertions to check filtering results
         self.assertEqual(file_data.shape[0], 3)  # No filtering should happen, all 3 rows should remain
-        self.assertEqual(file_data["BRnum"].to_list(), [1, 2, 3])  # All records should be present
+        self.assertEqual(file_data["BRnum"].to_list(), ["1", "2", "3"])  # All records should be present
         self.assertEqual(meta_data.shape[0], 0)  # meta_data should be empty since the meta file doesn't exist
 
 
+class TestFileHandlerJournal(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.journal_file = os.path.join(self.temp_dir.name, "meta.journal.jsonl")
+        self.handler = FileHandler("url_file.xlsx", "meta_file.xlsx", "destination", 4, journal_file=self.journal_file)
+
+    def tearDown(self):
+        self.handler.journal.close()
+        self.temp_dir.cleanup()
+
+    def test_add_download_status_writes_journal(self):
+        # Act
+        self.handler.add_download_status(("id1", "yes"))
+        self.handler.add_download_status(("id2", "no"))
+        self.handler.journal.flush()
+
+        # Assert the statuses are on disk before the run has finished
+        with open(self.journal_file) as file:
+            self.assertEqual(len(file.readlines()), 2)
+
+    @patch("polars.read_excel")
+    def test_import_data_files_resumes_from_journal(self, mock_read_excel):
+        # Arrange
+        self.handler.add_download_status((1, "yes"))
+        self.handler.add_download_status((2, "no"))
+        self.handler.journal.close()
+        mock_read_excel.return_value = pl.DataFrame({"BRnum": [1, 2, 3], "Pdf_URL": ["url1", "url2", "url3"], "Report Html Address": ["html1", "html2", "html3"]})
+
+        # Act
+        file_data, meta_data = self.handler.import_data_files()
+
+        # Assert only the url file was parsed and the journaled downloads were skipped, the failed row going last
+        mock_read_excel.assert_called_once()
+        self.assertTrue(self.handler.resumed_from_store)
+        self.assertEqual(file_data["BRnum"].to_list(), ["3", "2"])
+        self.assertEqual(meta_data["BRnum"].to_list(), ["1"])
+
+    @patch("polars.read_excel")
+    def test_resumes_from_status_store(self, mock_read_excel):
+        # Arrange a finished run whose journal was folded into the status store
+        self.handler.status_store.path = os.path.join(self.temp_dir.name, "meta.status")
+        self.handler.add_download_status((1, "yes"), {"url": "url1", "sha256": "abc", "path": "1.pdf"})
+        self.handler.add_download_status((2, "no"), {"failure": "http_5xx", "attempts": 3})
+        self.handler.journal.close()
+        self.handler.fold_journal()
+        mock_read_excel.return_value = pl.DataFrame({"BRnum": [1, 2, 3], "Pdf_URL": ["url1", "url2", "url3"], "Report Html Address": ["html1", "html2", "html3"]})
+
+        # Act
+        file_data, meta_data = self.handler.import_data_files()
+
+        # Assert the journal is gone and the store alone decides what to skip
+        self.assertFalse(self.handler.journal.exists())
+        self.assertTrue(self.handler.resumed_from_store)
+        self.assertEqual(file_data["BRnum"].to_list(), ["3", "2"])
+        self.assertEqual(meta_data["BRnum"].to_list(), ["1"])
+        self.assertEqual(self.handler.validators["1"]["sha256"], "abc")
+
+    def test_store_is_compacted_once_it_holds_too_many_parts(self):
+        # Arrange
+        self.handler.status_store.path = os.path.join(self.temp_dir.name, "meta.status")
+        self.handler.compact_parts = 2
+        parts = []
+
+        # Act
+        for status in ["no", "no", "yes"]:
+            self.handler.add_download_status((1, status))
+            self.handler.journal.close()
+            self.handler.fold_journal()
+            parts.append(len(self.handler.status_store.parts()))
+
+        # Assert the third part took the store past the limit, and only the latest status of the id was kept
+        self.assertEqual(parts, [1, 2, 1])
+        self.assertEqual(self.handler.status_store.read(self.handler.ID).select("BRnum", "pdf_downloaded").rows(), [("1", "yes")])
+
+    def test_shards_do_not_compact_the_store(self):
+        # Arrange
+        self.handler.status_store.path = os.path.join(self.temp_dir.name, "meta.status")
+        self.handler.compact_parts = 1
+        self.handler.shard = (0, 2)
+
+        # Act
+        for status in ["no", "yes"]:
+            self.handler.add_download_status((1, status))
+            self.handler.journal.close()
+            self.handler.fold_journal()
+
+        # Assert
+        self.assertEqual(len(self.handler.status_store.parts()), 2)
+
+
+class TestFileHandlerScanDataFiles(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.url_data = pl.DataFrame({"BRnum": ["1", "2", "3"], "Pdf_URL": ["url1", "url2", "url3"], "Report Html Address": ["html1", "html2", "html3"], "Other": [1, 2, 3]})
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_scan_csv_and_parquet(self):
+        numeric = self.url_data.with_columns(pl.col("BRnum").cast(pl.Int64))
+        for extension, write in ((".csv", self.url_data.write_csv), (".parquet", self.url_data.write_parquet), (".pq", numeric.write_parquet)):
+            with self.subTest(extension=extension):
+                # Arrange ids that look like numbers, which the csv reader would take for integers
+                url_file = os.path.join(self.temp_dir.name, "urls" + extension)
+                write(url_file)
+                handler = FileHandler(url_file, os.path.join(self.temp_dir.name, "meta.xlsx"), "destination", 1)
+                handler.add_download_status = MagicMock()
+                downloaded = DownloadResult()
+                downloaded.success = True
+                downloader = MagicMock()
+                downloader.download_handling.return_value = downloaded
+
+                # Act
+                file_data, meta_data = handler.scan_data_files()
+                rows = file_data.collect()
+                handler.download_item(downloader, MagicMock(), [rows["Pdf_URL"][0], "destination", rows["BRnum"][0], None])
+
+                # Assert nothing is read before the query is collected, and the ids are strings that name the files
+                self.assertIsInstance(file_data, pl.LazyFrame)
+                self.assertEqual(rows.columns, ["BRnum", "Pdf_URL", "Report Html Address"])
+                self.assertEqual(rows.schema["BRnum"], pl.String)
+                self.assertTrue(meta_data.is_empty())
+                handler.add_download_status.assert_called_once_with(("1", "yes"), dict(downloaded.details(), path=os.path.join("destination", "1.pdf")), downloaded)
+
+
+class TestFileHandlerShards(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.url_file = os.path.join(self.temp_dir.name, "urls.parquet")
+        self.meta_file = os.path.join(self.temp_dir.name, "meta.xlsx")
+        hosts = ["http://a.example", "http://B.example", "https://c.example:8443", None]
+        pl.DataFrame(
+            {
+                "BRnum": [str(i) for i in range(40)],
+                "Pdf_URL": [f"{hosts[i % 4]}/{i}.pdf" if hosts[i % 4] else None for i in range(40)],
+                "Report Html Address": [f"http://d.example/{i}" for i in range(40)],
+            }
+        ).write_parquet(self.url_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def shard_rows(self, shard_by: str) -> list:
+        shards = []
+        for index in range(3):
+            handler = FileHandler(self.url_file, self.meta_file, "destination", 1, shard=(index, 3), shard_by=shard_by)
+            file_data, meta_data = handler.scan_data_files()
+            shards.append(file_data.collect())
+        return shards
+
+    def test_shards_split_rows_by_id(self):
+        # Act
+        shards = self.shard_rows("id")
+
+        # Assert every row lands in exactly one shard
+        ids = [row for shard in shards for row in shard["BRnum"].to_list()]
+        self.assertEqual(sorted(ids), sorted(str(i) for i in range(40)))
+
+    def test_shards_do_not_depend_on_the_polars_version(self):
+        # Act
+        shards = self.shard_rows("id")
+
+        # Assert the rows are split by the CRC-32 of their id, which every machine computes alike
+        for index, shard in enumerate(shards):
+            self.assertEqual(shard["BRnum"].to_list(), [str(i) for i in range(40) if zlib.crc32(str(i).encode()) % 3 == index])
+
+    def test_shards_split_rows_by_host(self):
+        # Act
+        shards = self.shard_rows("host")
+
+        # Assert every row lands in exactly one shard and every host in one shard only
+        self.assertEqual(sum(shard.height for shard in shards), 40)
+        hosts = [{host_of(link or alt) for link, alt in shard.select("Pdf_URL", "Report Html Address").iter_rows()} for shard in shards]
+        for index, shard_hosts in enumerate(hosts):
+            for other in hosts[index + 1 :]:
+                self.assertFalse(shard_hosts & other)
+
+    def test_shards_use_their_own_journal(self):
+        # Act
+        first = FileHandler(self.url_file, self.meta_file, "destination", 1, shard=(0, 2))
+        second = FileHandler(self.url_file, self.meta_file, "destination", 1, shard=(1, 2))
+
+        # Assert
+        self.assertNotEqual(first.journal.path, second.journal.path)
+        self.assertEqual(first.status_store.path, second.status_store.path)
+
+    @patch("Polar_File_Handler.Workbook")
+    @patch("polars.DataFrame.write_excel")
+    def test_merge_and_export_status_store(self, mock_write_excel, mock_workbook):
+        # Arrange two shards written to separate stores
+        for index, rows in enumerate(([("3", "yes"), ("1", "no")], [("2", "yes")])):
+            store = StatusStore(os.path.join(self.temp_dir.name, f"shard{index}.status"))
+            store.append(pl.DataFrame(rows, schema=["BRnum", "pdf_downloaded"], orient="row"), "BRnum")
+        handler = FileHandler(self.url_file, self.meta_file, "destination", 1)
+
+        # Act
+        copied = handler.status_store.merge(*(os.path.join(self.temp_dir.name, f"shard{index}.status") for index in range(2)))
+        handler.export_status_store()
+
+        # Assert the statuses are exported sorted by id
+        self.assertEqual(copied, 2)
+        self.assertEqual(handler.status_store.read("BRnum").sort("BRnum")["BRnum"].to_list(), ["1", "2", "3"])
+        mock_workbook.assert_called_once_with(self.meta_file)
+
+
+class TestFileHandlerDns(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.url_file = os.path.join(self.temp_dir.name, "urls.parquet")
+        pl.DataFrame(
+            {
+                "BRnum": ["1", "2", "3"],
+                "Pdf_URL": ["http://dead.example/1.pdf", "http://dead.example:8080/2.pdf", "http://a.example/3.pdf"],
+                "Report Html Address": ["http://a.example/1", "http://dead.example/2", None],
+            }
+        ).write_parquet(self.url_file)
+        self.handler = FileHandler(self.url_file, os.path.join(self.temp_dir.name, "meta.xlsx"), "destination", 1, prefetch_dns=True)
+
+    def tearDown(self):
+        self.handler.journal.close()
+        self.temp_dir.cleanup()
+
+    @patch("Dns_Cache.socket.getaddrinfo")
+    def test_rows_on_dead_hosts_skip_to_alt_url_or_fail(self, mock_getaddrinfo):
+        # Arrange
+        def getaddrinfo(host, *args):
+            if host == "dead.example":
+                raise socket.gaierror("Name or service not known")
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", 0))]
+
+        mock_getaddrinfo.side_effect = getaddrinfo
+        file_data, meta_data = self.handler.scan_data_files()
+
+        # Act
+        self.handler.prefetch_hosts(file_data)
+        rows = list(self.handler.download_rows(file_data))
+
+        # Assert every host was resolved once, row 1 only keeps its alternative url and row 2 failed without a request
+        self.assertEqual(mock_getaddrinfo.call_count, 2)
+        self.assertEqual(self.handler.dead_hosts, {"dead.example"})
+        self.assertEqual(rows, [("1", None, "http://a.example/1"), ("3", "http://a.example/3.pdf", None)])
+        self.assertEqual(self.handler.statuses.rows(), [("2", "no")])
+        self.assertEqual(self.handler.dead_rows, 1)
+
+    @patch("Dns_Cache.socket.getaddrinfo")
+    def test_hosts_that_stop_resolving_during_the_run_are_skipped(self, mock_getaddrinfo):
+        # Arrange a run without a prefetch in which a download already failed to resolve dead.example
+        mock_getaddrinfo.side_effect = socket.gaierror("Name or service not known")
+        self.handler.prefetch_dns = False
+        with self.assertRaises(socket.gaierror):
+            self.handler.dns_cache.resolve("dead.example")
+        file_data, meta_data = self.handler.scan_data_files()
+
+        # Act
+        rows = list(self.handler.download_rows(file_data))
+
+        # Assert the cached failure is used without another lookup
+        self.assertEqual(mock_getaddrinfo.call_count, 1)
+        self.assertEqual(rows, [("1", None, "http://a.example/1"), ("3", "http://a.example/3.pdf", None)])
+        self.assertEqual(self.handler.statuses.rows(), [("2", "no")])
+
+
+class TestFileHandlerRuns(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.url_files = []
+        for index in range(2):
+            url_file = os.path.join(self.temp_dir.name, f"urls{index}.parquet")
+            pl.DataFrame(
+                {"BRnum": [f"{index}-{i}" for i in range(3)], "Pdf_URL": [f"http://a.example/{index}/{i}.pdf" for i in range(3)], "Report Html Address": [None] * 3}
+            ).write_parquet(url_file)
+            self.url_files.append(url_file)
+        self.meta_file = os.path.join(self.temp_dir.name, "meta.xlsx")
+        self.destination = os.path.join(self.temp_dir.name, "files")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_url_files_are_downloaded_back_to_back(self):
+        # Arrange
+        handler = FileHandler(self.url_files, self.meta_file, self.destination, 2, export_xlsx=False, progress_interval=None)
+        seen = []
+        handler.thread_handler = lambda file_data: seen.append(file_data.collect()["BRnum"].to_list()) or 3
+
+        # Act
+        handler.handler()
+
+        # Assert
+        self.assertEqual(seen, [["0-0", "0-1", "0-2"], ["1-0", "1-1", "1-2"]])
+
+    def test_second_run_exports_every_id_once(self):
+        # Arrange a handler that downloads one url file and then another
+        handler = FileHandler(self.url_files[0], self.meta_file, self.destination, 1, retry_budget=1, progress_interval=None)
+
+        def download_handling(url, destination_path, **kwargs):
+            result = DownloadResult()
+            result.success = True
+            return result
+
+        # Act
+        with patch.object(Downloader, "download_handling", side_effect=download_handling):
+            handler.handler()
+            handler.retry_policy.budget = 0
+            handler.url_files = [self.url_files[1]]
+            handler.handler()
+        handler.close()
+
+        # Assert the second run counted and exported its own rows next to the ones stored before, not the first run again
+        self.assertEqual(len(handler.statuses), 3)
+        self.assertEqual(handler.metrics.snapshot()["completed"], 3)
+        self.assertEqual(handler.retry_policy.budget, 1)
+        exported = pl.read_excel(self.meta_file)
+        self.assertEqual(sorted(exported[handler.ID].to_list()), [f"{index}-{i}" for index in range(2) for i in range(3)])
+
+    def test_rows_with_the_same_urls_share_one_download(self):
+        # Arrange rows 0-0, 0-2 and 0-3 with the same urls
+        url_file = os.path.join(self.temp_dir.name, "shared.parquet")
+        links = ["http://a.example/x.pdf", "http://a.example/y.pdf", "http://a.example/x.pdf", "http://a.example/x.pdf"]
+        pl.DataFrame({"BRnum": [f"0-{i}" for i in range(4)], "Pdf_URL": links, "Report Html Address": [None] * 4}).write_parquet(url_file)
+        handler = FileHandler(url_file, self.meta_file, self.destination, 1, export_xlsx=False, progress_interval=None)
+
+        def download_handling(url, destination_path, **kwargs):
+            with open(destination_path, "wb") as file:
+                file.write(url.encode())
+            result = DownloadResult()
+            result.success = True
+            result.url = url
+            return result
+
+        # Act
+        with patch.object(Downloader, "download_handling", side_effect=download_handling) as mock_download_handling:
+            handler.handler()
+        handler.close()
+
+        # Assert only the distinct urls were downloaded and the rows sharing them got hardlinks of the same file
+        self.assertEqual(mock_download_handling.call_count, 2)
+        self.assertEqual(sorted(handler.statuses.rows()), [(f"0-{i}", "yes") for i in range(4)])
+        self.assertEqual(handler.coalescer.coalesced, 2)
+        for name in ["0-2", "0-3"]:
+            self.assertTrue(os.path.samefile(os.path.join(self.destination, "0-0.pdf"), os.path.join(self.destination, name + ".pdf")))
+        statuses = handler.status_store.read(handler.ID)
+        self.assertEqual(statuses.filter(pl.col(handler.ID) == "0-3")["path"].item(), os.path.join(self.destination, "0-3.pdf"))
+
+    def test_slow_downloads_are_put_back_into_a_full_queue(self):
+        # Arrange one worker and a queue of one item, so the worker puts every slow item back into a full queue
+        handler = FileHandler(self.url_files[0], self.meta_file, self.destination, 1, batch_size=1, min_transfer_rate=1000.0, export_xlsx=False, progress_interval=None)
+
+        def download_handling(url, rate_floor=True, **kwargs):
+            # Gives up only once the rest of the input fills the queue
+            while rate_floor and handler.scheduler.pending < 2 and not handler.scheduler.closed:
+                time.sleep(0.01)
+            result = DownloadResult()
+            result.success = not rate_floor
+            result.failure = "slow" if rate_floor else None
+            return result
+
+        # Act
+        with patch.object(Downloader, "download_handling", side_effect=download_handling) as mock_download_handling:
+            run = threading.Thread(target=handler.handler, daemon=True)
+            run.start()
+            run.join(10)
+
+        # Assert every row was tried once with the rate floor and once without
+        self.assertFalse(run.is_alive())
+        handler.close()
+        self.assertEqual(mock_download_handling.call_count, 6)
+        self.assertEqual(sorted(handler.statuses.rows()), [(f"0-{i}", "yes") for i in range(3)])
+
+    def test_interrupt_cancels_the_run(self):
+        # Arrange a download that is interrupted by Ctrl+C
+        handler = FileHandler(self.url_files[0], self.meta_file, self.destination, 1, export_xlsx=False, progress_interval=None)
+
+        def download_handling(url, **kwargs):
+            result = DownloadResult()
+            if url.endswith("/0.pdf"):
+                os.kill(os.getpid(), signal.SIGINT)
+                handler.cancelled.wait(5)
+                result.failure = "cancelled"
+            return result
+
+        # Act
+        with patch.object(Downloader, "download_handling", side_effect=download_handling), self.assertLogs("Polar_File_Handler", level="WARNING"):
+            handler.handler()
+        handler.close()
+
+        # Assert nothing was recorded for the cut off row and the other rows were left for the next run
+        self.assertTrue(handler.cancelled.is_set())
+        self.assertEqual(handler.statuses.rows(), [])
+        self.assertIs(signal.getsignal(signal.SIGINT), signal.default_int_handler)
+
+
+class TestFileHandlerVerify(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "files")
+        os.makedirs(self.destination)
+        url_file = os.path.join(self.temp_dir.name, "urls.csv")
+        pl.DataFrame({"BRnum": [1, 2, 3, 4, 5, 6], "Pdf_URL": [f"url{index}" for index in range(1, 7)], "Report Html Address": [None] * 6}).write_csv(url_file)
+        self.handler = FileHandler(url_file, os.path.join(self.temp_dir.name, "meta.xlsx"), self.destination, 1)
+        self.pdf = b"%PDF-1.4\n" + b"x" * 2000 + b"\n%%EOF\n"
+
+    def tearDown(self):
+        self.handler.close()
+        self.temp_dir.cleanup()
+
+    def write(self, name, data):
+        with open(os.path.join(self.destination, name), "wb") as file:
+            file.write(data)
+
+    def test_verify_requeues_missing_and_corrupt_files(self):
+        # Arrange a complete file, a missing one, a truncated one, a replaced one, one never recorded and one not in the url file
+        sha256 = hashlib.sha256(self.pdf).hexdigest()
+        for name in (1, 2, 3, 4):
+            self.handler.add_download_status((name, "yes"), {"content_length": len(self.pdf), "sha256": sha256, "path": os.path.join(self.destination, f"{name}.pdf")})
+        self.handler.journal.close()
+        self.write("1.pdf", self.pdf)
+        self.write("3.pdf", self.pdf[:1000])
+        self.write("4.pdf", self.pdf.replace(b"x", b"y"))
+        self.write("5.pdf", self.pdf)
+        self.write("99.pdf", self.pdf)
+
+        # Act
+        counts = self.handler.verify(processes=1)
+        file_data, meta_data = self.handler.import_data_files()
+        again = self.handler.verify(processes=1)
+
+        # Assert only the missing and corrupt rows and the row never downloaded are queued, and nothing is hashed twice
+        self.assertEqual(counts, {"files": 4, "hashed": 5, "missing": 1, "corrupt": 2, "recovered": 1})
+        self.assertEqual(file_data["BRnum"].to_list(), ["6", "2", "3", "4"])
+        self.assertEqual(sorted(meta_data["BRnum"].to_list()), ["1", "5"])
+        self.assertEqual(self.handler.validators["5"]["sha256"], sha256)
+        self.assertEqual(again, {"files": 4, "hashed": 0, "missing": 0, "corrupt": 0, "recovered": 0})
+
+
+class TestFileHandlerLayout(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "files")
+        os.makedirs(self.destination)
+        self.url_file = os.path.join(self.temp_dir.name, "urls.csv")
+        pl.DataFrame({"BRnum": [1, 2], "Pdf_URL": ["url1", "url2"], "Report Html Address": [None, None]}).write_csv(self.url_file)
+        self.meta_file = os.path.join(self.temp_dir.name, "meta.xlsx")
+        self.pdf = b"%PDF-1.4\n" + b"x" * 2000 + b"\n%%EOF\n"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_migrate_layout_records_the_new_paths(self):
+        # Arrange a flat destination from an earlier run that was verified
+        with FileHandler(self.url_file, self.meta_file, self.destination, 1) as flat:
+            for name in (1, 2):
+                path = os.path.join(self.destination, f"{name}.pdf")
+                with open(path, "wb") as file:
+                    file.write(self.pdf)
+                flat.add_download_status((name, "yes"), {"sha256": hashlib.sha256(self.pdf).hexdigest(), "path": path})
+            flat.journal.close()
+            flat.verify(processes=1)
+        handler = FileHandler(self.url_file, self.meta_file, self.destination, 1, layout="hash")
+
+        # Act
+        moved = handler.migrate_layout()
+        counts = handler.verify(processes=1)
+
+        # Assert the stored paths point into the new folders and the moved files are not hashed again
+        self.assertEqual(moved, 2)
+        paths = dict(handler.read_statuses("yes").select("BRnum", "path").iter_rows())
+        self.assertEqual(paths, {"1": handler.layout.path(1), "2": handler.layout.path(2)})
+        self.assertTrue(all(os.path.isfile(path) for path in paths.values()))
+        self.assertEqual(counts["hashed"], 0)
+        self.assertEqual(counts["missing"] + counts["corrupt"], 0)
+
+    def test_rows_are_queued_into_their_layout_folder(self):
+        # Arrange
+        handler = FileHandler(self.url_file, self.meta_file, self.destination, 1, layout="hash")
+        file_data, _ = handler.import_data_files()
+
+        # Act
+        with patch.object(handler, "thread_downloader"), patch("Polar_File_Handler.HostScheduler") as mock_queue:
+            handler.thread_handler(file_data)
+
+        # Assert
+        folders = [call.args[0][1] for call in mock_queue.return_value.put.call_args_list]
+        self.assertEqual(folders, [handler.layout.directory(1), handler.layout.directory(2)])
+        self.assertTrue(all(os.path.isdir(folder) for folder in folders))
+        handler.close()
+
+
+class TestFileHandlerArchive(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.destination = os.path.join(self.temp_dir.name, "files")
+        os.makedirs(self.destination)
+        url_file = os.path.join(self.temp_dir.name, "urls.csv")
+        pl.DataFrame({"BRnum": [1, 2, 3], "Pdf_URL": ["url1", "url1", "url3"], "Report Html Address": [None] * 3}).write_csv(url_file)
+        self.handler = FileHandler(url_file, os.path.join(self.temp_dir.name, "meta.xlsx"), self.destination, 1, archive="zip")
+        self.pdf = b"%PDF-1.4\n" + b"x" * 2000 + b"\n%%EOF\n"
+
+    def tearDown(self):
+        self.handler.close()
+        self.temp_dir.cleanup()
+
+    def test_downloads_are_moved_into_the_archive(self):
+        # Arrange a row whose download is shared by a row with the same urls
+        path = os.path.join(self.destination, "1.pdf")
+        with open(path, "wb") as file:
+            file.write(self.pdf)
+        self.handler.coalescer.claim(("url1", None), 1)
+        self.handler.coalescer.claim(("url1", None), 2)
+
+        # Act
+        self.handler.add_download_status((1, "yes"), {"content_length": len(self.pdf), "sha256": hashlib.sha256(self.pdf).hexdigest(), "path": path})
+        self.handler.archive.close()
+        self.handler.journal.close()
+        counts = self.handler.verify(processes=1)
+
+        # Assert both rows read the one archived file, which no longer lies loose, and verify finds nothing missing
+        reader = ArchiveReader(self.destination)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(reader.read(1), self.pdf)
+        self.assertEqual(reader.read(2), self.pdf)
+        shard = os.path.join(self.destination, "pdfs-00000.zip")
+        self.assertEqual(dict(self.handler.read_statuses("yes").select("BRnum", "path").iter_rows()), {"1": shard, "2": shard})
+        self.assertEqual((counts["missing"], counts["corrupt"], counts["recovered"]), (0, 0, 0))
+
+    def write_pdf(self, name, body=None):
+        path = os.path.join(self.destination, f"{name}.pdf")
+        with open(path, "wb") as file:
+            file.write(body or self.pdf)
+        return path
+
+    def test_unchanged_download_keeps_its_archive_entry(self):
+        # Arrange a file archived by an earlier run that the server reports unchanged
+        sha256 = hashlib.sha256(self.pdf).hexdigest()
+        self.handler.add_download_status((1, "yes"), {"sha256": sha256, "path": self.write_pdf(1)})
+        self.handler.archive.close()
+        self.handler.archive = ArchiveWriter(self.destination, "zip")
+        result = DownloadResult()
+        result.not_modified = True
+
+        # Act
+        self.handler.add_download_status((1, "yes"), {"sha256": sha256, "path": os.path.join(self.destination, "1.pdf")}, result)
+        self.handler.archive.close()
+        self.handler.journal.close()
+
+        # Assert nothing was archived again and the status points at the earlier shard
+        shard = os.path.join(self.destination, "pdfs-00000.zip")
+        self.assertEqual(sorted(os.listdir(self.destination)), ["pdfs-00000.index.jsonl", "pdfs-00000.zip"])
+        self.assertEqual(dict(self.handler.read_statuses("yes").select("BRnum", "path").iter_rows()), {"1": shard})
+        self.assertEqual(ArchiveReader(self.destination).read(1), self.pdf)
+
+    def test_identical_content_is_aliased_in_the_archive(self):
+        # Arrange
+        sha256 = hashlib.sha256(self.pdf).hexdigest()
+
+        # Act
+        self.handler.add_download_status((1, "yes"), {"sha256": sha256, "path": self.write_pdf(1)})
+        self.handler.add_download_status((3, "yes"), {"sha256": sha256, "path": self.write_pdf(3)})
+        self.handler.archive.close()
+
+        # Assert the bytes are stored once and both names read them
+        reader = ArchiveReader(self.destination)
+        with zipfile.ZipFile(os.path.join(self.destination, "pdfs-00000.zip")) as archive:
+            self.assertEqual(archive.namelist(), ["1.pdf"])
+        self.assertEqual(reader.read(3), self.pdf)
+        self.assertFalse(os.path.exists(os.path.join(self.destination, "3.pdf")))
+
+    def test_archived_files_keep_their_validators(self):
+        # Arrange
+        sha256 = hashlib.sha256(self.pdf).hexdigest()
+        self.handler.add_download_status((1, "yes"), {"url": "url1", "etag": '"v1"', "sha256": sha256, "path": self.write_pdf(1)})
+        statuses = pl.DataFrame({"BRnum": ["1", "2"], "pdf_downloaded": ["yes", "yes"], "etag": ['"v1"', '"v2"'], "sha256": [sha256, "abc"], "path": ["x.zip", "2.pdf"]})
+
+        # Act
+        self.handler.load_cache(statuses)
+
+        # Assert only the archived file may be revalidated without being on disk
+        self.assertTrue(self.handler.validators["1"]["archived"])
+        self.assertNotIn("archived", self.handler.validators["2"])
+        self.assertNotIn(sha256, self.handler.content_index)
+
+
+class TestFileHandlerContentCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.handler = FileHandler("url_file.xlsx", "meta_file.xlsx", self.temp_dir.name, 4, journal_file=os.path.join(self.temp_dir.name, "journal.jsonl"))
+
+    def tearDown(self):
+        self.handler.journal.close()
+        self.temp_dir.cleanup()
+
+    def test_identical_content_is_hardlinked(self):
+        # Arrange
+        first = os.path.join(self.temp_dir.name, "id1.pdf")
+        second = os.path.join(self.temp_dir.name, "id2.pdf")
+        for path in (first, second):
+            with open(path, "wb") as file:
+                file.write(b"%PDF-1.4 same report")
+
+        # Act
+        self.handler.add_download_status(("id1", "yes"), {"sha256": "abc", "path": first})
+        self.handler.add_download_status(("id2", "yes"), {"sha256": "abc", "path": second})
+
+        # Assert
+        self.assertTrue(os.path.samefile(first, second))
+
+    @patch("polars.read_excel")
+    def test_refresh_requeues_downloaded_rows_with_validators(self, mock_read_excel):
+        # Arrange
+        self.handler.add_download_status((1, "yes"), {"url": "url1", "etag": '"v1"', "sha256": "abc", "path": "id1.pdf"})
+        self.handler.journal.close()
+        self.handler.refresh = True
+        mock_read_excel.return_value = pl.DataFrame({"BRnum": [1, 2], "Pdf_URL": ["url1", "url2"], "Report Html Address": ["html1", "html2"]})
+
+        # Act
+        file_data, meta_data = self.handler.import_data_files()
+
+        # Assert the new row comes before the revalidation
+        self.assertEqual(file_data["BRnum"].to_list(), ["2", "1"])
+        self.assertEqual(self.handler.validators["1"]["etag"], '"v1"')
+
+    @patch("polars.read_excel")
+    def test_skip_permanent_failures(self, mock_read_excel):
+        # Arrange
+        self.handler.add_download_status((1, "no"), {"failure": "http_4xx", "attempts": 1})
+        self.handler.add_download_status((2, "no"), {"failure": "read_timeout", "attempts": 3})
+        self.handler.journal.close()
+        self.handler.skip_permanent_failures = True
+        mock_read_excel.return_value = pl.DataFrame({"BRnum": [1, 2, 3], "Pdf_URL": ["url1", "url2", "url3"], "Report Html Address": ["html1", "html2", "html3"]})
+
+        # Act
+        file_data, meta_data = self.handler.import_data_files()
+
+        # Assert only the recoverable and new rows are queued
+        self.assertEqual(file_data["BRnum"].to_list(), ["3", "2"])
+
+    @patch("polars.read_excel")
+    def test_rows_are_prioritized(self, mock_read_excel):
+        # Arrange two failed rows with known sizes and one without
+        self.handler.add_download_status((1, "no"), {"failure": "slow", "attempts": 1, "content_length": 900})
+        self.handler.add_download_status((2, "no"), {"failure": "slow", "attempts": 1, "content_length": 100})
+        self.handler.add_download_status((3, "no"), {"failure": "connect", "attempts": 3})
+        self.handler.journal.close()
+        mock_read_excel.return_value = pl.DataFrame(
+            {"BRnum": [1, 2, 3, 4], "Pdf_URL": ["url1", "url2", "url3", "url4"], "Report Html Address": ["html1", "html2", "html3", "html4"]}
+        )
+
+        # Act
+        prioritized, _ = self.handler.import_data_files()
+        self.handler.prioritize = False
+        unordered, _ = self.handler.import_data_files()
+
+        # Assert the new row comes first and the largest failed file last
+        self.assertEqual(prioritized["BRnum"].to_list(), ["4", "3", "2", "1"])
+        self.assertEqual(unordered["BRnum"].to_list(), ["1", "2", "3", "4"])
+
+
 # class TestFileHandlerThreadDownloader(unittest.TestCase):
 #    def setUp(self):
 #        try:
@@ -0,0 +1,79 @@
+import unittest
+import sys
+import os
+import io
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Downloader import DownloadResult
+from Download_Metrics import DownloadMetrics
+from Progress_Reporter import ProgressReporter, format_duration
+
+
+class TtyStream(io.StringIO):
+    def isatty(self):
+        return True
+
+
+class TestProgressReporter(unittest.TestCase):
+    def setUp(self):
+        self.metrics = DownloadMetrics()
+        self.metrics.queue_depth = lambda: 3
+        for success in (True, False):
+            result = DownloadResult()
+            result.success = success
+            result.bytes_received = 1024 * 1024
+            self.metrics.finished("id", result, self.metrics.started())
+        self.metrics.started()
+
+    def test_line_shows_counts_and_eta(self):
+        # Arrange
+        reporter = ProgressReporter(self.metrics)
+        reporter.total = 10
+
+        # Act
+        line = reporter.line(self.metrics.snapshot())
+
+        # Assert
+        self.assertIn("2/10 done (1 ok, 1 failed), 1 in flight, 3 queued", line)
+        self.assertNotIn("ETA ?", line)
+
+    def test_eta_unknown_without_total(self):
+        # Act
+        line = ProgressReporter(self.metrics).line(self.metrics.snapshot())
+
+        # Assert
+        self.assertIn("2 done", line)
+        self.assertIn("ETA ?", line)
+
+    def test_terminal_line_is_overwritten(self):
+        # Arrange
+        stream = TtyStream()
+        reporter = ProgressReporter(self.metrics, interval=3600, count_rows=lambda: 5, stream=stream)
+
+        # Act
+        reporter.start()
+        reporter.stop()
+
+        # Assert the rows were counted on the reporter thread and the final line ends the terminal line
+        self.assertEqual(reporter.total, 5)
+        self.assertTrue(stream.getvalue().startswith("\r"))
+        self.assertTrue(stream.getvalue().endswith("\n"))
+
+    def test_log_when_not_a_terminal(self):
+        # Arrange
+        reporter = ProgressReporter(self.metrics, stream=io.StringIO())
+
+        # Act
+        with self.assertLogs("Progress_Reporter", level="INFO") as logs:
+            reporter.report()
+
+        # Assert
+        self.assertIn("2 done", logs.output[0])
+
+    def test_format_duration(self):
+        self.assertEqual(format_duration(3725), "1:02:05")
+        self.assertEqual(format_duration(None), "?")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+from unittest.mock import patch
+import json
+import sys
+import os
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Redirect_Cache import RedirectCache
+
+
+class TestRedirectCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "meta.redirects.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_resolves_recorded_redirects(self):
+        # Arrange
+        cache = RedirectCache()
+
+        # Act
+        cache.record("http://short/a", "http://cdn/a.pdf")
+        cache.record("http://same", "http://same")
+
+        # Assert
+        self.assertEqual(cache.resolve("http://short/a"), "http://cdn/a.pdf")
+        self.assertEqual(cache.resolve("http://same"), "http://same")
+        self.assertEqual(cache.hits, 1)
+
+    def test_entries_expire(self):
+        # Arrange
+        cache = RedirectCache(ttl=60)
+        with patch("Redirect_Cache.time.time", return_value=1000.0):
+            cache.record("http://short/a", "http://cdn/a.pdf")
+
+        # Act
+        with patch("Redirect_Cache.time.time", return_value=1061.0):
+            resolved = cache.resolve("http://short/a")
+
+        # Assert
+        self.assertEqual(resolved, "http://short/a")
+
+    def test_saved_entries_are_loaded_by_the_next_run(self):
+        # Arrange
+        cache = RedirectCache(self.path)
+        cache.record("http://short/a", "http://cdn/a.pdf")
+        cache.record("http://short/b", "http://cdn/b.pdf")
+        cache.save()
+
+        # Act
+        later = RedirectCache(self.path)
+        later.load()
+
+        # Assert
+        self.assertEqual(later.resolve("http://short/a"), "http://cdn/a.pdf")
+        self.assertEqual(later.resolve("http://short/b"), "http://cdn/b.pdf")
+
+    def test_save_keeps_entries_of_other_processes_but_not_forgotten_ones(self):
+        # Arrange two caches saving to the same file, like two shards
+        first = RedirectCache(self.path)
+        second = RedirectCache(self.path)
+        first.record("http://short/a", "http://cdn/a.pdf")
+        first.record("http://short/b", "http://cdn/b.pdf")
+        first.save()
+        second.load()
+        second.forget("http://short/b")
+        second.record("http://short/c", "http://cdn/c.pdf")
+
+        # Act
+        second.save()
+
+        # Assert
+        with open(self.path, encoding="utf-8") as file:
+            self.assertEqual(sorted(json.load(file)), ["http://short/a", "http://short/c"])
+
+    def test_unreadable_file_is_ignored(self):
+        # Arrange
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("{torn")
+        cache = RedirectCache(self.path)
+
+        # Act
+        with self.assertLogs("Redirect_Cache", level="WARNING"):
+            cache.load()
+
+        # Assert
+        self.assertEqual(cache.entries, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
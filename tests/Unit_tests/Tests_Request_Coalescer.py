@@ -0,0 +1,68 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Request_Coalescer import RequestCoalescer
+
+
+class TestRequestCoalescer(unittest.TestCase):
+    def test_first_row_of_a_key_leads(self):
+        # Arrange
+        coalescer = RequestCoalescer()
+
+        # Act & Assert
+        self.assertEqual(coalescer.claim(("a", None), "1"), ("lead", None))
+        self.assertEqual(coalescer.claim(("b", None), "2"), ("lead", None))
+        self.assertEqual(coalescer.complete("1", ("yes", {})), [])
+        self.assertEqual((coalescer.leaders, coalescer.followers), ({"2": ("b", None)}, {("b", None): []}))
+
+    def test_followers_share_the_outcome_of_the_leader(self):
+        # Arrange
+        coalescer = RequestCoalescer()
+
+        # Act
+        lead = coalescer.claim(("a", None), "1")
+        follow = coalescer.claim(("a", None), "2")
+        followers = coalescer.complete("1", ("yes", {"path": "1.pdf"}))
+        done = coalescer.claim(("a", None), "3")
+
+        # Assert nothing is in flight any more, only the outcome is kept for rows that come later
+        self.assertEqual(lead, ("lead", None))
+        self.assertEqual(follow, ("follow", None))
+        self.assertEqual(followers, ["2"])
+        self.assertEqual(done, ("done", ("yes", {"path": "1.pdf"})))
+        self.assertEqual(coalescer.coalesced, 2)
+        self.assertEqual((coalescer.followers, coalescer.leaders), ({}, {}))
+
+    def test_only_the_latest_outcomes_are_kept(self):
+        # Arrange
+        coalescer = RequestCoalescer(max_finished=2)
+        for index, key in enumerate(["a", "b", "c"]):
+            coalescer.claim(key, str(index))
+            coalescer.complete(str(index), ("yes", {"path": f"{index}.pdf"}))
+
+        # Act
+        dropped = coalescer.claim("a", "3")
+        kept = coalescer.claim("c", "4")
+
+        # Assert the oldest outcome was dropped, so its key is downloaded again
+        self.assertEqual(dropped, ("lead", None))
+        self.assertEqual(kept, ("done", ("yes", {"path": "2.pdf"})))
+        self.assertEqual(list(coalescer.finished), ["b", "c"])
+
+    def test_a_leader_that_never_finishes_leaves_its_followers_unrecorded(self):
+        # Arrange
+        coalescer = RequestCoalescer()
+
+        # Act
+        coalescer.claim(("a", "b"), "1")
+        role, _ = coalescer.claim(("a", "b"), "2")
+
+        # Assert
+        self.assertEqual(role, "follow")
+        self.assertEqual(coalescer.complete("2", ("no", {})), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
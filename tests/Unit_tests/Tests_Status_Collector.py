@@ -0,0 +1,62 @@
+import unittest
+import polars as pl
+import sys
+import os
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Status_Collector import StatusCollector
+
+
+class TestStatusCollector(unittest.TestCase):
+    def test_statuses_become_columns(self):
+        # Arrange
+        collector = StatusCollector()
+
+        # Act
+        collector.add("id1", True, 2048, 0.5)
+        collector.add("id2", False)
+        frame = collector.frame("BRnum")
+
+        # Assert
+        self.assertEqual(frame.columns, ["BRnum", "pdf_downloaded", "bytes", "seconds"])
+        self.assertEqual(frame.schema["bytes"], pl.Int64)
+        self.assertEqual(frame.rows(), [("id1", "yes", 2048, 0.5), ("id2", "no", 0, 0.0)])
+        self.assertEqual(collector.rows(), [("id1", "yes"), ("id2", "no")])
+
+    def test_every_thread_appends_to_its_own_buffer(self):
+        # Arrange
+        collector = StatusCollector()
+
+        def record(worker):
+            for index in range(100):
+                collector.add(f"{worker}-{index}", index % 2 == 0, index)
+
+        threads = [threading.Thread(target=record, args=(worker,)) for worker in range(4)]
+
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        frame = collector.frame("BRnum")
+
+        # Assert
+        self.assertEqual(len(collector.buffers), 4)
+        self.assertEqual(len(collector), 400)
+        self.assertEqual(frame.height, 400)
+        self.assertEqual(frame["BRnum"].n_unique(), 400)
+        self.assertEqual(frame.filter(pl.col("pdf_downloaded") == "yes").height, 200)
+        self.assertEqual(frame["bytes"].sum(), 4 * sum(range(100)))
+
+    def test_empty_collector(self):
+        # Act
+        frame = StatusCollector().frame("BRnum")
+
+        # Assert
+        self.assertTrue(frame.is_empty())
+        self.assertEqual(len(StatusCollector()), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Status_Journal import StatusJournal
+
+
+class TestStatusJournal(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "status.jsonl")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_missing_journal(self):
+        # Arrange
+        journal = StatusJournal(self.path)
+
+        # Act
+        result = journal.read("BRnum")
+
+        # Assert reading does not create the file
+        self.assertTrue(result.is_empty())
+        self.assertFalse(journal.exists())
+
+    def test_latest_record_wins(self):
+        # Arrange
+        journal = StatusJournal(self.path)
+        journal.append({"BRnum": "id1", "pdf_downloaded": "no"})
+        journal.append_many([{"BRnum": "id2", "pdf_downloaded": "no"}, {"BRnum": "id1", "pdf_downloaded": "yes"}])
+        journal.close()
+
+        # Act
+        result = journal.read("BRnum")
+
+        # Assert
+        self.assertEqual(sorted(result.rows()), [("id1", "yes"), ("id2", "no")])
+
+    def test_torn_last_line_is_skipped(self):
+        # Arrange
+        # Simulates a crash in the middle of writing the last record
+        with open(self.path, "w") as file:
+            file.write('{"BRnum": "id1", "pdf_downloaded": "yes"}\n{"BRnum": "id2", "pdf_dow')
+        journal = StatusJournal(self.path)
+
+        # Act
+        result = journal.read("BRnum")
+
+        # Assert
+        self.assertEqual(result.rows(), [("id1", "yes")])
+
+    def test_fsync_is_batched(self):
+        # Arrange
+        journal = StatusJournal(self.path, fsync_every=3, fsync_interval=3600)
+
+        # Act
+        journal.append({"BRnum": "id1", "pdf_downloaded": "yes"})
+        journal.append({"BRnum": "id2", "pdf_downloaded": "yes"})
+        journal.flush()
+        pending = journal.unsynced
+        with open(self.path) as file:
+            written = len(file.readlines())
+        journal.append({"BRnum": "id3", "pdf_downloaded": "yes"})
+        journal.flush()
+
+        # Assert every record was written as it arrived, but only synced once three were waiting
+        self.assertEqual((written, pending), (2, 2))
+        self.assertEqual(journal.unsynced, 0)
+        journal.close()
+
+    def test_records_from_many_threads_are_written_by_one_writer(self):
+        # Arrange
+        journal = StatusJournal(self.path, fsync_every=None, fsync_interval=None)
+
+        def record(start):
+            for index in range(start, start + 250):
+                journal.append({"BRnum": f"id{index}", "pdf_downloaded": "yes"})
+
+        threads = [threading.Thread(target=record, args=(start,)) for start in range(0, 1000, 250)]
+
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer = journal.writer
+        journal.close()
+
+        # Assert every record arrived whole, and closing stopped the writer
+        self.assertEqual(journal.read("BRnum").height, 1000)
+        self.assertFalse(writer.is_alive())
+        self.assertIsNone(journal.writer)
+
+    def test_idle_journal_is_synced_after_the_interval(self):
+        # Arrange
+        journal = StatusJournal(self.path, fsync_every=100, fsync_interval=0.05)
+
+        # Act
+        journal.append({"BRnum": "id1", "pdf_downloaded": "yes"})
+        journal.flush()
+        deadline = time.monotonic() + 2
+        while journal.unsynced and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # Assert
+        self.assertEqual(journal.unsynced, 0)
+        journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
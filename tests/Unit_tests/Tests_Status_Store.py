@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+import tempfile
+import polars as pl
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../src")))
+from Status_Store import StatusStore
+
+
+class TestStatusStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = StatusStore(os.path.join(self.temp_dir.name, "meta.status"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_missing_store(self):
+        # Act
+        result = self.store.read("BRnum")
+
+        # Assert reading does not create the directory
+        self.assertTrue(result.is_empty())
+        self.assertFalse(os.path.exists(self.store.path))
+
+    def test_later_part_wins(self):
+        # Arrange
+        self.store.append(pl.DataFrame({"BRnum": ["id1", "id2"], "pdf_downloaded": ["no", "no"]}), "BRnum")
+        self.store.append(pl.DataFrame({"BRnum": ["id1"], "pdf_downloaded": ["yes"], "sha256": ["abc"]}), "BRnum")
+
+        # Act
+        result = self.store.read("BRnum")
+
+        # Assert every part has the full schema and the latest status is kept
+        self.assertEqual(len(self.store.parts()), 2)
+        self.assertIn("etag", result.columns)
+        self.assertEqual(sorted(result.select("BRnum", "pdf_downloaded").rows()), [("id1", "yes"), ("id2", "no")])
+
+    def test_read_with_predicate(self):
+        # Arrange
+        self.store.append(pl.DataFrame({"BRnum": ["id1", "id2"], "pdf_downloaded": ["yes", "no"], "failure": [None, "http_4xx"]}), "BRnum")
+
+        # Act
+        result = self.store.read("BRnum", pl.col("pdf_downloaded") == "no")
+
+        # Assert
+        self.assertEqual(result.select("BRnum", "failure").rows(), [("id2", "http_4xx")])
+
+    def test_compact(self):
+        # Arrange
+        self.store.append(pl.DataFrame({"BRnum": ["id1"], "pdf_downloaded": ["no"]}), "BRnum")
+        self.store.append(pl.DataFrame({"BRnum": ["id1"], "pdf_downloaded": ["yes"]}), "BRnum")
+
+        # Act
+        self.store.compact("BRnum")
+
+        # Assert
+        self.assertEqual(len(self.store.parts()), 1)
+        self.assertEqual(self.store.read("BRnum").select("BRnum", "pdf_downloaded").rows(), [("id1", "yes")])
+
+
+if __name__ == "__main__":
+    unittest.main()